@@ -1,8 +1,14 @@
-from django.contrib import admin
+import io
+
+from django.contrib import admin, messages
 from django import forms
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import Product, Customer, AISettings, Payment, Promotion
+from .product_import import ProductImporter, detect_format, iter_rows
 
 class CustomerCreationAdminForm(forms.ModelForm):
     password1 = forms.CharField(label="Password", widget=forms.PasswordInput)
@@ -56,11 +62,59 @@ class CustomerAdmin(BaseUserAdmin):
         }),
     )
 
+class ProductImportForm(forms.Form):
+    file = forms.FileField(label="ไฟล์สินค้า (.csv / .jsonl / .json)")
+    update_existing = forms.BooleanField(label="อัปเดตสินค้าที่รหัสมีอยู่แล้ว", required=False, initial=True)
+    dry_run = forms.BooleanField(label="ตรวจข้อมูลอย่างเดียว (ไม่บันทึก)", required=False)
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ("name", "price", "image_url", "updated_at")
     search_fields = ("name",)
     list_filter = ("created_at",)
+    change_list_template = "admin/aicashier/product/change_list.html"
+
+    def get_urls(self):
+        urls = [
+            path("import/", self.admin_site.admin_view(self.import_view), name="aicashier_product_import"),
+        ]
+        return urls + super().get_urls()
+
+    def import_view(self, request):
+        """อัปโหลดไฟล์เพื่อนำเข้าสินค้าจำนวนมาก (index RAG ทำเบื้องหลังหลังบันทึก)"""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        stats = None
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            upload = form.cleaned_data["file"]
+            importer = ProductImporter(
+                update_existing=form.cleaned_data["update_existing"],
+                dry_run=form.cleaned_data["dry_run"],
+            )
+            try:
+                text_stream = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+                stats = importer.run(iter_rows(text_stream, detect_format(upload.name)))
+                self.message_user(
+                    request,
+                    f"นำเข้า {stats['rows']} แถว: สร้าง {stats['created']}, อัปเดต {stats['updated']}, "
+                    f"ผิดพลาด {len(stats['errors'])} ({stats['rows_per_sec']:.0f} แถว/วินาที)",
+                    messages.WARNING if stats["errors"] else messages.SUCCESS,
+                )
+            except (UnicodeDecodeError, ValueError) as e:
+                self.message_user(request, f"อ่านไฟล์ไม่สำเร็จ: {e}", messages.ERROR)
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "นำเข้าสินค้า",
+            "form": form,
+            "stats": stats,
+            "errors": stats["errors"][:200] if stats else [],
+        }
+        return TemplateResponse(request, "admin/aicashier/product/import.html", context)
 
 
 @admin.register(Promotion)
@@ -0,0 +1,296 @@
+"""
+คำตอบสำเร็จรูปสำหรับคำถามที่ถามบ่อย
+
+- pregenerate_answers (รันช่วงร้านว่าง) จัดกลุ่มคำถามล่าสุดด้วย embedding
+  แล้วให้ LLM ตอบกลุ่มที่ถูกถามมากที่สุด + คำทักทาย/แนะนำสินค้าเด่น
+- ตอนมีคำถามเข้ามา ถ้าตรงกับกลุ่ม (ข้อความเหมือนกัน หรือ cosine >= MATCH_THRESHOLD) ตอบทันที
+- คำตอบผูกกับ catalog version + settings version ถ้าสินค้า/สต็อก/AISettings เปลี่ยน คำตอบเดิมจะไม่ถูกใช้
+  (catalog version = เลขใน CatalogVersion ที่ signal / checkout เพิ่มให้ - hash ทั้ง catalog เฉพาะตอน pregenerate)
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.apps import apps
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .circuit_breaker import CircuitOpenError
+from .llm_scheduler import BACKGROUND, LLMOverloaded
+from .index_snapshot import compute_catalog_version, get_db_content_hashes
+from .models import AISettings, CatalogVersion, Product, PregeneratedAnswer
+
+logger = logging.getLogger(__name__)
+
+PITCH_KEY = 'pitch'
+PITCH_QUERY = 'สวัสดี วันนี้มีอะไรแนะนำบ้าง'
+CLUSTER_THRESHOLD = 0.85
+MATCH_THRESHOLD = 0.88
+VERSION_TTL = 30  # วินาที - ตรวจ version ใหม่อย่างน้อยทุก ๆ เท่านี้ (signal ล้างให้ทันทีใน process เดียวกัน)
+
+_POLITE_SUFFIX = re.compile(r'(ครับ|ค่ะ|คะ|คับ|จ้า|จ้ะ|นะ|หน่อย)+$')
+
+_lock = threading.Lock()
+_state = {
+    'versions': None,
+    'checked_at': 0.0,
+    'loaded_versions': None,
+    'exact': {},
+    'answers': [],
+    'matrix': None,
+}
+
+
+def normalize_query(text):
+    text = " ".join((text or "").lower().split())
+    text = text.strip(" ?!.")
+    return _POLITE_SUFFIX.sub('', text).strip()
+
+
+# ===== Versions =====
+def get_settings_version():
+    ai_settings = AISettings.get_settings()
+    raw = "\x1f".join(str(value) for value in [
+        ai_settings.is_active,
+        ai_settings.greeting_message,
+        ai_settings.promotion_text,
+        ai_settings.sales_steps,
+        ai_settings.closing_message,
+        ai_settings.featured_item_1_id,
+        ai_settings.featured_item_2_id,
+        ai_settings.featured_item_3_id,
+        ai_settings.featured_item_4_id,
+    ])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def get_catalog_version():
+    """เลข version ของ catalog (อ่านแถวเดียว) - signal ของสินค้า/หมวดหมู่ และ checkout ที่ทำให้สินค้าหมดเพิ่มให้"""
+    return str(CatalogVersion.current())
+
+
+def get_content_version():
+    """hash ของข้อมูลสินค้าที่ embed + สินค้าที่มีของ (คำตอบบอกว่าอะไรหมด) - อ่านทั้ง catalog ใช้เฉพาะงาน offline"""
+    content_version = compute_catalog_version(get_db_content_hashes())
+    in_stock = Product.objects.filter(quantity__gt=0).order_by('id').values_list('id', flat=True)
+    raw = content_version + ":" + ",".join(str(pid) for pid in in_stock)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def current_versions(force=False):
+    with _lock:
+        if not force and _state['versions'] and time.monotonic() - _state['checked_at'] < VERSION_TTL:
+            return _state['versions']
+    versions = (get_catalog_version(), get_settings_version())
+    with _lock:
+        _state['versions'] = versions
+        _state['checked_at'] = time.monotonic()
+    return versions
+
+
+def invalidate_versions():
+    """เรียกจาก signal เมื่อสินค้า/หมวด/AISettings เปลี่ยน"""
+    with _lock:
+        _state['checked_at'] = 0.0
+
+
+# ===== Serving =====
+def _ensure_loaded():
+    versions = current_versions()
+    if _state['loaded_versions'] == versions:
+        return
+
+    catalog_version, settings_version = versions
+    answers = list(PregeneratedAnswer.objects.filter(
+        catalog_version=catalog_version,
+        settings_version=settings_version
+    ).values('kind', 'query', 'variants', 'embedding', 'answer'))
+
+    exact = {}
+    for answer in answers:
+        for query in [answer['query']] + list(answer['variants'] or []):
+            exact.setdefault(normalize_query(query), answer)
+    with_embedding = [answer for answer in answers if answer['embedding']]
+    matrix = np.asarray([a['embedding'] for a in with_embedding], dtype=np.float32) if with_embedding else None
+
+    with _lock:
+        _state['exact'] = exact
+        _state['answers'] = with_embedding
+        _state['matrix'] = matrix
+        _state['loaded_versions'] = versions
+
+
+def find_answer(query, embeddings=None):
+    """คืนคำตอบสำเร็จรูปถ้าคำถามตรงกับกลุ่มที่สร้างไว้ (None ถ้าไม่มี)"""
+    try:
+        _ensure_loaded()
+        hit = _state['exact'].get(normalize_query(query))
+        matrix = _state['matrix']
+        if hit is None and matrix is not None and embeddings is not None:
+            vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            scores = matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= MATCH_THRESHOLD:
+                hit = _state['answers'][best]
+        return hit['answer'] if hit else None
+    except Exception as e:
+        logger.error(f"Error looking up pregenerated answer: {e}")
+        return None
+
+
+def get_pitch():
+    return find_answer(PITCH_QUERY)
+
+
+# ===== Pregeneration =====
+def get_recent_query_counts(days=30, limit=1000):
+    """[(query, count)] จาก log แชท (ถ้ายังไม่มีตาราง log คืนค่าว่าง)"""
+    try:
+        ChatLog = apps.get_model('aicashier', 'ChatLog')
+    except LookupError:
+        return []
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rows = (
+        ChatLog.objects.filter(log_date__gte=since)
+        .values('user_query')
+        .annotate(count=Count('id'))
+        .order_by('-count')[:limit]
+    )
+    return [(row['user_query'], row['count']) for row in rows if (row['user_query'] or '').strip()]
+
+
+def cluster_queries(query_counts, embeddings, threshold=CLUSTER_THRESHOLD):
+    """จัดกลุ่มแบบ greedy ตาม threshold - คำถามที่ถามบ่อยเป็นตัวแทนกลุ่ม (ใช้เมื่อยังไม่มีผลจาก cluster_queries)
+
+    query_counts: [(query, count)] เรียงจากมากไปน้อย
+    """
+    if not query_counts:
+        return []
+    vectors = np.asarray(embeddings.embed_documents([q for q, _ in query_counts]), dtype=np.float32)
+    vectors /= np.where(np.linalg.norm(vectors, axis=1, keepdims=True) == 0, 1,
+                        np.linalg.norm(vectors, axis=1, keepdims=True))
+
+    clusters = []
+    centroids = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+    for (query, count), vector in zip(query_counts, vectors):
+        if len(clusters):
+            scores = centroids @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= threshold:
+                cluster = clusters[best]
+                cluster['variants'].append(query)
+                cluster['count'] += count
+                cluster['sum'] += vector * count
+                centroids[best] = cluster['sum'] / (np.linalg.norm(cluster['sum']) or 1.0)
+                continue
+        clusters.append({'query': query, 'variants': [], 'count': count, 'sum': vector * count})
+        centroids = np.vstack([centroids, vector])
+
+    for cluster, centroid in zip(clusters, centroids):
+        cluster['embedding'] = centroid.tolist()
+        del cluster['sum']
+    return sorted(clusters, key=lambda c: -c['count'])
+
+
+def get_precomputed_clusters(days=30, limit=10):
+    """กลุ่มคำถามยอดนิยมจาก cluster_queries ในรูปแบบเดียวกับ cluster_queries()"""
+    from .query_clustering import get_top_clusters
+    from .models import QueryCluster
+
+    top_clusters, _ = get_top_clusters(days=days, limit=limit)
+    by_id = QueryCluster.objects.in_bulk([row['cluster_id'] for row in top_clusters])
+    clusters = []
+    for row in top_clusters:
+        cluster = by_id.get(row['cluster_id'])
+        if cluster:
+            clusters.append({
+                'query': cluster.label,
+                'variants': [v for v in cluster.variants if v != cluster.label],
+                'count': row['count'],
+                'embedding': cluster.centroid,
+            })
+    return clusters
+
+
+def _cluster_key(query):
+    return hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()[:16]
+
+
+def pregenerate_answers(rag, max_clusters=10, days=30, threshold=CLUSTER_THRESHOLD, delay=2.0, log=print):
+    """สร้างคำตอบสำหรับกลุ่มคำถามยอดนิยม + pitch ผ่าน LLM (ทีละรายการ เว้นระยะกัน rate limit)"""
+    catalog_version, settings_version = current_versions(force=True)
+    content_version = get_content_version()
+
+    clusters = get_precomputed_clusters(days, max_clusters)
+    if not clusters:
+        # ยังไม่เคยรัน cluster_queries - จัดกลุ่มจาก log โดยตรง
+        clusters = cluster_queries(get_recent_query_counts(days), rag.embeddings, threshold)[:max_clusters]
+    pitch_embedding = rag.embeddings.embed_query(PITCH_QUERY)
+    pitch_embedding = (np.asarray(pitch_embedding) / (np.linalg.norm(pitch_embedding) or 1.0)).tolist()
+    jobs = [{
+        'key': PITCH_KEY, 'kind': 'pitch', 'query': PITCH_QUERY,
+        'variants': [], 'count': 0, 'embedding': pitch_embedding,
+    }] + [{'key': _cluster_key(c['query']), 'kind': 'faq', **c} for c in clusters]
+
+    generated = 0
+    keep_keys = []
+    for i, job in enumerate(jobs):
+        keep_keys.append(job['key'])
+        existing = PregeneratedAnswer.objects.filter(
+            Q(catalog_version=catalog_version) | Q(content_version=content_version),
+            cluster_key=job['key'], settings_version=settings_version
+        ).first()
+        if existing:
+            # คำตอบยังใช้ได้ (version เดิม หรือ version เปลี่ยนแต่เนื้อหาสินค้าเหมือนเดิม) - อัปเดตแค่สถิติของกลุ่ม
+            existing.variants = job['variants']
+            existing.query_count = job['count']
+            existing.embedding = job['embedding']
+            existing.catalog_version = catalog_version
+            existing.content_version = content_version
+            existing.save(update_fields=[
+                'variants', 'query_count', 'embedding', 'catalog_version', 'content_version', 'updated_at'
+            ])
+            continue
+
+        if generated and delay:
+            time.sleep(delay)
+        try:
+            answer = rag.rag_query(
+                job['query'], conversation_history=[], allow_fallback=False, priority=BACKGROUND
+            )
+        except (CircuitOpenError, LLMOverloaded) as e:
+            log(f"   ✗ หยุดสร้างคำตอบ: {e}")
+            # กลุ่มที่ยังไม่ได้ทำ เก็บคำตอบเดิมไว้
+            keep_keys.extend(j['key'] for j in jobs[i + 1:])
+            break
+        if not answer or str(answer).startswith('เกิดข้อผิดพลาด'):
+            log(f"   ✗ สร้างคำตอบไม่สำเร็จ: {job['query'][:40]}")
+            continue
+
+        PregeneratedAnswer.objects.update_or_create(
+            cluster_key=job['key'],
+            defaults={
+                'kind': job['kind'],
+                'query': job['query'][:500],
+                'variants': job['variants'],
+                'embedding': job['embedding'],
+                'answer': str(answer),
+                'query_count': job['count'],
+                'catalog_version': catalog_version,
+                'content_version': content_version,
+                'settings_version': settings_version,
+            }
+        )
+        generated += 1
+        log(f"   ✓ ({i + 1}/{len(jobs)}) {job['query'][:40]} [{job['count']} ครั้ง]")
+
+    # กลุ่มที่ไม่ติดอันดับแล้ว
+    removed, _ = PregeneratedAnswer.objects.exclude(cluster_key__in=keep_keys).delete()
+    invalidate_versions()
+    return {'clusters': len(clusters), 'generated': generated, 'removed': removed}
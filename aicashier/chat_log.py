@@ -0,0 +1,118 @@
+"""
+บันทึก log การคุยกับ AI แบบ buffer (ไม่มี INSERT ใน request)
+
+request แค่ใส่ ChatLog เข้า buffer ในหน่วยความจำ
+thread เบื้องหลังเขียนด้วย bulk_create เมื่อครบ batch_size หรือทุก flush_interval วินาที
+ถ้าเขียนไม่สำเร็จจะเก็บไว้ลองใหม่ (เกิน max_buffer จะทิ้งรายการเก่าสุด)
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import ChatLog, Customer
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 3  # ประมาณการสำหรับข้อความไทยปนอังกฤษ (LLM client ไม่คืน usage)
+
+
+def estimate_tokens(text):
+    return (len(text or '') + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class ChatLogWriter:
+
+    def __init__(self, batch_size=100, flush_interval=5.0, max_buffer=5000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = deque(maxlen=max_buffer)
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    def log(self, **fields):
+        """ใส่ log เข้า buffer (ไม่แตะ DB)"""
+        created_at = fields.pop('created_at', None) or timezone.now()
+        entry = ChatLog(created_at=created_at, log_date=timezone.localdate(created_at), **fields)
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                logger.warning("Chat log buffer full, dropping oldest entry")
+            self._buffer.append(entry)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='chat-log-writer', daemon=True)
+            self._thread.start()
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._buffer)
+
+    def flush(self):
+        """เขียนทุกอย่างที่ค้างใน buffer - คืนจำนวนที่เขียนได้"""
+        written = 0
+        with self._write_lock:
+            while True:
+                with self._cond:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    return written
+                try:
+                    ChatLog.objects.bulk_create(batch, batch_size=self.batch_size)
+                    written += len(batch)
+                except Exception as e:
+                    logger.error(f"Error writing {len(batch)} chat logs: {e}")
+                    with self._cond:
+                        # ใส่กลับหน้า buffer แล้วรอรอบหน้า
+                        self._buffer.extendleft(reversed(batch))
+                    return written
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._buffer) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                written = self.flush()
+                if written:
+                    print(f"[ChatLog] Wrote {written} entries")
+            finally:
+                connection.close()
+
+
+chat_log_writer = ChatLogWriter()
+atexit.register(chat_log_writer.flush)
+
+
+def log_interaction(request, channel, user_query, ai_response='', started=None, stages=None,
+                    source='llm', cart_action='', intent=''):
+    """บันทึกการคุย 1 ครั้งจาก view - ไม่ให้ error ของ log กระทบ response"""
+    try:
+        stages = dict(stages or {})
+        user = getattr(request, 'user', None)
+        chat_log_writer.log(
+            customer=user if isinstance(user, Customer) else None,
+            session_key=(request.session.session_key or '') if hasattr(request, 'session') else '',
+            channel=channel,
+            user_query=user_query,
+            ai_response=str(ai_response or ''),
+            source=source,
+            cart_action=cart_action or '',
+            intent=intent or '',
+            total_ms=int((time.perf_counter() - started) * 1000) if started else 0,
+            prompt_tokens=stages.pop('prompt_tokens', 0),
+            completion_tokens=stages.pop('completion_tokens', estimate_tokens(ai_response) if source == 'llm' else 0),
+            stage_latencies=stages,
+        )
+    except Exception as e:
+        logger.error(f"Error logging chat interaction: {e}")
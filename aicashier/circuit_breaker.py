@@ -0,0 +1,182 @@
+"""
+Circuit breaker สำหรับเรียก LLM (Gemini)
+
+- closed: เรียกได้ตามปกติ เก็บผลของการเรียกล่าสุด window_size ครั้ง
+  ถ้า error หรือช้าเกิน slow_call_ms เกินสัดส่วนที่กำหนด (หรือโดน 429) จะเปิดวงจร
+- open: ไม่เรียก LLM เลย raise CircuitOpenError ทันที ให้ผู้เรียกใช้คำตอบสำรองแทน
+- half_open: ครบ open_seconds แล้วปล่อยให้ลองเรียกทีละ half_open_probes ครั้ง
+  สำเร็จ -> closed, ล้มเหลว/ช้า -> open อีกรอบ
+  probe ที่ค้างเกิน slow_call_ms ถือว่าช้า -> open (ไม่รอจนกว่าจะจบ)
+จำนวนการเปลี่ยนสถานะดูได้ที่ /api/ai/route-stats/
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """วงจรเปิดอยู่ - ไม่ได้เรียก LLM"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit is open (retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_rate_limit_error(error):
+    text = str(error)
+    return '429' in text or 'ResourceExhausted' in type(error).__name__ or 'quota' in text.lower()
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, window_size=20, min_calls=5, failure_rate=0.5, slow_call_ms=6000,
+                 slow_call_rate=0.5, open_seconds=30, half_open_probes=1, clock=time.monotonic):
+        self.name = name
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_ms = slow_call_ms
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_started = 0.0
+        self._epoch = 0  # เพิ่มทุกครั้งที่เปลี่ยนสถานะ - probe จากรอบก่อนที่เพิ่งจบจะไม่ถูกนับ
+        self._results = deque(maxlen=window_size)  # (failed, slow)
+        self._transitions = Counter()
+        self._rejected = 0
+        self._last_reason = ''
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def _refresh(self):
+        # เรียกขณะถือ lock
+        if self._state == OPEN and self.clock() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, 'cool-down elapsed')
+        elif (self._state == HALF_OPEN and self._probes
+                and (self.clock() - self._probe_started) * 1000 >= self.slow_call_ms):
+            self._transition(OPEN, f'probe timed out ({self.slow_call_ms}ms)')
+
+    def _transition(self, state, reason):
+        # เรียกขณะถือ lock
+        previous = self._state
+        self._state = state
+        self._last_reason = reason
+        self._transitions[f"{previous}->{state}"] += 1
+        self._probes = 0
+        self._epoch += 1
+        if state == OPEN:
+            self._opened_at = self.clock()
+        if state == CLOSED:
+            self._results.clear()
+        logger.warning(f"Circuit {self.name}: {previous} -> {state} ({reason})")
+        print(f"[Circuit] {self.name}: {previous} -> {state} ({reason})")
+
+    def _reject(self):
+        # เรียกขณะถือ lock
+        self._rejected += 1
+        retry_after = max(0.0, self.open_seconds - (self.clock() - self._opened_at))
+        raise CircuitOpenError(self.name, retry_after)
+
+    def check(self):
+        """raise CircuitOpenError ถ้าวงจรเปิดอยู่ (ไม่ใช้โควต้า probe ของ half_open)"""
+        with self._lock:
+            self._refresh()
+            if self._state == OPEN:
+                self._reject()
+
+    def _acquire(self):
+        """คืน epoch ของรอบ half_open ถ้าการเรียกนี้เป็น probe, None ถ้าเป็นการเรียกปกติ"""
+        with self._lock:
+            self._refresh()
+            if self._state == CLOSED:
+                return None
+            if self._state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                self._probe_started = self.clock()
+                return self._epoch
+            self._reject()
+
+    def _record(self, probe, failed, elapsed_ms, rate_limited=False):
+        slow = elapsed_ms >= self.slow_call_ms
+        with self._lock:
+            if probe is not None:
+                if self._state != HALF_OPEN or probe != self._epoch:
+                    # probe ที่หมดเวลาไปแล้ว (วงจรเปิดอีกรอบ) - ไม่ต้องนับ
+                    return
+                if failed or slow:
+                    self._transition(OPEN, 'probe failed' if failed else f'probe slow ({elapsed_ms:.0f}ms)')
+                else:
+                    self._transition(CLOSED, 'probe succeeded')
+                return
+            if self._state != CLOSED:
+                # การเรียกที่เริ่มก่อนวงจรเปิด เพิ่งจบ - ไม่ต้องนับ
+                return
+
+            self._results.append((failed, slow))
+            if rate_limited:
+                self._transition(OPEN, 'rate limited')
+                return
+            calls = len(self._results)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for f, _ in self._results if f)
+            slow_calls = sum(1 for _, s in self._results if s)
+            if failures / calls >= self.failure_rate:
+                self._transition(OPEN, f'{failures}/{calls} calls failed')
+            elif slow_calls / calls >= self.slow_call_rate:
+                self._transition(OPEN, f'{slow_calls}/{calls} calls slower than {self.slow_call_ms}ms')
+
+    def call(self, fn, *args, **kwargs):
+        """เรียก fn ผ่าน breaker - วงจรเปิดอยู่จะ raise CircuitOpenError โดยไม่เรียก fn"""
+        probe = self._acquire()
+        started = self.clock()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._record(probe, True, (self.clock() - started) * 1000, rate_limited=is_rate_limit_error(e))
+            raise
+        self._record(probe, False, (self.clock() - started) * 1000)
+        return result
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            calls = len(self._results)
+            return {
+                'name': self.name,
+                'state': self._state,
+                'last_reason': self._last_reason,
+                'window_calls': calls,
+                'window_failures': sum(1 for f, _ in self._results if f),
+                'window_slow_calls': sum(1 for _, s in self._results if s),
+                'rejected': self._rejected,
+                'transitions': dict(self._transitions),
+            }
+
+
+llm_breaker = CircuitBreaker(
+    'gemini',
+    slow_call_ms=getattr(settings, 'AI_LLM_SLOW_CALL_MS', 6000),
+    open_seconds=getattr(settings, 'AI_LLM_CIRCUIT_OPEN_SECONDS', 30),
+)
@@ -0,0 +1,213 @@
+"""
+เก็บบทสนทนาฝั่ง server ตาม session (แทนการให้ browser ส่งประวัติทั้งหมดมาทุกครั้ง)
+
+- เก็บในตาราง ConversationState ทุก worker จึงเห็นบทสนทนาเดียวกัน หมดอายุตาม TTL
+- เก็บเฉพาะ turn ล่าสุด turn ที่เก่ากว่านั้นถูกย่อเป็น summary โดย LLM ใน thread เบื้องหลัง
+  prompt จึงมีขนาดคงที่ไม่ว่า session จะยาวแค่ไหน
+- ถ้าสรุปไม่ทัน / LLM ล่ม จะตัด turn เก่าทิ้งเมื่อเกิน max_turns
+- เก็บผล retrieval ล่าสุดของ session ไว้ให้คำถามต่อเนื่อง ("แล้วอันนี้ล่ะ") ใช้ซ้ำได้
+"""
+
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .circuit_breaker import llm_breaker
+from .llm_scheduler import BACKGROUND, llm_scheduler
+from .models import ConversationState
+
+logger = logging.getLogger(__name__)
+
+MAX_CONTENT_CHARS = 1000
+MAX_SUMMARY_CHARS = 1500
+# worker ที่กำลังสรุปตายกลางทาง - ให้สรุปใหม่ได้เมื่อเกินเวลานี้
+SUMMARY_TIMEOUT = timedelta(minutes=2)
+CLEANUP_PROBABILITY = 0.01
+
+
+def _summarize_with_llm(previous_summary, turns):
+    from .signals import get_rag_service
+
+    rag_service = get_rag_service()
+    if rag_service is None or not getattr(rag_service, 'llm', None):
+        raise RuntimeError("LLM not available")
+
+    lines = "\n".join(
+        f"{'ลูกค้า' if turn['role'] == 'user' else 'ร้าน'}: {turn['content']}" for turn in turns
+    )
+    prompt = f"""สรุปบทสนทนาระหว่างลูกค้ากับร้านให้สั้นที่สุด (ไม่เกิน 5 บรรทัด ภาษาไทย)
+เก็บเฉพาะสิ่งที่ต้องใช้คุยต่อ: สินค้าที่ลูกค้าสนใจ/สั่ง ความต้องการ และสิ่งที่ร้านแนะนำไปแล้ว
+
+สรุปก่อนหน้า:
+{previous_summary or '-'}
+
+บทสนทนาใหม่:
+{lines}
+
+สรุป:"""
+    # คิวลำดับต่ำสุด + circuit breaker - LLM ล่ม/คิวเต็มก็ไม่ต้องสรุป (turn เก่าจะถูกตัดทิ้งแทน)
+    return str(llm_scheduler.run(BACKGROUND, llm_breaker.call, rag_service.llm.invoke, prompt)).strip()
+
+
+class ConversationStore:
+
+    def __init__(self, ttl=30 * 60, keep_recent=6, summarize_after=10, max_turns=20,
+                 summarizer=_summarize_with_llm):
+        self.ttl = timedelta(seconds=ttl)
+        self.keep_recent = keep_recent
+        self.summarize_after = summarize_after
+        self.max_turns = max_turns
+        self.summarizer = summarizer
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='conversation-summary')
+
+    def _expired(self, state, now):
+        return now - state.updated_at > self.ttl
+
+    def _load(self, session_key):
+        state = ConversationState.objects.filter(session_key=session_key).first()
+        if state is None or self._expired(state, timezone.now()):
+            return None
+        return state
+
+    def _update(self, session_key, apply, touch=True, create=True):
+        """แก้ state ของ session ภายใต้ row lock (worker อื่นแก้พร้อมกันไม่ได้) - คืนค่าที่ apply คืน"""
+        now = timezone.now()
+        with transaction.atomic():
+            queryset = ConversationState.objects.select_for_update()
+            if create:
+                state, _ = queryset.get_or_create(session_key=session_key)
+            else:
+                state = queryset.filter(session_key=session_key).first()
+                if state is None:
+                    return None
+            if self._expired(state, now):
+                state.summary, state.turns, state.retrieval, state.summarizing_since = '', [], None, None
+            result = apply(state)
+            if touch:
+                state.updated_at = now
+            state.save()
+        return result
+
+    @staticmethod
+    def _turn(role, content, number):
+        return {
+            'n': number,
+            'role': 'user' if role == 'user' else 'assistant',
+            'content': str(content)[:MAX_CONTENT_CHARS],
+        }
+
+    @staticmethod
+    def _public(turns):
+        return [{'role': turn['role'], 'content': turn['content']} for turn in turns]
+
+    def get_context(self, session_key, seed_history=None):
+        """คืน (summary, turn ล่าสุด) - seed_history ใช้กับ client ที่ยังส่งประวัติมาเอง"""
+        state = self._load(session_key)
+        if state and (state.turns or state.summary):
+            return state.summary, self._public(state.turns)
+        if not seed_history:
+            return '', []
+
+        def seed(state):
+            if not state.turns and not state.summary:
+                for item in seed_history[-self.max_turns:]:
+                    if isinstance(item, dict) and item.get('content'):
+                        state.turn_count += 1
+                        state.turns.append(self._turn(item.get('role'), item['content'], state.turn_count))
+            return state.summary, self._public(state.turns)
+
+        return self._update(session_key, seed)
+
+    def append(self, session_key, user_message, ai_response):
+        def add_turns(state):
+            for role, content in (('user', user_message), ('assistant', ai_response)):
+                state.turn_count += 1
+                state.turns.append(self._turn(role, content, state.turn_count))
+            if len(state.turns) > self.max_turns:
+                # summary ตามไม่ทัน - ตัดของเก่าทิ้งเพื่อให้ขนาดยังคงที่
+                del state.turns[:len(state.turns) - self.max_turns]
+            return self._claim_summary(state)
+
+        self._submit(session_key, self._update(session_key, add_turns))
+
+        if random.random() < CLEANUP_PROBABILITY:
+            ConversationState.objects.filter(updated_at__lt=timezone.now() - self.ttl).delete()
+
+    def _claim_summary(self, state):
+        # เรียกขณะถือ row lock - คืนงานสรุปที่ต้องทำ (หรือ None)
+        now = timezone.now()
+        if len(state.turns) < self.summarize_after:
+            return None
+        if state.summarizing_since and now - state.summarizing_since < SUMMARY_TIMEOUT:
+            return None
+        state.summarizing_since = now
+        return state.summary, state.turns[:-self.keep_recent]
+
+    def _submit(self, session_key, job):
+        if job:
+            # เริ่มหลัง commit - thread สรุปต้องเห็น summarizing_since ที่บันทึกแล้ว
+            transaction.on_commit(lambda: self._executor.submit(self._summarize, session_key, *job))
+
+    def _summarize(self, session_key, previous_summary, old_turns):
+        try:
+            summary = self.summarizer(previous_summary, self._public(old_turns))[:MAX_SUMMARY_CHARS]
+            last_number = old_turns[-1]['n']
+
+            def apply_summary(state):
+                if not state.summarizing_since:
+                    # session ถูกล้าง / หมดอายุระหว่างสรุป
+                    return None
+                # ลบเฉพาะ turn ที่สรุปแล้ว (turn ใหม่ที่เข้ามาระหว่างนี้ยังอยู่)
+                state.turns = [turn for turn in state.turns if turn['n'] > last_number]
+                state.summary = summary
+                state.summarizing_since = None
+                # มี turn เข้ามาเพิ่มระหว่างสรุป - สรุปต่ออีกรอบ
+                return self._claim_summary(state)
+
+            self._submit(session_key, self._update(session_key, apply_summary, touch=False, create=False))
+            print(f"[Conversation] Summarized {len(old_turns)} turns for session {session_key[:8]}...")
+        except Exception as e:
+            logger.error(f"Error summarizing conversation: {e}")
+            try:
+                self._update(session_key, lambda state: setattr(state, 'summarizing_since', None),
+                             touch=False, create=False)
+            except Exception as reset_error:
+                logger.error(f"Error resetting summary flag: {reset_error}")
+        finally:
+            connection.close()
+
+    def get_retrieval(self, session_key, catalog_version):
+        """ผล retrieval ล่าสุดของ session (None ถ้าไม่มีหรือ catalog เปลี่ยนแล้ว)"""
+        state = self._load(session_key)
+        if not state or not state.retrieval or state.retrieval.get('catalog_version') != catalog_version:
+            return None
+        return state.retrieval['docs']
+
+    def set_retrieval(self, session_key, docs, catalog_version):
+        """docs ต้องเป็นข้อมูลที่แปลงเป็น JSON ได้"""
+        def apply(state):
+            state.retrieval = {'docs': list(docs), 'catalog_version': catalog_version}
+
+        self._update(session_key, apply)
+
+    def clear(self, session_key):
+        ConversationState.objects.filter(session_key=session_key).delete()
+
+    def stats(self):
+        return {
+            'sessions': ConversationState.objects.filter(updated_at__gte=timezone.now() - self.ttl).count(),
+        }
+
+
+conversation_store = ConversationStore()
+
+
+def get_conversation_key(request):
+    """session key ของ Django (สร้าง session ให้ถ้ายังไม่มี)"""
+    if not request.session.session_key:
+        request.session.save()
+    return request.session.session_key
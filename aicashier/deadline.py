@@ -0,0 +1,115 @@
+"""
+Deadline ต่อ request สำหรับ pipeline เสียง (ตะกร้า -> retrieval -> LLM)
+
+แต่ละขั้นได้ budget ของตัวเอง แต่ไม่เกินเวลาที่เหลือของทั้ง request
+ขั้นที่ช้าเกิน budget จะถูกปล่อยทิ้ง (ทำงานต่อใน thread pool) แล้วใช้ fallback แทน
+จำนวนครั้งที่เกิน budget นับแยกตามขั้น ดูได้ที่ /api/ai/route-stats/
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# budget ต่อขั้น (ms)
+STAGE_BUDGETS_MS = {
+    'cart_ms': 1500,
+    'retrieval_ms': 1500,
+    'prepare_ms': 2000,  # retrieval + เตรียม prompt (ทำคู่ขนานกับตะกร้า)
+    'llm_ms': 6000,
+}
+
+# thread pool จำกัดขนาด - งานที่หมดเวลาแล้วยังวิ่งต่อได้ แต่ไม่ทำให้ thread บานปลาย
+stage_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='pipeline-stage')
+
+_miss_lock = threading.Lock()
+_miss_counts = Counter()
+
+
+class DeadlineExceeded(Exception):
+    """ขั้นใน pipeline ทำไม่เสร็จภายใน budget"""
+
+    def __init__(self, stage):
+        super().__init__(f"{stage} exceeded its deadline")
+        self.stage = stage
+
+
+def get_miss_counts():
+    with _miss_lock:
+        return dict(_miss_counts)
+
+
+class Deadline:
+
+    def __init__(self, total_ms=None, budgets=None, timings=None):
+        total_ms = total_ms if total_ms is not None else getattr(settings, 'AI_VOICE_DEADLINE_MS', 8000)
+        self.started = time.perf_counter()
+        self.expires_at = self.started + total_ms / 1000
+        self.budgets = {**STAGE_BUDGETS_MS, **(budgets or {})}
+        self.timings = timings if timings is not None else {}
+        self.missed = []
+
+    def remaining(self):
+        """เวลาที่เหลือ (วินาที)"""
+        return max(0.0, self.expires_at - time.perf_counter())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def budget(self, stage):
+        """เวลาที่ขั้นนี้ใช้ได้ (วินาที) = min(budget ของขั้น, เวลาที่เหลือ)"""
+        stage_budget = self.budgets.get(stage)
+        if stage_budget is None:
+            return self.remaining()
+        return min(stage_budget / 1000, self.remaining())
+
+    def record_miss(self, stage):
+        self.missed.append(stage)
+        self.timings['deadline_missed'] = list(self.missed)
+        with _miss_lock:
+            _miss_counts[stage] += 1
+        logger.warning(f"Pipeline stage {stage} missed its deadline")
+        print(f"[Deadline] {stage} exceeded budget")
+
+    def record(self, stage, started):
+        """บันทึกเวลาของขั้นที่ทำใน thread ปัจจุบัน (ตัดกลางทางไม่ได้ - นับ miss อย่างเดียว)"""
+        elapsed = time.perf_counter() - started
+        self.timings[stage] = int(elapsed * 1000)
+        if stage in self.budgets and elapsed * 1000 > self.budgets[stage]:
+            self.record_miss(stage)
+
+    def start(self, stage, fn, *args, **kwargs):
+        """เริ่มขั้นใน thread pool ทันที (ทำคู่ขนานกับงานอื่นได้) - รอผลด้วย result()"""
+        return stage, time.perf_counter(), stage_executor.submit(fn, *args, **kwargs)
+
+    def result(self, handle):
+        """รอผลของขั้นที่ start() ไว้ budget นับตั้งแต่เริ่ม - เกินเวลาจะ raise DeadlineExceeded"""
+        stage, started, future = handle
+        timeout = min(self.budget(stage) - (time.perf_counter() - started), self.remaining())
+        try:
+            if timeout <= 0 and not future.done():
+                raise FutureTimeoutError()
+            return future.result(timeout=max(timeout, 0))
+        except FutureTimeoutError:
+            future.cancel()
+            self.record_miss(stage)
+            raise DeadlineExceeded(stage)
+        finally:
+            self.timings[stage] = int((time.perf_counter() - started) * 1000)
+
+    def discard(self, handle):
+        """ทิ้งขั้นที่ start() ไว้แต่ไม่ใช้ผลแล้ว - ยกเลิกถ้ายังไม่เริ่ม (ที่วิ่งอยู่แล้วจะทำต่อจนจบ)"""
+        if handle is not None:
+            handle[2].cancel()
+
+    def run(self, stage, fn, *args, **kwargs):
+        """รัน fn ใน thread pool ภายใน budget ของขั้น - เกินเวลาจะ raise DeadlineExceeded"""
+        if self.budget(stage) <= 0:
+            self.record_miss(stage)
+            raise DeadlineExceeded(stage)
+        return self.result(self.start(stage, fn, *args, **kwargs))
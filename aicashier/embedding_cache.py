@@ -0,0 +1,199 @@
+"""
+Persistent embedding cache แบบ content-addressed
+
+key = sha1(model id + ข้อความ chunk) -> vector
+เก็บเป็นไฟล์ต่อท้ายได้อย่างเดียว (append-only) 2 ไฟล์ต่อโมเดล:
+- keys.bin     : digest 20 bytes ต่อแถว (เป็นตัว commit ว่าแถวนั้นใช้ได้)
+- vectors.f32  : float32 ต่อกันแถวละ dim ตัว อ่านผ่าน numpy.memmap
+ทำให้ reindex catalog ที่ไม่เปลี่ยนแค่อ่านไฟล์ ไม่ต้องรันโมเดลใหม่
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+def _lock_file(lock_file):
+    """lock ข้าม process (fcntl บน Linux/macOS, msvcrt บน Windows, ไม่มีทั้งคู่ = lock ใน process อย่างเดียว)"""
+    if fcntl:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    elif msvcrt:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(lock_file):
+    if fcntl:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    elif msvcrt:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+KEY_SIZE = 20  # sha1 digest
+
+
+class EmbeddingCache:
+
+    def __init__(self, cache_dir, model_id):
+        self.model_id = model_id
+        self.cache_dir = os.path.join(cache_dir, model_id)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._keys_path = os.path.join(self.cache_dir, 'keys.bin')
+        self._vectors_path = os.path.join(self.cache_dir, 'vectors.f32')
+        self._meta_path = os.path.join(self.cache_dir, 'meta.json')
+        self._lock_path = os.path.join(self.cache_dir, '.lock')
+
+        self._index = {}  # digest -> row
+        self._rows = 0
+        self._dim = None
+        self._mmap = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._load_meta()
+        self._refresh()
+
+    def key(self, text):
+        return hashlib.sha1(f"{self.model_id}\x00{text}".encode('utf-8')).digest()
+
+    def _load_meta(self):
+        try:
+            with open(self._meta_path) as f:
+                self._dim = json.load(f).get('dim')
+        except (FileNotFoundError, ValueError):
+            self._dim = None
+
+    def _refresh(self):
+        """อ่าน keys ที่ process อื่นเขียนเพิ่มเข้ามา"""
+        try:
+            size = os.path.getsize(self._keys_path)
+        except FileNotFoundError:
+            return
+        rows = size // KEY_SIZE
+        if rows <= self._rows:
+            return
+
+        with open(self._keys_path, 'rb') as f:
+            f.seek(self._rows * KEY_SIZE)
+            data = f.read((rows - self._rows) * KEY_SIZE)
+        for i in range(rows - self._rows):
+            self._index.setdefault(data[i * KEY_SIZE:(i + 1) * KEY_SIZE], self._rows + i)
+        self._rows = rows
+        if self._dim is None:
+            self._load_meta()
+        self._mmap = None
+
+    def _vectors(self):
+        if self._mmap is None and self._rows and self._dim:
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode='r',
+                                   shape=(self._rows, self._dim))
+        return self._mmap
+
+    def get_many(self, texts):
+        """คืน list ของ vector ตามลำดับ texts (None ถ้ายังไม่มีใน cache)"""
+        with self._lock:
+            keys = [self.key(text) for text in texts]
+            if any(k not in self._index for k in keys):
+                self._refresh()
+
+            vectors = self._vectors()
+            result = []
+            for k in keys:
+                row = self._index.get(k)
+                if row is None or vectors is None:
+                    result.append(None)
+                    self.misses += 1
+                else:
+                    result.append(vectors[row].tolist())
+                    self.hits += 1
+            return result
+
+    def put_many(self, texts, vectors):
+        with self._lock, open(self._lock_path, 'a+b') as lock_file:
+            # กันหลาย process เขียนพร้อมกัน
+            _lock_file(lock_file)
+            try:
+                self._refresh()
+                new = {}
+                for text, vector in zip(texts, vectors):
+                    k = self.key(text)
+                    if k not in self._index and k not in new:
+                        new[k] = vector
+                if not new:
+                    return 0
+
+                arr = np.asarray(list(new.values()), dtype=np.float32)
+                if self._dim is None:
+                    self._dim = int(arr.shape[1])
+                    with open(self._meta_path, 'w') as f:
+                        json.dump({'model': self.model_id, 'dim': self._dim}, f)
+                elif arr.shape[1] != self._dim:
+                    raise ValueError(f"vector dim {arr.shape[1]} != cache dim {self._dim}")
+
+                # เขียน vectors ก่อน แล้วค่อยเขียน keys (ถ้า crash กลางทาง แถวนั้นจะถูกเขียนทับครั้งถัดไป)
+                mode = 'r+b' if os.path.exists(self._vectors_path) else 'wb'
+                with open(self._vectors_path, mode) as f:
+                    f.seek(self._rows * self._dim * 4)
+                    f.write(arr.tobytes())
+                mode = 'r+b' if os.path.exists(self._keys_path) else 'wb'
+                with open(self._keys_path, mode) as f:
+                    f.seek(self._rows * KEY_SIZE)
+                    f.write(b''.join(new.keys()))
+                    f.truncate()
+
+                for i, k in enumerate(new):
+                    self._index[k] = self._rows + i
+                self._rows += len(new)
+                self._mmap = None
+                return len(new)
+            finally:
+                _unlock_file(lock_file)
+
+    def stats(self):
+        return {'entries': self._rows, 'dim': self._dim, 'hits': self.hits, 'misses': self.misses}
+
+
+class CachedEmbeddings(Embeddings):
+    """ครอบ Embeddings เดิม - embed_documents จะดูใน cache ก่อนเรียกโมเดล"""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        try:
+            vectors = self.cache.get_many(texts)
+        except Exception as e:
+            print(f"[EmbeddingCache] Read error, computing all: {e}")
+            return self.embeddings.embed_documents(texts)
+
+        # embed เฉพาะข้อความที่ยังไม่มี (ข้อความซ้ำกันใน batch embed ครั้งเดียว)
+        missing = list(dict.fromkeys(texts[i] for i, v in enumerate(vectors) if v is None))
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            vectors = [v if v is not None else computed[text] for text, v in zip(texts, vectors)]
+            try:
+                self.cache.put_many(missing, [computed[text] for text in missing])
+            except Exception as e:
+                print(f"[EmbeddingCache] Write error: {e}")
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
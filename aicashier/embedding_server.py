@@ -0,0 +1,236 @@
+"""
+Embedding/Search server แบบ process แยก (ผ่าน unix socket)
+
+โหลดโมเดล embedding และ vector store ไว้ใน process เดียว แล้วให้ web worker ทุกตัว
+เรียกใช้ผ่าน client บาง ๆ แทนการโหลดโมเดลซ้ำในทุก worker
+รัน: python manage.py run_embedding_server
+"""
+
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+# ชื่อโมเดล embedding (โฟลเดอร์ใน aicashier/models) - ใช้ตรวจว่า vectors เข้ากันได้
+EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+# frame = ความยาว 4 bytes (big-endian) + JSON payload
+_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Windows ไม่มี unix socket - ใช้ได้แค่โมเดล local ใน worker
+HAS_UNIX_SOCKETS = hasattr(socket, 'AF_UNIX')
+
+# True เมื่อ process นี้คือตัว server เอง (ต้องใช้โมเดล local ห้ามเรียกตัวเองผ่าน socket)
+_is_server_process = False
+
+
+def mark_server_process():
+    """ระบุว่า process นี้เป็น embedding server (เรียกก่อน import rag_service)"""
+    global _is_server_process
+    _is_server_process = True
+
+
+def is_server_process():
+    return _is_server_process
+
+
+class EmbeddingServerError(Exception):
+    """Server ตอบกลับมาเป็น error"""
+
+
+class EmbeddingServerUnavailable(EmbeddingServerError):
+    """เชื่อมต่อ server ไม่ได้ / timeout"""
+
+
+def _send_frame(sock, payload):
+    data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("socket closed by peer")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def _recv_frame(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"frame too large: {size} bytes")
+    return json.loads(_recv_exact(sock, size).decode('utf-8'))
+
+
+# ===== Server =====
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """หนึ่ง connection รับได้หลาย request (client ใช้ connection ซ้ำ)"""
+
+    def handle(self):
+        while True:
+            try:
+                request = _recv_frame(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+
+            try:
+                response = {'ok': True, 'result': self.server.dispatch(request)}
+            except Exception as e:
+                print(f"[EmbeddingServer] Error handling '{request.get('op')}': {e}")
+                response = {'ok': False, 'error': str(e)}
+
+            try:
+                _send_frame(self.request, response)
+            except OSError:
+                return
+
+
+if HAS_UNIX_SOCKETS:
+    class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, socket_path, rag):
+            self.socket_path = socket_path
+            self.rag = rag
+            # ให้โมเดลทำงานทีละงาน - torch ใช้ thread pool ของตัวเองอยู่แล้ว
+            self._model_lock = threading.Lock()
+
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+            super().__init__(socket_path, _RequestHandler)
+            os.chmod(socket_path, 0o660)
+
+        def dispatch(self, request):
+            op = request.get('op')
+
+            if op == 'ping':
+                return {
+                    'pid': os.getpid(),
+                    'index_generation': self.rag.index_writer.generation,
+                    **self.rag.get_collection_stats(),
+                }
+
+            if op == 'stats':
+                return self.rag.get_collection_stats()
+
+            # งานเขียน index ทั้งหมดเข้าคิวของ writer ตัวเดียวใน process นี้
+            if op == 'index':
+                mutations = [tuple(m) for m in request.get('mutations', [])]
+                return self.rag.index_writer.submit(mutations, wait=bool(request.get('wait')))
+
+            if op == 'index_flush':
+                return self.rag.index_writer.flush(request.get('timeout'))
+
+            if op == 'embed_documents':
+                with self._model_lock:
+                    return self.rag.embeddings.embed_documents(list(request.get('texts', [])))
+
+            if op == 'embed_query':
+                with self._model_lock:
+                    return self.rag.embeddings.embed_query(request.get('text', ''))
+
+            if op == 'search':
+                with self._model_lock:
+                    results = self.rag.search_products(request.get('query', ''), k=int(request.get('k', 3)))
+                return [
+                    {'page_content': doc.page_content, 'metadata': doc.metadata, 'score': score}
+                    for doc, score in results
+                ]
+
+            raise ValueError(f"unknown op: {op}")
+
+        def server_close(self):
+            super().server_close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+
+# ===== Client =====
+class EmbeddingClient:
+    """Client สำหรับ web worker - ใช้ connection ซ้ำต่อ thread, มี timeout
+
+    ถ้าเชื่อมต่อไม่ได้จะพัก (retry_interval วินาที) ก่อนลองใหม่
+    เพื่อไม่ให้ทุก request ต้องรอ timeout ซ้ำ ๆ
+    """
+
+    def __init__(self, socket_path, timeout=5.0, retry_interval=30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def is_available(self):
+        return time.monotonic() >= self._down_until
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def call(self, op, call_timeout=False, **params):
+        """ส่ง request ไปที่ server - call_timeout=None คือรอได้ไม่จำกัด (ค่าเริ่มต้นใช้ self.timeout)"""
+        if not self.is_available():
+            raise EmbeddingServerUnavailable("embedding server marked down")
+
+        payload = {'op': op, **params}
+        response = None
+        for attempt in range(2):
+            sock = getattr(self._local, 'sock', None)
+            reused = sock is not None
+            try:
+                if sock is None:
+                    sock = self._connect()
+                    self._local.sock = sock
+                sock.settimeout(self.timeout if call_timeout is False else call_timeout)
+                _send_frame(sock, payload)
+                response = _recv_frame(sock)
+                break
+            except (OSError, ValueError) as e:
+                self._close()
+                # connection เก่าอาจหลุด (server restart) - ลองต่อใหม่ได้อีกครั้งเดียว
+                if reused and attempt == 0 and not isinstance(e, socket.timeout):
+                    continue
+                self._down_until = time.monotonic() + self.retry_interval
+                print(f"[EmbeddingClient] Server unavailable ({e}), fallback for {self.retry_interval:.0f}s")
+                raise EmbeddingServerUnavailable(str(e)) from e
+
+        if not response.get('ok'):
+            raise EmbeddingServerError(response.get('error', 'unknown error'))
+        return response.get('result')
+
+    def embed_documents(self, texts):
+        return self.call('embed_documents', texts=list(texts))
+
+    def embed_query(self, text):
+        return self.call('embed_query', text=text)
+
+    def search(self, query, k=3):
+        return self.call('search', query=query, k=k)
+
+    def ping(self):
+        return self.call('ping')
+
@@ -0,0 +1,157 @@
+"""
+Versioned snapshot ของ vector index
+
+- product_content_hash: hash ของข้อมูลสินค้าที่ถูก embed (เก็บไว้ใน metadata ของทุก chunk)
+- catalog version: hash รวมของ (product_id, content_hash) ทั้งหมด ใช้เทียบ DB กับ index
+- export/import: เก็บ vectors + documents + metadata เป็นไฟล์ .npz (บีบอัด)
+  ให้ node ใหม่โหลดได้ทันทีโดยไม่ต้อง embed ทั้ง catalog ใหม่
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from django.utils import timezone
+
+from .embedding_server import EMBEDDING_MODEL_NAME
+
+SNAPSHOT_FORMAT = 1
+
+
+def product_content_hash(product):
+    """hash ของข้อมูลที่ใช้สร้าง text/metadata ของสินค้าใน index"""
+    category_name = product.category.name if product.category else "ไม่มีหมวด"
+    raw = "\x1f".join([
+        product.name or "",
+        category_name,
+        str(product.price),
+        product.description or "",
+        product.ai_information or "",
+    ])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def ai_chunk_id(text):
+    """id ของ chunk จาก ai_information - ข้อความเดียวกันได้ id เดียวกันทุกสินค้า"""
+    return "chunk_" + hashlib.sha1(text.encode('utf-8')).hexdigest()[:24]
+
+
+def get_db_content_hashes(product_ids=None):
+    """content_hash ของสินค้าใน DB - product_ids=None คือทั้ง catalog"""
+    from django.apps import apps
+    Product = apps.get_model('aicashier', 'Product')
+    products = Product.objects.select_related('category').only(
+        'id', 'name', 'price', 'description', 'ai_information', 'category__name'
+    )
+    if product_ids is not None:
+        products = products.filter(id__in=[int(pid) for pid in product_ids])
+    return {str(p.id): product_content_hash(p) for p in products.iterator(chunk_size=500)}
+
+
+def compute_catalog_version(content_hashes):
+    """content_hashes: dict {product_id: content_hash}"""
+    digest = hashlib.sha1()
+    for product_id in sorted(content_hashes, key=lambda pid: int(pid)):
+        digest.update(f"{product_id}:{content_hashes[product_id]}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_index_content_hashes(collection):
+    """อ่าน content_hash ของสินค้าแต่ละตัวจาก metadata ใน index (ไม่ดึง embeddings)"""
+    hashes = {}
+    existing = collection.get(include=["metadatas"])
+    for metadata in existing["metadatas"]:
+        product_id = metadata.get("product_id")
+        if product_id:
+            # index เก่าที่ยังไม่มี content_hash จะไม่ตรงกับ DB และถูก embed ใหม่
+            hashes[product_id] = metadata.get("content_hash", "")
+    return hashes
+
+
+def export_snapshot(collection, path, batch_size=1000):
+    ids, documents, metadatas, embeddings = [], [], [], []
+    offset = 0
+    while True:
+        page = collection.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=batch_size,
+            offset=offset
+        )
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+        embeddings.extend(page["embeddings"])
+        offset += len(page["ids"])
+
+    content_hashes = {}
+    for metadata in metadatas:
+        if metadata.get("product_id"):
+            content_hashes[metadata["product_id"]] = metadata.get("content_hash", "")
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'model': EMBEDDING_MODEL_NAME,
+        'catalog_version': compute_catalog_version(content_hashes),
+        'product_count': len(content_hashes),
+        'chunk_count': len(ids),
+        'created_at': timezone.now().isoformat(),
+    }
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if not len(ids):
+        vectors = np.zeros((0, 0), dtype=np.float32)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(
+            f,
+            manifest=np.array(json.dumps(manifest)),
+            ids=np.array(json.dumps(ids, ensure_ascii=False)),
+            documents=np.array(json.dumps(documents, ensure_ascii=False)),
+            metadatas=np.array(json.dumps(metadatas, ensure_ascii=False)),
+            embeddings=vectors,
+        )
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def read_snapshot_manifest(path):
+    with np.load(path, allow_pickle=False) as data:
+        return json.loads(str(data['manifest']))
+
+
+def import_snapshot(collection, path, replace=False, batch_size=1000):
+    """โหลด snapshot เข้า collection โดยใช้ vectors ที่เก็บไว้ (ไม่ต้อง embed ใหม่)"""
+    with np.load(path, allow_pickle=False) as data:
+        manifest = json.loads(str(data['manifest']))
+        if manifest.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format: {manifest.get('format')}")
+        if manifest.get('model') != EMBEDDING_MODEL_NAME:
+            raise ValueError(
+                f"Snapshot was built with model '{manifest.get('model')}', "
+                f"expected '{EMBEDDING_MODEL_NAME}'"
+            )
+
+        ids = json.loads(str(data['ids']))
+        documents = json.loads(str(data['documents']))
+        metadatas = json.loads(str(data['metadatas']))
+        embeddings = data['embeddings']
+
+    if replace:
+        existing_ids = collection.get(include=[])["ids"]
+        for start in range(0, len(existing_ids), batch_size):
+            collection.delete(ids=existing_ids[start:start + batch_size])
+
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        collection.upsert(
+            ids=ids[start:end],
+            embeddings=embeddings[start:end].tolist(),
+            documents=documents[start:end],
+            metadatas=metadatas[start:end],
+        )
+    return manifest
@@ -0,0 +1,174 @@
+"""
+Single-writer สำหรับ vector index (Chroma)
+
+ทุกการแก้ไข index (upsert / delete / patch metadata) ต้องผ่าน IndexWriter
+ซึ่งมี thread เขียนเพียงตัวเดียว ทำงานตามลำดับ และรวม (coalesce) งานของสินค้าเดียวกัน
+ถ้าตั้ง AI_EMBEDDING_SOCKET ไว้ งานเขียนทั้งหมดจะถูกส่งไปที่ embedding server
+ซึ่งเป็น process เดียวที่เขียน data/chroma - worker อื่นไม่ต้องแย่งกันเขียน
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from .embedding_server import EmbeddingServerError
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+PATCH = 'patch'
+
+MAX_ATTEMPTS = 3
+
+
+def _coalesce(previous, new):
+    """รวม mutation ของสินค้าเดียวกันที่ยังค้างอยู่ให้เหลือตัวเดียว"""
+    if previous is None:
+        return new
+
+    prev_op, prev_metadata = previous
+    op, metadata = new
+    if op == PATCH:
+        if prev_op == PATCH:
+            return (PATCH, {**prev_metadata, **metadata})
+        # upsert จะโหลดข้อมูลล่าสุดจาก DB อยู่แล้ว / delete ชนะเสมอ
+        return previous
+    return new
+
+
+class IndexWriter:
+    """เขียน index ทีละ batch จาก thread เดียว"""
+
+    def __init__(self, rag, coalesce_delay=0.2, batch_size=64):
+        self.rag = rag
+        self.coalesce_delay = coalesce_delay
+        self.batch_size = batch_size
+        self.generation = 0  # เพิ่มขึ้นทุกครั้งที่เขียน batch เสร็จ
+        self._pending = OrderedDict()
+        self._attempts = {}
+        self._inflight = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='rag-index-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, mutations, wait=False):
+        """mutations: list ของ (op, product_id, metadata)"""
+        with self._cond:
+            for op, product_id, metadata in mutations:
+                key = str(product_id)
+                previous = self._pending.pop(key, None)
+                self._pending[key] = _coalesce(previous, (op, metadata or {}))
+            self._cond.notify_all()
+        self._ensure_thread()
+
+        if wait:
+            return self.flush()
+        return True
+
+    def flush(self, timeout=None):
+        """รอจนงานที่ค้างอยู่ถูกเขียนหมด"""
+        with self._cond:
+            if not self._pending and not self._inflight:
+                return True
+        self._ensure_thread()
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._inflight, timeout)
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending) + self._inflight
+
+    def _run(self):
+        from django.db import connection
+
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+
+            # รอสักครู่ให้ save ที่ตามมาติด ๆ ถูกรวมเข้า batch เดียวกัน
+            time.sleep(self.coalesce_delay)
+
+            with self._cond:
+                batch = OrderedDict()
+                while self._pending and len(batch) < self.batch_size:
+                    key, mutation = self._pending.popitem(last=False)
+                    batch[key] = mutation
+                self._inflight = len(batch)
+
+            try:
+                failed = self._apply(batch)
+            except Exception as e:
+                print(f"[IndexWriter] Error applying batch: {e}")
+                failed = batch
+            finally:
+                connection.close()
+
+            with self._cond:
+                for key, mutation in failed.items():
+                    attempts = self._attempts.get(key, 0) + 1
+                    if attempts >= MAX_ATTEMPTS:
+                        print(f"[IndexWriter] Giving up on product {key} after {attempts} attempts")
+                        self._attempts.pop(key, None)
+                        continue
+                    self._attempts[key] = attempts
+                    if key not in self._pending:
+                        self._pending[key] = mutation
+                for key in batch:
+                    if key not in failed:
+                        self._attempts.pop(key, None)
+                self._inflight = 0
+                self.generation += 1
+                self._cond.notify_all()
+
+    def _apply(self, batch):
+        """เขียน batch ลง index - คืนค่า mutation ที่เขียนไม่สำเร็จ"""
+        deletes = [key for key, (op, _) in batch.items() if op == DELETE]
+        upserts = [key for key, (op, _) in batch.items() if op == UPSERT]
+        patches = {key: metadata for key, (op, metadata) in batch.items() if op == PATCH}
+
+        failed = OrderedDict()
+        if deletes and not self.rag._apply_deletes(deletes):
+            failed.update((key, batch[key]) for key in deletes)
+        if upserts and not self.rag._apply_upserts(upserts):
+            failed.update((key, batch[key]) for key in upserts)
+        if patches and not self.rag._apply_metadata_patches(patches):
+            failed.update((key, batch[key]) for key in patches)
+
+        print(f"[IndexWriter] Applied batch: upsert={len(upserts)}, delete={len(deletes)}, "
+              f"patch={len(patches)}, failed={len(failed)}")
+        self.rag._after_index_batch()
+        return failed
+
+
+class RemoteIndexWriter:
+    """ส่ง mutation ไปให้ writer ใน embedding server
+
+    ถ้า server ล่มจะเขียนเองใน process นี้ (fallback) เพื่อไม่ให้งานหาย
+    """
+
+    def __init__(self, client, fallback):
+        self.client = client
+        self.fallback = fallback
+
+    def submit(self, mutations, wait=False):
+        payload = [[op, str(product_id), metadata or {}] for op, product_id, metadata in mutations]
+        try:
+            return self.client.call('index', mutations=payload, wait=wait,
+                                    call_timeout=None if wait else self.client.timeout)
+        except EmbeddingServerError as e:
+            print(f"[IndexWriter] Server unavailable, writing locally: {e}")
+            return self.fallback.submit(mutations, wait=wait)
+
+    def flush(self, timeout=None):
+        ok = self.fallback.flush(timeout)
+        try:
+            return self.client.call('index_flush', timeout=timeout, call_timeout=timeout) and ok
+        except EmbeddingServerError:
+            return ok
+
+    def pending_count(self):
+        return self.fallback.pending_count()
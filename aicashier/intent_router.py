@@ -0,0 +1,176 @@
+"""
+ตอบคำถามง่าย ๆ (ราคา / สต็อก / สินค้าในหมวด / สินค้าแนะนำ) จากฐานข้อมูลโดยตรง ไม่ผ่าน RAG + LLM
+
+จับ intent ด้วย keyword และหาชื่อสินค้า/หมวดในข้อความ (เทียบแบบ substring เพราะภาษาไทยไม่เว้นวรรค)
+ข้อมูลสินค้าเก็บเป็น snapshot ในหน่วยความจำ โหลดใหม่เมื่อ signal แจ้งว่าสินค้าเปลี่ยนหรือครบ TTL
+คำถามที่ไม่ชัดเจน (เปรียบเทียบ / ขอคำแนะนำเชิงความเห็น) ส่งต่อให้ LLM เหมือนเดิม
+"""
+
+import logging
+import re
+import threading
+import time
+
+from .models import AISettings, Product
+
+logger = logging.getLogger(__name__)
+
+PRICE = 'price'
+STOCK = 'stock'
+CATEGORY = 'category'
+FEATURED = 'featured'
+
+SNAPSHOT_TTL = 30  # วินาที
+MAX_LISTED = 10
+
+_PRICE_RE = re.compile(r'ราคา|เท่าไหร่|เท่าไร|กี่บาท')
+_STOCK_RE = re.compile(r'มีของ|ของหมด|หมดไหม|หมดยัง|เหลือ|มีไหม|มีมั้ย|มีขาย|กี่ชิ้น|สต็อก|สต๊อก')
+_CATEGORY_RE = re.compile(r'มีอะไรบ้าง|อะไรบ้าง|มีอะไร|เมนู|รายการ')
+_FEATURED_RE = re.compile(r'แนะนำ|ขายดี|เมนูเด่น|สินค้าเด่น')
+# คำถามเชิงความเห็น / เปรียบเทียบ - ให้ LLM ตอบ
+_OPEN_ENDED_RE = re.compile(r'อร่อย|ดีกว่า|ต่างกัน|แตกต่าง|ทำไม|ยังไง|อย่างไร|เหมาะ|คุ้ม|ควร|เปรียบเทียบ')
+
+_lock = threading.Lock()
+_snapshot = {'loaded_at': 0.0, 'products': [], 'categories': {}, 'featured': []}
+
+
+def _normalize(text):
+    return re.sub(r'\s+', '', (text or '').lower())
+
+
+def invalidate_snapshot():
+    """เรียกจาก signal เมื่อสินค้า / หมวด / AISettings เปลี่ยน"""
+    with _lock:
+        _snapshot['loaded_at'] = 0.0
+
+
+def _get_snapshot():
+    with _lock:
+        if time.monotonic() - _snapshot['loaded_at'] < SNAPSHOT_TTL:
+            return _snapshot
+
+    products = [
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'key': _normalize(row['name']),
+            'price': row['price'],
+            'quantity': row['quantity'],
+            'category': row['category__name'],
+        }
+        for row in Product.objects.values('id', 'name', 'price', 'quantity', 'category__name')
+    ]
+    categories = {}
+    for product in products:
+        if product['category']:
+            categories.setdefault(product['category'], []).append(product)
+
+    ai_settings = AISettings.get_settings()
+    by_id = {product['id']: product for product in products}
+    featured = [
+        by_id[pid] for pid in [
+            ai_settings.featured_item_1_id, ai_settings.featured_item_2_id,
+            ai_settings.featured_item_3_id, ai_settings.featured_item_4_id,
+        ] if pid in by_id
+    ]
+
+    with _lock:
+        _snapshot.update({
+            'loaded_at': time.monotonic(),
+            # ชื่อยาวก่อน เพื่อให้ "ชาเขียวนม" ชนะ "ชาเขียว"
+            'products': sorted((p for p in products if p['key']), key=lambda p: -len(p['key'])),
+            'categories': categories,
+            'featured': featured,
+        })
+        return _snapshot
+
+
+def _match_products(text, products):
+    """หาชื่อสินค้าในข้อความ (ไม่นับชื่อที่เป็นส่วนหนึ่งของชื่อที่ match ไปแล้ว)"""
+    matched = []
+    for product in products:
+        if product['key'] in text and not any(product['key'] in m['key'] for m in matched):
+            matched.append(product)
+    return matched
+
+
+def find_products(query):
+    """สินค้าที่ถูกพูดถึงในข้อความ (จาก snapshot)"""
+    try:
+        return _match_products(_normalize(query), _get_snapshot()['products'])
+    except Exception as e:
+        logger.error(f"Error matching products: {e}")
+        return []
+
+
+def _price(value):
+    return f"{value:,.2f}".rstrip('0').rstrip('.')
+
+
+def _answer_price(products):
+    lines = []
+    for product in products:
+        line = f"{product['name']} ราคา {_price(product['price'])} บาท"
+        if product['quantity'] <= 0:
+            line += " (ตอนนี้สินค้าหมดชั่วคราว)"
+        lines.append(line)
+    return "\n".join(lines) + " ครับ"
+
+
+def _answer_stock(products):
+    lines = []
+    for product in products:
+        if product['quantity'] > 0:
+            lines.append(f"{product['name']} มีสินค้าครับ (เหลือ {product['quantity']} ชิ้น ราคา {_price(product['price'])} บาท)")
+        else:
+            lines.append(f"ขออภัยครับ {product['name']} หมดชั่วคราว")
+    return "\n".join(lines)
+
+
+def _answer_list(title, products):
+    available = [p for p in products if p['quantity'] > 0][:MAX_LISTED]
+    if not available:
+        return f"ขออภัยครับ ตอนนี้{title}หมดทุกรายการ"
+    lines = [f"• {p['name']} - {_price(p['price'])} บาท" for p in available]
+    return f"{title}ที่มีตอนนี้:\n" + "\n".join(lines)
+
+
+def catalog_answer():
+    """คำตอบสำเร็จรูปจากรายการสินค้า (ใช้ตอน LLM ใช้งานไม่ได้)"""
+    try:
+        snapshot = _get_snapshot()
+        if snapshot['featured']:
+            return _answer_list("สินค้าแนะนำ", snapshot['featured'])
+        return _answer_list("สินค้า", sorted(snapshot['products'], key=lambda p: p['name']))
+    except Exception as e:
+        logger.error(f"Error building catalog answer: {e}")
+        return None
+
+
+def route_query(query):
+    """คืน {'intent', 'answer'} ถ้าตอบได้จากข้อมูลโดยตรง หรือ None ถ้าต้องส่งต่อให้ LLM"""
+    try:
+        text = _normalize(query)
+        if not text or _OPEN_ENDED_RE.search(text):
+            return None
+
+        snapshot = _get_snapshot()
+        products = _match_products(text, snapshot['products'])
+
+        if products and _PRICE_RE.search(text):
+            return {'intent': PRICE, 'answer': _answer_price(products)}
+        if products and _STOCK_RE.search(text):
+            return {'intent': STOCK, 'answer': _answer_stock(products)}
+
+        if not products and _CATEGORY_RE.search(text):
+            for name, category_products in snapshot['categories'].items():
+                if _normalize(name) in text:
+                    return {'intent': CATEGORY, 'answer': _answer_list(f"หมวด{name}", category_products)}
+
+        if not products and _FEATURED_RE.search(text) and snapshot['featured']:
+            return {'intent': FEATURED, 'answer': _answer_list("สินค้าแนะนำ", snapshot['featured'])}
+
+        return None
+    except Exception as e:
+        logger.error(f"Error routing query: {e}")
+        return None
@@ -0,0 +1,143 @@
+"""
+คิวเรียก LLM แบบมีลำดับความสำคัญ (จำกัดจำนวนที่เรียกพร้อมกัน)
+
+- cart: คำสั่งเสียงเกี่ยวกับตะกร้า / ชำระเงิน (สำคัญสุด ไม่ถูกตัดทิ้ง)
+- chat: แชท / ถามข้อมูลสินค้า
+- recommend: แนะนำสินค้า
+- background: งานเบื้องหลัง (สรุปบทสนทนา, สร้างคำตอบล่วงหน้า)
+
+ช่องว่างจะให้คิวที่สำคัญกว่าก่อนเสมอ แต่ละคลาสมีเพดานของตัวเองกันไม่ให้คลาสเดียวกินหมด
+คำขอที่รอคิวนานเกิน MAX_WAIT_SECONDS ของคลาสจะถูกตัดทิ้ง (raise LLMOverloaded)
+สถิติเวลารอคิวดูได้ที่ /api/ai/route-stats/
+"""
+
+import itertools
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CART = 'cart'
+CHAT = 'chat'
+RECOMMEND = 'recommend'
+BACKGROUND = 'background'
+
+PRIORITIES = {CART: 0, CHAT: 1, RECOMMEND: 2, BACKGROUND: 3}
+
+# จำนวนที่เรียกพร้อมกันได้สูงสุดต่อคลาส
+CLASS_LIMITS = {CART: 4, CHAT: 3, RECOMMEND: 2, BACKGROUND: 1}
+
+# เวลารอคิวสูงสุด (วินาที) - None = รอได้เรื่อย ๆ
+MAX_WAIT_SECONDS = {CART: None, CHAT: 5, RECOMMEND: 3, BACKGROUND: 60}
+
+BUSY_MESSAGE = "ขออภัยครับ ตอนนี้มีลูกค้าใช้งานพร้อมกันจำนวนมาก รบกวนลองถามใหม่อีกครั้งในอีกสักครู่นะครับ"
+
+
+class LLMOverloaded(Exception):
+    """รอคิว LLM นานเกินกำหนด - ถูกตัดทิ้ง"""
+
+    def __init__(self, priority, waited):
+        super().__init__(f"LLM queue wait for {priority} exceeded {waited:.1f}s")
+        self.priority = priority
+        self.waited = waited
+
+
+class LLMScheduler:
+
+    def __init__(self, max_concurrent=4, class_limits=None, max_wait=None):
+        self.max_concurrent = max_concurrent
+        self.class_limits = {**CLASS_LIMITS, **(class_limits or {})}
+        self.max_wait = {**MAX_WAIT_SECONDS, **(max_wait or {})}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = {}  # seq -> priority class
+        self._running = {name: 0 for name in PRIORITIES}
+        self._stats = {
+            name: {'completed': 0, 'shed': 0, 'wait_ms_total': 0, 'wait_ms_max': 0}
+            for name in PRIORITIES
+        }
+
+    def _has_capacity(self, priority):
+        # เรียกขณะถือ lock
+        return (sum(self._running.values()) < self.max_concurrent
+                and self._running[priority] < self.class_limits[priority])
+
+    def _is_next(self, seq, priority):
+        # เรียกขณะถือ lock - ไม่มีคนรอที่สำคัญกว่า (หรือมาก่อนในคลาสเดียวกัน) และยังเข้าได้
+        if not self._has_capacity(priority):
+            return False
+        rank = (PRIORITIES[priority], seq)
+        return not any(
+            (PRIORITIES[other], other_seq) < rank and self._has_capacity(other)
+            for other_seq, other in self._waiting.items()
+        )
+
+    def _acquire(self, priority, max_wait):
+        started = time.monotonic()
+        with self._cond:
+            seq = next(self._seq)
+            self._waiting[seq] = priority
+            try:
+                while not self._is_next(seq, priority):
+                    remaining = None if max_wait is None else max_wait - (time.monotonic() - started)
+                    if remaining is not None and remaining <= 0:
+                        self._stats[priority]['shed'] += 1
+                        raise LLMOverloaded(priority, time.monotonic() - started)
+                    self._cond.wait(remaining)
+            finally:
+                del self._waiting[seq]
+                # คนอื่นที่รออยู่อาจเข้าได้แล้ว (เช่นเราถูกตัดทิ้ง)
+                self._cond.notify_all()
+            self._running[priority] += 1
+            wait_ms = int((time.monotonic() - started) * 1000)
+            stats = self._stats[priority]
+            stats['wait_ms_total'] += wait_ms
+            stats['wait_ms_max'] = max(stats['wait_ms_max'], wait_ms)
+
+    def _release(self, priority):
+        with self._cond:
+            self._running[priority] -= 1
+            self._stats[priority]['completed'] += 1
+            self._cond.notify_all()
+
+    def run(self, priority, fn, *args, max_wait=None, **kwargs):
+        """รอคิวตามลำดับความสำคัญแล้วเรียก fn
+        max_wait: เวลารอคิวสูงสุดของครั้งนี้ (ใช้ค่าที่น้อยกว่าระหว่างนี้กับของคลาส)
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown LLM priority class: {priority}")
+        limits = [w for w in (max_wait, self.max_wait[priority]) if w is not None]
+        try:
+            self._acquire(priority, min(limits) if limits else None)
+        except LLMOverloaded as e:
+            logger.warning(str(e))
+            print(f"[LLMQueue] Shed {priority} request after {e.waited:.1f}s")
+            raise
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._release(priority)
+
+    def stats(self):
+        with self._cond:
+            waiting = {name: 0 for name in PRIORITIES}
+            for priority in self._waiting.values():
+                waiting[priority] += 1
+            result = {}
+            for name, stats in self._stats.items():
+                admitted = stats['completed'] + self._running[name]
+                result[name] = {
+                    'running': self._running[name],
+                    'waiting': waiting[name],
+                    'completed': stats['completed'],
+                    'shed': stats['shed'],
+                    'avg_wait_ms': round(stats['wait_ms_total'] / admitted) if admitted else 0,
+                    'max_wait_ms': stats['wait_ms_max'],
+                }
+            return {'max_concurrent': self.max_concurrent, 'classes': result}
+
+
+llm_scheduler = LLMScheduler(max_concurrent=getattr(settings, 'AI_LLM_MAX_CONCURRENT', 4))
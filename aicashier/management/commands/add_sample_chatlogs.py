@@ -54,9 +54,11 @@ class Command(BaseCommand):
             chat_logs.append(
                 ChatLog(
                     customer=customer,
+                    channel=random.choice(['chat', 'voice']),
                     user_query=query,
                     ai_response=response,
-                    created_at=created_at
+                    created_at=created_at,
+                    log_date=timezone.localdate(created_at)
                 )
             )
         
@@ -67,5 +69,5 @@ class Command(BaseCommand):
             self.style.SUCCESS(f'✓ เพิ่มข้อมูลแชท 30 รายการเรียบร้อย')
         )
         self.stdout.write(
-            self.style.WARNING(f'💡 ตอนนี้หน้า overviews จะแสดงข้อมูลจริงจากแชทแล้ว')
+            self.style.WARNING(f'💡 รัน python manage.py cluster_queries แล้วหน้า overviews จะแสดงข้อมูลจากแชทนี้')
         )
@@ -0,0 +1,42 @@
+"""
+Management command to precompute product recommendations
+Usage:
+    python manage.py build_recommendations [--top-n 10]
+    python manage.py build_recommendations --only copurchase --metric cosine --min-support 3
+"""
+
+from django.core.management.base import BaseCommand
+
+from aicashier.recommendation_service import (
+    DEFAULT_TOP_N,
+    MIN_SUPPORT,
+    build_copurchase,
+    build_similar_items,
+)
+
+
+class Command(BaseCommand):
+    help = 'คำนวณสินค้าแนะนำล่วงหน้า (สินค้าคล้ายกันจาก embedding และสินค้าที่มักซื้อด้วยกันจากประวัติออเดอร์)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-n', type=int, default=DEFAULT_TOP_N, help='จำนวนสินค้าใกล้เคียงต่อสินค้า')
+        parser.add_argument('--only', choices=['similar', 'copurchase'], default=None)
+        parser.add_argument('--metric', choices=['lift', 'cosine'], default='lift',
+                            help='วิธี normalize co-occurrence')
+        parser.add_argument('--min-support', type=int, default=MIN_SUPPORT,
+                            help='ต้องถูกซื้อด้วยกันอย่างน้อยกี่ออเดอร์')
+
+    def handle(self, *args, **options):
+        if options['only'] in (None, 'similar'):
+            self.stdout.write(' กำลังคำนวณสินค้าคล้ายกันจาก embedding...')
+            count = build_similar_items(top_n=options['top_n'])
+            self.stdout.write(self.style.SUCCESS(f'✓ Similar items: {count} สินค้า'))
+
+        if options['only'] in (None, 'copurchase'):
+            self.stdout.write(' กำลังคำนวณสินค้าที่มักซื้อด้วยกันจากออเดอร์...')
+            count = build_copurchase(
+                top_k=options['top_n'],
+                metric=options['metric'],
+                min_support=options['min_support'],
+            )
+            self.stdout.write(self.style.SUCCESS(f'✓ Co-purchase: {count} สินค้า'))
@@ -0,0 +1,48 @@
+"""
+Management command to cluster customer questions incrementally
+ควรรันเป็นระยะ (เช่น cron ทุกชั่วโมง) - จัดเฉพาะคำถามใหม่ต่อจากรอบก่อน
+Usage:
+    python manage.py cluster_queries [--threshold 0.82] [--batch-size 256]
+    python manage.py cluster_queries --rebuild
+"""
+
+from django.core.management.base import BaseCommand
+
+from aicashier.query_clustering import (
+    ASSIGN_THRESHOLD,
+    BATCH_SIZE,
+    assign_new_queries,
+    rebuild_clusters,
+)
+
+
+class Command(BaseCommand):
+    help = 'จัดกลุ่มคำถามของลูกค้าด้วย embedding และนับจำนวนต่อวัน (สำหรับหน้า overview)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=ASSIGN_THRESHOLD,
+                            help='cosine similarity ขั้นต่ำที่นับว่าเป็นกลุ่มเดียวกัน')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='จำนวน log ที่ embed ต่อรอบ')
+        parser.add_argument('--rebuild', action='store_true', help='ลบกลุ่มเดิมแล้วจัดกลุ่มใหม่ทั้งหมด')
+
+    def handle(self, *args, **options):
+        from aicashier.rag_service import rag_service
+
+        if rag_service is None:
+            self.stdout.write(self.style.ERROR('✗ RAG service ไม่พร้อมใช้งาน'))
+            return
+
+        if options['rebuild']:
+            deleted = rebuild_clusters()
+            self.stdout.write(self.style.WARNING(f' ลบข้อมูลกลุ่มเดิม {deleted} รายการ'))
+
+        self.stdout.write(' กำลังจัดกลุ่มคำถามใหม่...')
+        result = assign_new_queries(
+            rag_service.embeddings,
+            threshold=options['threshold'],
+            batch_size=options['batch_size'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ จัดกลุ่ม {result['processed']} คำถาม | กลุ่มใหม่ {result['clusters_created']}"
+        ))
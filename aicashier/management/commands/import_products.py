@@ -0,0 +1,63 @@
+"""
+Management command to bulk import products from CSV / JSON Lines / JSON
+Usage:
+    python manage.py import_products products.csv
+    python manage.py import_products products.jsonl --chunk-size 1000 --no-update
+    python manage.py import_products products.csv --dry-run
+
+คอลัมน์: name, price, quantity, category, description, ai_information, image_url, product_code
+(product_code ว่าง = สร้างรหัสใหม่, ตรงกับสินค้าที่มีอยู่ = อัปเดต)
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from aicashier.product_import import ProductImporter, detect_format, iter_rows
+
+MAX_ERRORS_SHOWN = 50
+
+
+class Command(BaseCommand):
+    help = 'นำเข้าสินค้าจำนวนมากจากไฟล์ CSV / JSON Lines / JSON แล้ว index เข้า RAG ครั้งเดียว'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='ไฟล์ที่จะนำเข้า')
+        parser.add_argument('--format', choices=['csv', 'jsonl', 'json'], default=None,
+                            help='รูปแบบไฟล์ (ค่าเริ่มต้น: ดูจากนามสกุล)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='จำนวนแถวต่อการเขียน DB หนึ่งครั้ง')
+        parser.add_argument('--no-update', action='store_true', help='ข้ามสินค้าที่รหัสมีอยู่แล้ว (ไม่อัปเดต)')
+        parser.add_argument('--dry-run', action='store_true', help='ตรวจข้อมูลอย่างเดียว ไม่บันทึก')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+
+        def progress(stats):
+            self.stdout.write(
+                f"   {stats['rows']} แถว | สร้าง {stats['created']} | อัปเดต {stats['updated']} | "
+                f"ผิดพลาด {len(stats['errors'])} | {stats['rows_per_sec']:.0f} แถว/วินาที"
+            )
+
+        importer = ProductImporter(
+            chunk_size=options['chunk_size'],
+            update_existing=not options['no_update'],
+            dry_run=options['dry_run'],
+            wait_for_index=True,
+            progress_callback=progress,
+        )
+
+        self.stdout.write(f" กำลังนำเข้า {options['path']} ({fmt}){' [dry-run]' if options['dry_run'] else ''}...")
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as f:
+                stats = importer.run(iter_rows(f, fmt))
+        except (OSError, ValueError) as e:
+            raise CommandError(f'อ่านไฟล์ไม่สำเร็จ: {e}')
+
+        for line_num, message in stats['errors'][:MAX_ERRORS_SHOWN]:
+            self.stdout.write(self.style.WARNING(f"   แถว {line_num}: {message}"))
+        if len(stats['errors']) > MAX_ERRORS_SHOWN:
+            self.stdout.write(self.style.WARNING(f"   ...และอีก {len(stats['errors']) - MAX_ERRORS_SHOWN} แถว"))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\n เสร็จสิ้น! {stats['rows']} แถวใน {stats['elapsed']:.1f} วินาที ({stats['rows_per_sec']:.0f} แถว/วินาที)\n"
+            f"  สร้าง {stats['created']}, อัปเดต {stats['updated']}, ข้าม {stats['skipped']}, "
+            f"ผิดพลาด {len(stats['errors'])}"
+        ))
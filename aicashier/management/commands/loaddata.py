@@ -0,0 +1,15 @@
+"""
+loaddata ที่ sync RAG แบบ batch ครั้งเดียวหลังโหลด fixture เสร็จ
+(แทนการ embed ทีละแถวจาก signal) เช่น python manage.py loaddata backup_data.json
+"""
+
+from django.core.management.commands.loaddata import Command as LoadDataCommand
+
+from aicashier.rag_sync_queue import bulk_rag_sync
+
+
+class Command(LoadDataCommand):
+
+    def handle(self, *fixture_labels, **options):
+        with bulk_rag_sync(wait=True):
+            return super().handle(*fixture_labels, **options)
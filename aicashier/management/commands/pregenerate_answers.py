@@ -0,0 +1,42 @@
+"""
+Management command to pre-generate answers for recurring kiosk questions
+ควรรันช่วงร้านว่าง (เช่น cron ตอนตี 5) เพราะเรียก LLM หลายครั้ง
+Usage:
+    python manage.py pregenerate_answers [--max-clusters 10] [--days 30]
+"""
+
+from django.core.management.base import BaseCommand
+
+from aicashier.answer_cache import CLUSTER_THRESHOLD, pregenerate_answers
+
+
+class Command(BaseCommand):
+    help = 'จัดกลุ่มคำถามที่ลูกค้าถามบ่อยแล้วสร้างคำตอบล่วงหน้า (รวมคำทักทาย/แนะนำสินค้าเด่น)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-clusters', type=int, default=10, help='จำนวนกลุ่มคำถามยอดนิยมที่จะสร้างคำตอบ')
+        parser.add_argument('--days', type=int, default=30, help='ใช้คำถามย้อนหลังกี่วัน')
+        parser.add_argument('--threshold', type=float, default=CLUSTER_THRESHOLD,
+                            help='cosine similarity ขั้นต่ำที่นับว่าเป็นคำถามเดียวกัน')
+        parser.add_argument('--delay', type=float, default=2.0, help='เว้นระยะระหว่างการเรียก LLM (วินาที)')
+
+    def handle(self, *args, **options):
+        from aicashier.rag_service import rag_service
+
+        if rag_service is None:
+            self.stdout.write(self.style.ERROR('✗ RAG service ไม่พร้อมใช้งาน'))
+            return
+
+        self.stdout.write(' กำลังจัดกลุ่มคำถามและสร้างคำตอบ...')
+        result = pregenerate_answers(
+            rag_service,
+            max_clusters=options['max_clusters'],
+            days=options['days'],
+            threshold=options['threshold'],
+            delay=options['delay'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ กลุ่มคำถาม {result['clusters']} กลุ่ม | สร้างคำตอบใหม่ {result['generated']} | "
+            f"ลบคำตอบเก่า {result['removed']}"
+        ))
@@ -0,0 +1,45 @@
+"""
+Management command to delete old chat logs day by day
+Usage:
+    python manage.py prune_chatlogs [--days 90] [--dry-run]
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from aicashier.models import ChatLog
+
+
+class Command(BaseCommand):
+    help = 'ลบ log การคุยกับ AI ที่เก่ากว่าที่กำหนด (ลบทีละวันตาม log_date)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='เก็บ log ย้อนหลังกี่วัน')
+        parser.add_argument('--dry-run', action='store_true', help='แสดงจำนวนที่จะลบโดยไม่ลบจริง')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.localdate() - timedelta(days=options['days'])
+        old_days = list(
+            ChatLog.objects.filter(log_date__lt=cutoff)
+            .order_by('log_date')
+            .values_list('log_date', flat=True)
+            .distinct()
+        )
+        if not old_days:
+            self.stdout.write(self.style.SUCCESS(f'✓ ไม่มี log เก่ากว่า {cutoff}'))
+            return
+
+        total = 0
+        for day in old_days:
+            day_logs = ChatLog.objects.filter(log_date=day)
+            if options['dry_run']:
+                count = day_logs.count()
+            else:
+                count, _ = day_logs.delete()
+            total += count
+            self.stdout.write(f'   {day}: {count} รายการ')
+
+        action = 'จะลบ' if options['dry_run'] else 'ลบแล้ว'
+        self.stdout.write(self.style.SUCCESS(f'✓ {action} {total} รายการ ({len(old_days)} วัน)'))
@@ -0,0 +1,86 @@
+"""
+Management command to export/import versioned snapshots of the RAG vector index
+Usage:
+    python manage.py rag_snapshot export [--path PATH]
+    python manage.py rag_snapshot import [--path PATH] [--replace] [--sync]
+    python manage.py rag_snapshot status [--path PATH]
+"""
+
+import os
+
+import chromadb
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from aicashier.index_snapshot import (
+    compute_catalog_version,
+    export_snapshot,
+    get_index_content_hashes,
+    import_snapshot,
+    read_snapshot_manifest,
+)
+
+COLLECTION_NAME = "products_collection"
+
+
+class Command(BaseCommand):
+    help = 'Export/Import snapshot ของ vector index (vectors + documents + metadata) พร้อม catalog version'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['export', 'import', 'status'])
+        parser.add_argument('--path', default=None, help='ไฟล์ snapshot (ค่าเริ่มต้น: AI_INDEX_SNAPSHOT)')
+        parser.add_argument('--replace', action='store_true', help='ลบข้อมูลเดิมใน index ก่อน import')
+        parser.add_argument('--sync', action='store_true', help='หลัง import ให้ sync สินค้าที่เปลี่ยนจาก DB ทันที')
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.AI_INDEX_SNAPSHOT
+        chroma_path = os.path.join(settings.BASE_DIR, 'data', 'chroma')
+        # เปิด Chroma ตรง ๆ ไม่ต้องโหลดโมเดล embedding
+        client = chromadb.PersistentClient(path=chroma_path)
+        collection = client.get_or_create_collection(COLLECTION_NAME)
+
+        if options['action'] == 'export':
+            self.stdout.write(f' กำลัง export index ({collection.count()} chunks)...')
+            manifest = export_snapshot(collection, path)
+            self.stdout.write(self.style.SUCCESS(
+                f"✓ Export เรียบร้อย: {path}\n"
+                f"  สินค้า {manifest['product_count']} รายการ, {manifest['chunk_count']} chunks, "
+                f"catalog version {manifest['catalog_version'][:12]}"
+            ))
+
+        elif options['action'] == 'import':
+            if not os.path.exists(path):
+                raise CommandError(f'ไม่พบไฟล์ snapshot: {path}')
+            try:
+                manifest = import_snapshot(collection, path, replace=options['replace'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(
+                f"✓ Import เรียบร้อย: {manifest['chunk_count']} chunks "
+                f"(catalog version {manifest['catalog_version'][:12]}, สร้างเมื่อ {manifest['created_at']})"
+            ))
+
+            if options['sync']:
+                from aicashier.rag_service import rag_service
+                if rag_service is None:
+                    raise CommandError('rag_service เป็น None')
+                diff = rag_service.sync_index_with_db()
+                self.stdout.write(self.style.SUCCESS(
+                    f"✓ Sync delta: upsert {len(diff['upsert_ids'])}, delete {len(diff['delete_ids'])}"
+                ))
+            else:
+                self.stdout.write(' สินค้าที่เปลี่ยนหลังสร้าง snapshot จะถูก sync ตอน boot ครั้งถัดไป')
+
+        else:
+            index_version = compute_catalog_version(get_index_content_hashes(collection))
+            self.stdout.write(f' Index ปัจจุบัน: {collection.count()} chunks, catalog version {index_version[:12]}')
+            if os.path.exists(path):
+                manifest = read_snapshot_manifest(path)
+                match = 'ตรงกัน' if manifest['catalog_version'] == index_version else 'ไม่ตรงกัน'
+                self.stdout.write(
+                    f" Snapshot {path}: {manifest['chunk_count']} chunks, "
+                    f"catalog version {manifest['catalog_version'][:12]} ({match}), "
+                    f"model {manifest['model']}, สร้างเมื่อ {manifest['created_at']}"
+                )
+            else:
+                self.stdout.write(f' ยังไม่มี snapshot ที่ {path}')
@@ -0,0 +1,55 @@
+"""
+Management command to run the shared embedding/search server
+Usage: python manage.py run_embedding_server [--socket PATH] [--threads N]
+"""
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'รัน embedding/search server แบบ process แยก ให้ web worker ใช้โมเดลร่วมกันผ่าน unix socket'
+
+    # ไม่ต้องรัน system checks - checks จะ import views/rag_service ก่อนที่เราจะตั้งค่า process
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=None, help='path ของ unix socket (ค่าเริ่มต้น: AI_EMBEDDING_SOCKET)')
+        parser.add_argument('--threads', type=int, default=None, help='จำนวน torch threads')
+
+    def handle(self, *args, **options):
+        socket_path = (
+            options['socket']
+            or getattr(settings, 'AI_EMBEDDING_SOCKET', '')
+            or os.path.join(settings.BASE_DIR, 'data', 'embedding.sock')
+        )
+
+        if options['threads']:
+            import torch
+            torch.set_num_threads(options['threads'])
+
+        from aicashier import embedding_server
+        if not embedding_server.HAS_UNIX_SOCKETS:
+            self.stdout.write(self.style.ERROR(' Error: ระบบปฏิบัติการนี้ไม่รองรับ unix socket (ใช้โมเดล local ใน worker แทน)'))
+            return
+
+        from aicashier.embedding_server import EmbeddingServer, mark_server_process
+
+        # ต้องเรียกก่อน import rag_service เพื่อให้โหลดโมเดล local
+        mark_server_process()
+
+        from aicashier.rag_service import rag_service
+        if rag_service is None:
+            self.stdout.write(self.style.ERROR(' Error: rag_service เป็น None'))
+            return
+
+        server = EmbeddingServer(socket_path, rag_service)
+        self.stdout.write(self.style.SUCCESS(f'✓ Embedding server listening on {socket_path} (pid {os.getpid()})'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(' กำลังปิด embedding server...')
+        finally:
+            server.server_close()
@@ -1,14 +1,48 @@
 # aicashier/management/commands/sync_ai.py
 
-from django.core.management.base import BaseCommand
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from aicashier.models import Product
 import sys
 import time  
 
+COLLECTION_NAME = "products_collection"
+
+
 class Command(BaseCommand):
     help = 'Sync product data to RAG Vector Database'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--changed-since',
+            nargs='?',
+            const='last',
+            default=None,
+            help='Sync แบบ incremental: เวลา (ISO) หรือ "last" = ต่อจาก watermark ครั้งก่อน'
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='เทียบ content hash ของสินค้าทุกตัว (จับการแก้ที่ไม่ผ่าน signal เช่น queryset.update())'
+        )
+        parser.add_argument(
+            '--verify-interval',
+            type=int,
+            default=60,
+            help='นาที - ถ้า verify ครั้งล่าสุดเก่ากว่านี้จะ verify ทั้ง catalog ให้อัตโนมัติ (0 = ปิด)'
+        )
+
     def handle(self, *args, **kwargs):
+        if kwargs.get('changed_since'):
+            return self.handle_incremental(kwargs['changed_since'], kwargs['verify'], kwargs['verify_interval'])
+
+        started_at = timezone.now()
         self.stdout.write(" กำลังเตรียมการเชื่อมต่อ AI Service...")
 
         try:
@@ -55,4 +89,103 @@ class Command(BaseCommand):
                 else:
                     self.stdout.write(self.style.ERROR(f"    Sync ล้มเหลว: {p.name} ({e})"))
 
-        self.stdout.write(self.style.SUCCESS(f"\n เสร็จสิ้น! Sync ข้อมูลไปแล้ว {success}/{total} รายการ"))
\ No newline at end of file
+        # รอ index writer เขียนงานที่เข้าคิวไว้ให้เสร็จ
+        self.stdout.write(" กำลังรอเขียนข้อมูลลง Vector Database...")
+        rag_service.index_writer.flush()
+        if success == total:
+            self._write_watermark(started_at, verified=True)
+
+        self.stdout.write(self.style.SUCCESS(f"\n เสร็จสิ้น! Sync ข้อมูลไปแล้ว {success}/{total} รายการ"))
+
+    # ===== Incremental =====
+    def _read_watermark(self):
+        try:
+            with open(settings.AI_SYNC_WATERMARK) as f:
+                data = json.load(f)
+            return {key: parse_datetime(value) for key, value in data.items() if value}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_watermark(self, synced_at, verified=False):
+        data = {key: value.isoformat() for key, value in self._read_watermark().items()}
+        data['synced_at'] = synced_at.isoformat()
+        if verified:
+            data['verified_at'] = synced_at.isoformat()
+
+        path = settings.AI_SYNC_WATERMARK
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def handle_incremental(self, changed_since, verify, verify_interval):
+        import chromadb
+        from aicashier.index_snapshot import get_db_content_hashes, get_index_content_hashes
+
+        # เวลาที่เริ่มอ่าน DB - สินค้าที่แก้ระหว่างรันจะถูกเก็บในรอบถัดไป
+        started_at = timezone.now()
+        watermark = self._read_watermark()
+
+        if changed_since == 'last':
+            since = watermark.get('synced_at')
+        else:
+            since = parse_datetime(changed_since)
+            if since is None:
+                raise CommandError(f'รูปแบบเวลาไม่ถูกต้อง: {changed_since}')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        verified_at = watermark.get('verified_at')
+        if since is None or (verify_interval and (
+                verified_at is None or started_at - verified_at > timedelta(minutes=verify_interval))):
+            verify = True
+
+        # อ่าน index ตรง ๆ (metadata อย่างเดียว) - ไม่ต้องโหลดโมเดลถ้าไม่มีอะไรเปลี่ยน
+        chroma_path = os.path.join(settings.BASE_DIR, 'data', 'chroma')
+        collection = chromadb.PersistentClient(path=chroma_path).get_or_create_collection(COLLECTION_NAME)
+        index_hashes = get_index_content_hashes(collection)
+
+        if verify:
+            db_hashes = get_db_content_hashes()
+            db_ids = set(db_hashes)
+            upsert_ids = [pid for pid, h in db_hashes.items() if index_hashes.get(pid) != h]
+            self.stdout.write(f" Verify ทั้ง catalog: {len(db_hashes)} รายการ")
+        else:
+            db_ids = {str(pid) for pid in Product.objects.values_list('id', flat=True)}
+            changed_ids = Product.objects.filter(updated_at__gte=since).values_list('id', flat=True)
+            changed_hashes = get_db_content_hashes(changed_ids)
+            upsert_ids = [pid for pid, h in changed_hashes.items() if index_hashes.get(pid) != h]
+            # สินค้าที่ยังไม่เคยอยู่ใน index (เช่น โหลดจาก fixture โดยไม่ผ่าน signal)
+            upsert_ids += [pid for pid in db_ids if pid not in index_hashes and pid not in changed_hashes]
+            self.stdout.write(f" สินค้าที่แก้ไขตั้งแต่ {since.isoformat()}: {len(changed_hashes)} รายการ")
+
+        delete_ids = [pid for pid in index_hashes if pid not in db_ids]
+
+        if not upsert_ids and not delete_ids:
+            self._write_watermark(started_at, verified=verify)
+            self.stdout.write(self.style.SUCCESS(" Index ตรงกับ DB แล้ว ไม่มีอะไรต้อง sync"))
+            return
+
+        self.stdout.write(f" ต้อง upsert {len(upsert_ids)} รายการ, ลบ vectors ที่ไม่มีสินค้าแล้ว {len(delete_ids)} รายการ")
+        try:
+            from aicashier.index_writer import DELETE
+            from aicashier.rag_service import rag_service
+            if rag_service is None:
+                raise CommandError('rag_service เป็น None')
+        except CommandError:
+            raise
+        except Exception as e:
+            raise CommandError(f'Error Service: {e}')
+
+        if delete_ids:
+            rag_service.index_writer.submit([(DELETE, pid, None) for pid in delete_ids])
+        if upsert_ids:
+            rag_service.upsert_products_in_rag(upsert_ids)
+
+        if not rag_service.index_writer.flush():
+            raise CommandError('เขียน index ไม่สำเร็จ - watermark ไม่ถูกเลื่อน')
+        self._write_watermark(started_at, verified=verify)
+        self.stdout.write(self.style.SUCCESS(
+            f" เสร็จสิ้น! upsert {len(upsert_ids)}, ลบ {len(delete_ids)} รายการ"
+        ))
\ No newline at end of file
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0014_delete_chatlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('similar', 'สินค้าคล้ายกัน (จาก embedding)')], default='similar', max_length=20)),
+                ('rank', models.PositiveSmallIntegerField(help_text='ลำดับ (0 = ใกล้ที่สุด)')),
+                ('score', models.FloatField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='aicashier.product')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='aicashier.product')),
+            ],
+            options={
+                'ordering': ['product', 'kind', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('product', 'kind', 'rank'), name='unique_product_neighbor_rank')],
+            },
+        ),
+    ]
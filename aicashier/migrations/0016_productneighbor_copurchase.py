@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0015_productneighbor'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productneighbor',
+            name='kind',
+            field=models.CharField(choices=[('similar', 'สินค้าคล้ายกัน (จาก embedding)'), ('copurchase', 'ลูกค้าที่ซื้อสินค้านี้มักซื้อด้วย')], default='similar', max_length=20),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0016_productneighbor_copurchase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PregeneratedAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cluster_key', models.CharField(max_length=64, unique=True)),
+                ('kind', models.CharField(choices=[('faq', 'คำถามที่ถามบ่อย'), ('pitch', 'คำทักทาย / แนะนำสินค้าเด่น')], default='faq', max_length=10)),
+                ('query', models.CharField(help_text='คำถามตัวแทนของกลุ่ม', max_length=500)),
+                ('variants', models.JSONField(blank=True, default=list, help_text='คำถามในกลุ่มเดียวกัน')),
+                ('embedding', models.JSONField(blank=True, default=list, help_text='centroid ของคำถามในกลุ่ม (normalize แล้ว)')),
+                ('answer', models.TextField()),
+                ('query_count', models.PositiveIntegerField(default=0, help_text='จำนวนครั้งที่ถูกถามในช่วงที่คำนวณ')),
+                ('catalog_version', models.CharField(max_length=40)),
+                ('settings_version', models.CharField(max_length=40)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-query_count'],
+                'indexes': [models.Index(fields=['catalog_version', 'settings_version'], name='answer_version_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0017_pregeneratedanswer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(help_text='คำถามตัวแทนของกลุ่ม', max_length=500)),
+                ('variants', models.JSONField(blank=True, default=list, help_text='ตัวอย่างคำถามในกลุ่ม (จำกัดจำนวน)')),
+                ('centroid', models.JSONField(default=list, help_text='ค่าเฉลี่ย embedding ของกลุ่ม (normalize แล้ว)')),
+                ('size', models.PositiveIntegerField(default=0, help_text='จำนวนคำถามทั้งหมดที่อยู่ในกลุ่ม')),
+                ('last_log_id', models.BigIntegerField(default=0, help_text='id ล่าสุดของ log ที่ถูกจัดเข้ากลุ่มนี้ (ใช้เป็น watermark)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-size'],
+            },
+        ),
+        migrations.CreateModel(
+            name='QueryClusterDailyCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('cluster', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_counts', to='aicashier.querycluster')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'cluster', 'count'], name='cluster_count_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('cluster', 'date'), name='unique_cluster_date')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0018_querycluster'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(blank=True, default='', max_length=40)),
+                ('channel', models.CharField(choices=[('chat', 'แชท'), ('voice', 'เสียง')], default='chat', max_length=10)),
+                ('user_query', models.TextField(help_text='คำถาม/คำค้นหาของลูกค้า')),
+                ('ai_response', models.TextField(blank=True, default='', help_text='คำตอบจาก AI')),
+                ('source', models.CharField(choices=[('llm', 'LLM'), ('pregenerated', 'คำตอบสำเร็จรูป'), ('cart', 'จัดการตะกร้า'), ('error', 'ผิดพลาด')], default='llm', help_text='คำตอบมาจากไหน', max_length=20)),
+                ('cart_action', models.CharField(blank=True, default='', help_text='add / decrease / delete / clear', max_length=20)),
+                ('stage_latencies', models.JSONField(blank=True, default=dict, help_text='เวลาแต่ละขั้น (ms) เช่น retrieval_ms, llm_ms')),
+                ('total_ms', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0, help_text='จำนวน token โดยประมาณ')),
+                ('completion_tokens', models.PositiveIntegerField(default=0, help_text='จำนวน token โดยประมาณ')),
+                ('log_date', models.DateField(help_text='วันที่ (เวลาท้องถิ่น) - ใช้แบ่งข้อมูลรายวัน')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('customer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='chat_logs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Chat Log',
+                'verbose_name_plural': 'Chat Logs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['log_date', 'channel'], name='chatlog_date_channel_idx'), models.Index(fields=['log_date', 'source'], name='chatlog_date_source_idx'), models.Index(fields=['customer', '-created_at'], name='chatlog_customer_idx')],
+            },
+        ),
+    ]
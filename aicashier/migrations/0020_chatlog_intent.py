@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0019_chatlog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatlog',
+            name='intent',
+            field=models.CharField(blank=True, default='', help_text='intent ของ fast path: price / stock / category / featured', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='chatlog',
+            name='source',
+            field=models.CharField(choices=[('llm', 'LLM'), ('fast_path', 'ตอบจากข้อมูลสินค้าโดยตรง'), ('pregenerated', 'คำตอบสำเร็จรูป'), ('cart', 'จัดการตะกร้า'), ('error', 'ผิดพลาด')], default='llm', help_text='คำตอบมาจากไหน', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0021_chatlog_timeout_source'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatlog',
+            name='source',
+            field=models.CharField(choices=[('llm', 'LLM'), ('fast_path', 'ตอบจากข้อมูลสินค้าโดยตรง'), ('pregenerated', 'คำตอบสำเร็จรูป'), ('cart', 'จัดการตะกร้า'), ('timeout', 'ตอบไม่ทันเวลา (ใช้ข้อความสำเร็จรูป)'), ('fallback', 'LLM ใช้งานไม่ได้ (ใช้คำตอบสำรอง)'), ('error', 'ผิดพลาด')], default='llm', help_text='คำตอบมาจากไหน', max_length=20),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0023_chatlog_shed_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.CharField(help_text='ประเภท: llm / cart', max_length=20)),
+                ('key', models.CharField(help_text='user:<id> / session:<key> / ip:<address>', max_length=100)),
+                ('tokens', models.FloatField(help_text='token ที่เหลือ ณ updated_at')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='rate_limit_updated_idx')],
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'key'), name='unique_rate_limit_bucket')],
+            },
+        ),
+    ]
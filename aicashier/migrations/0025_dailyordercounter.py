@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:39
+
+from django.db import migrations, models
+from django.db.models import Max
+from django.db.models.functions import TruncDate
+
+
+def seed_counters(apps, schema_editor):
+    """ตั้งต้นตัวนับจากเลขออเดอร์ที่ออกไปแล้ว (กันเลขซ้ำกับออเดอร์วันนี้)"""
+    Order = apps.get_model('aicashier', 'Order')
+    DailyOrderCounter = apps.get_model('aicashier', 'DailyOrderCounter')
+    rows = (
+        Order.objects.filter(order_number__isnull=False)
+        .annotate(day=TruncDate('created_at'))
+        .values('day')
+        .annotate(last_number=Max('order_number'))
+    )
+    DailyOrderCounter.objects.bulk_create([
+        DailyOrderCounter(date=row['day'], last_number=row['last_number'])
+        for row in rows if row['day']
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0024_ratelimitbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('last_number', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:48
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0025_dailyordercounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40, unique=True)),
+                ('summary', models.TextField(blank=True, default='', help_text='สรุปบทสนทนาช่วงก่อนหน้า')),
+                ('turns', models.JSONField(blank=True, default=list, help_text="turn ล่าสุด [{'n', 'role', 'content'}]")),
+                ('turn_count', models.PositiveIntegerField(default=0, help_text='จำนวน turn ทั้งหมด (ใช้เป็นเลขลำดับของ turn)')),
+                ('summarizing_since', models.DateTimeField(blank=True, help_text='กำลังสรุปอยู่ตั้งแต่เมื่อไร', null=True)),
+                ('retrieval', models.JSONField(blank=True, help_text="ผล retrieval ล่าสุด {'catalog_version', 'docs'}", null=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='conversation_updated_idx')],
+            },
+        ),
+    ]
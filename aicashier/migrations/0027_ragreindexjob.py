@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0026_conversationstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RAGReindexJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(max_length=12, unique=True)),
+                ('reason', models.CharField(max_length=200)),
+                ('status', models.CharField(choices=[('queued', 'รอเริ่ม'), ('running', 'กำลังทำ'), ('done', 'เสร็จแล้ว'), ('failed', 'ล้มเหลว')], default='queued', max_length=10)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('patched', models.PositiveIntegerField(default=0, help_text='จำนวนสินค้าที่ patch metadata แล้ว')),
+                ('reindexed', models.PositiveIntegerField(default=0, help_text='จำนวนสินค้าที่ embed ใหม่แล้ว')),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at'], name='rag_reindex_created_idx')],
+            },
+        ),
+    ]
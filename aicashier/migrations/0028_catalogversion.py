@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aicashier', '0027_ragreindexjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pregeneratedanswer',
+            name='content_version',
+            field=models.CharField(blank=True, default='', help_text='hash ของข้อมูลสินค้าตอนสร้างคำตอบ (ใช้คำตอบเดิมต่อได้ถ้าเนื้อหาไม่เปลี่ยน)', max_length=40),
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 
 class CustomerManager(BaseUserManager):
@@ -97,20 +98,37 @@ class Order(models.Model):
     
     @staticmethod
     def get_next_order_number():
-        """สร้างหมายเลขออเดอร์ที่รีเซ็ททุกวัน เริ่มจาก 1000"""
-        from django.utils import timezone
-        from datetime import datetime
-        
-        today = timezone.now().date()
-        today_orders = Order.objects.filter(
-            created_at__date=today,
-            order_number__isnull=False
-        ).order_by('-order_number')
-        
-        if today_orders.exists():
-            last_number = today_orders.first().order_number
-            return last_number + 1
-        return 1000
+        """สร้างหมายเลขออเดอร์ที่รีเซ็ททุกวัน เริ่มจาก 1000 (ออกเลขจาก DailyOrderCounter แบบ atomic)"""
+        return DailyOrderCounter.next_number()
+
+
+class DailyOrderCounter(models.Model):
+    """เลขออเดอร์ล่าสุดของแต่ละวัน - ออกเลขด้วย UPDATE ... SET last_number = last_number + 1
+    แถวถูก lock จนจบ transaction ออเดอร์ที่สร้างพร้อมกันจึงไม่ได้เลขซ้ำ
+    """
+    FIRST_NUMBER = 1000
+    
+    date = models.DateField(unique=True)
+    last_number = models.PositiveIntegerField()
+    
+    def __str__(self):
+        return f"{self.date}: {self.last_number}"
+    
+    @classmethod
+    def next_number(cls, date=None):
+        date = date or timezone.localdate()
+        with transaction.atomic():
+            if cls.objects.filter(date=date).update(last_number=models.F('last_number') + 1):
+                return cls.objects.get(date=date).last_number
+            try:
+                # ออเดอร์แรกของวัน
+                with transaction.atomic():
+                    cls.objects.create(date=date, last_number=cls.FIRST_NUMBER)
+                return cls.FIRST_NUMBER
+            except IntegrityError:
+                # มีอีก request สร้างแถวของวันนี้ไปก่อน
+                cls.objects.filter(date=date).update(last_number=models.F('last_number') + 1)
+                return cls.objects.get(date=date).last_number
 
 
 class OrderItem(models.Model):
@@ -326,3 +344,255 @@ class Payment(models.Model):
 
 
 
+
+
+class ProductNeighbor(models.Model):
+    """สินค้าใกล้เคียงที่คำนวณไว้ล่วงหน้า (top-N ต่อสินค้า) - สร้างโดย build_recommendations"""
+    KIND_CHOICES = [
+        ('similar', 'สินค้าคล้ายกัน (จาก embedding)'),
+        ('copurchase', 'ลูกค้าที่ซื้อสินค้านี้มักซื้อด้วย'),
+    ]
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='similar')
+    rank = models.PositiveSmallIntegerField(help_text="ลำดับ (0 = ใกล้ที่สุด)")
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['product', 'kind', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'kind', 'rank'], name='unique_product_neighbor_rank'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} -> {self.neighbor_id} ({self.kind} #{self.rank}: {self.score:.3f})"
+
+
+class CatalogVersion(models.Model):
+    """เลข version ของข้อมูลสินค้า (แถวเดียว) - เพิ่มเมื่อสินค้า / หมวดหมู่ / ชุดสินค้าที่มีของเปลี่ยน
+    ใช้ตรวจว่าคำตอบสำเร็จรูป / ผล retrieval ที่ cache ไว้ยังใช้ได้ โดยไม่ต้อง hash ทั้ง catalog ทุก request
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"catalog v{self.version}"
+    
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+    
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(version=models.F('version') + 1, updated_at=timezone.now()):
+            _, created = cls.objects.get_or_create(pk=1, defaults={'version': 1})
+            if not created:
+                # มีอีก request สร้างแถวไปก่อน
+                cls.objects.filter(pk=1).update(version=models.F('version') + 1, updated_at=timezone.now())
+
+
+class PregeneratedAnswer(models.Model):
+    """คำตอบที่สร้างไว้ล่วงหน้าสำหรับคำถามที่ถามบ่อย (สร้างโดย pregenerate_answers)
+
+    ใช้ได้เฉพาะเมื่อ catalog_version / settings_version ตรงกับปัจจุบัน
+    """
+    KIND_CHOICES = [
+        ('faq', 'คำถามที่ถามบ่อย'),
+        ('pitch', 'คำทักทาย / แนะนำสินค้าเด่น'),
+    ]
+    
+    cluster_key = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='faq')
+    query = models.CharField(max_length=500, help_text="คำถามตัวแทนของกลุ่ม")
+    variants = models.JSONField(default=list, blank=True, help_text="คำถามในกลุ่มเดียวกัน")
+    embedding = models.JSONField(default=list, blank=True, help_text="centroid ของคำถามในกลุ่ม (normalize แล้ว)")
+    answer = models.TextField()
+    query_count = models.PositiveIntegerField(default=0, help_text="จำนวนครั้งที่ถูกถามในช่วงที่คำนวณ")
+    catalog_version = models.CharField(max_length=40)
+    content_version = models.CharField(max_length=40, blank=True, default='',
+                                       help_text="hash ของข้อมูลสินค้าตอนสร้างคำตอบ (ใช้คำตอบเดิมต่อได้ถ้าเนื้อหาไม่เปลี่ยน)")
+    settings_version = models.CharField(max_length=40)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-query_count']
+        indexes = [
+            models.Index(fields=['catalog_version', 'settings_version'], name='answer_version_idx'),
+        ]
+    
+    def __str__(self):
+        return f"[{self.kind}] {self.query[:50]}"
+
+
+class QueryCluster(models.Model):
+    """กลุ่มคำถามของลูกค้าที่ความหมายใกล้กัน (สร้างโดย cluster_queries แบบ incremental)"""
+    label = models.CharField(max_length=500, help_text="คำถามตัวแทนของกลุ่ม")
+    variants = models.JSONField(default=list, blank=True, help_text="ตัวอย่างคำถามในกลุ่ม (จำกัดจำนวน)")
+    centroid = models.JSONField(default=list, help_text="ค่าเฉลี่ย embedding ของกลุ่ม (normalize แล้ว)")
+    size = models.PositiveIntegerField(default=0, help_text="จำนวนคำถามทั้งหมดที่อยู่ในกลุ่ม")
+    last_log_id = models.BigIntegerField(default=0, help_text="id ล่าสุดของ log ที่ถูกจัดเข้ากลุ่มนี้ (ใช้เป็น watermark)")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-size']
+    
+    def __str__(self):
+        return f"{self.label[:50]} ({self.size})"
+
+
+class QueryClusterDailyCount(models.Model):
+    """จำนวนคำถามต่อกลุ่มต่อวัน - หน้า overview อ่านจากตารางนี้แทนการ scan log"""
+    cluster = models.ForeignKey(QueryCluster, on_delete=models.CASCADE, related_name='daily_counts')
+    date = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cluster', 'date'], name='unique_cluster_date'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'cluster', 'count'], name='cluster_count_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.cluster_id} @ {self.date}: {self.count}"
+
+
+class ChatLog(models.Model):
+    """log การคุยกับ AI (แชท / เสียง) แบบ append-only สำหรับ analytics
+
+    เขียนผ่าน chat_log.chat_log_writer (buffer ในหน่วยความจำแล้ว bulk_create เป็น batch)
+    แบ่งข้อมูลตามวันด้วย log_date - prune_chatlogs ลบทีละวัน
+    """
+    CHANNEL_CHOICES = [
+        ('chat', 'แชท'),
+        ('voice', 'เสียง'),
+    ]
+    SOURCE_CHOICES = [
+        ('llm', 'LLM'),
+        ('fast_path', 'ตอบจากข้อมูลสินค้าโดยตรง'),
+        ('pregenerated', 'คำตอบสำเร็จรูป'),
+        ('cart', 'จัดการตะกร้า'),
+        ('timeout', 'ตอบไม่ทันเวลา (ใช้ข้อความสำเร็จรูป)'),
+        ('fallback', 'LLM ใช้งานไม่ได้ (ใช้คำตอบสำรอง)'),
+        ('shed', 'คิว LLM เต็ม (ตัดทิ้ง)'),
+        ('error', 'ผิดพลาด'),
+    ]
+    
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='chat_logs'
+    )
+    session_key = models.CharField(max_length=40, blank=True, default='')
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES, default='chat')
+    user_query = models.TextField(help_text="คำถาม/คำค้นหาของลูกค้า")
+    ai_response = models.TextField(blank=True, default='', help_text="คำตอบจาก AI")
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='llm', help_text="คำตอบมาจากไหน")
+    cart_action = models.CharField(max_length=20, blank=True, default='', help_text="add / decrease / delete / clear")
+    intent = models.CharField(max_length=20, blank=True, default='', help_text="intent ของ fast path: price / stock / category / featured")
+    stage_latencies = models.JSONField(default=dict, blank=True, help_text="เวลาแต่ละขั้น (ms) เช่น retrieval_ms, llm_ms")
+    total_ms = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0, help_text="จำนวน token โดยประมาณ")
+    completion_tokens = models.PositiveIntegerField(default=0, help_text="จำนวน token โดยประมาณ")
+    log_date = models.DateField(help_text="วันที่ (เวลาท้องถิ่น) - ใช้แบ่งข้อมูลรายวัน")
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = 'Chat Log'
+        verbose_name_plural = 'Chat Logs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['log_date', 'channel'], name='chatlog_date_channel_idx'),
+            models.Index(fields=['log_date', 'source'], name='chatlog_date_source_idx'),
+            models.Index(fields=['customer', '-created_at'], name='chatlog_customer_idx'),
+        ]
+    
+    def __str__(self):
+        return f"[{self.channel}] {self.user_query[:50]}"
+
+
+class RateLimitBucket(models.Model):
+    """token bucket ของ rate limit ต่อ client (ใช้ร่วมกันทุก worker) - ดู rate_limit.py"""
+    bucket = models.CharField(max_length=20, help_text="ประเภท: llm / cart")
+    key = models.CharField(max_length=100, help_text="user:<id> / session:<key> / ip:<address>")
+    tokens = models.FloatField(help_text="token ที่เหลือ ณ updated_at")
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'key'], name='unique_rate_limit_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['updated_at'], name='rate_limit_updated_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.bucket}:{self.key} ({self.tokens:.1f})"
+
+
+class ConversationState(models.Model):
+    """บทสนทนาของแต่ละ session (ใช้ร่วมกันทุก worker) - ดู conversation_store.py"""
+    session_key = models.CharField(max_length=40, unique=True)
+    summary = models.TextField(blank=True, default='', help_text="สรุปบทสนทนาช่วงก่อนหน้า")
+    turns = models.JSONField(default=list, blank=True, help_text="turn ล่าสุด [{'n', 'role', 'content'}]")
+    turn_count = models.PositiveIntegerField(default=0, help_text="จำนวน turn ทั้งหมด (ใช้เป็นเลขลำดับของ turn)")
+    summarizing_since = models.DateTimeField(null=True, blank=True, help_text="กำลังสรุปอยู่ตั้งแต่เมื่อไร")
+    retrieval = models.JSONField(null=True, blank=True, help_text="ผล retrieval ล่าสุด {'catalog_version', 'docs'}")
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='conversation_updated_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.session_key[:8]}... ({len(self.turns)} turns)"
+
+
+class RAGReindexJob(models.Model):
+    """ความคืบหน้าของงาน reindex RAG เบื้องหลัง (ทุก worker เห็นเหมือนกัน) - ดู rag_reindex.py"""
+    STATUS_CHOICES = [
+        ('queued', 'รอเริ่ม'),
+        ('running', 'กำลังทำ'),
+        ('done', 'เสร็จแล้ว'),
+        ('failed', 'ล้มเหลว'),
+    ]
+    
+    job_id = models.CharField(max_length=12, unique=True)
+    reason = models.CharField(max_length=200)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    total = models.PositiveIntegerField(default=0)
+    patched = models.PositiveIntegerField(default=0, help_text="จำนวนสินค้าที่ patch metadata แล้ว")
+    reindexed = models.PositiveIntegerField(default=0, help_text="จำนวนสินค้าที่ embed ใหม่แล้ว")
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='rag_reindex_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.job_id} {self.reason} ({self.status})"
+    
+    def as_dict(self):
+        return {
+            'id': self.job_id,
+            'reason': self.reason,
+            'status': self.status,
+            'total': self.total,
+            'patched': self.patched,
+            'reindexed': self.reindexed,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'error': self.error or None,
+        }
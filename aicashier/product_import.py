@@ -0,0 +1,292 @@
+"""
+นำเข้าสินค้าจำนวนมากจากไฟล์ CSV / JSON Lines / JSON
+
+- อ่านไฟล์แบบ stream ทีละแถว ตรวจข้อมูลทีละแถว (แถวที่ผิดถูกข้ามพร้อมบอกเลขแถว)
+- จอง product_code เป็นช่วง (query รหัสสูงสุดครั้งเดียวต่อ chunk)
+- bulk_create / bulk_update ทีละ chunk
+- index เข้า RAG ครั้งเดียวตอนจบผ่าน bulk_rag_sync (embed เป็น batch)
+ใช้ได้ทั้ง python manage.py import_products และหน้า upload ใน admin
+"""
+
+import csv
+import json
+import logging
+import re
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .index_writer import UPSERT
+from .models import Category, Product
+from .rag_sync_queue import bulk_rag_sync, record_bulk_catalog_change, record_bulk_product
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_CODE_PREFIX = 'P'
+PRODUCT_CODE_RE = re.compile(r'^[A-Za-z]{1,2}\d{4,}$')
+MAX_QUANTITY = 2147483647  # เพดานของ PositiveIntegerField (MySQL)
+UPDATE_FIELDS = ['name', 'description', 'category', 'price', 'quantity', 'image_url', 'ai_information']
+
+
+class ProductImportError(ValueError):
+    """ข้อมูลในแถวไม่ถูกต้อง"""
+
+
+def allocate_product_codes(count, prefix=PRODUCT_CODE_PREFIX, exclude=()):
+    """จองรหัสสินค้าใหม่ count รหัส เช่น P0001, P0002 (query รหัสสูงสุดครั้งเดียว)
+
+    เรียงตามความยาวก่อน เพื่อให้ P10000 มากกว่า P9999
+    """
+    last_code = (
+        Product.objects.filter(product_code__regex=rf'^{prefix}\d+$')
+        .order_by(Length('product_code').desc(), '-product_code')
+        .values_list('product_code', flat=True)
+        .first()
+    )
+    next_number = int(last_code[len(prefix):]) + 1 if last_code else 1
+
+    codes = []
+    exclude = set(exclude)
+    while len(codes) < count:
+        code = f"{prefix}{str(next_number).zfill(4)}"
+        next_number += 1
+        if code not in exclude:
+            codes.append(code)
+    return codes
+
+
+def detect_format(filename):
+    name = (filename or '').lower()
+    if name.endswith('.jsonl') or name.endswith('.ndjson'):
+        return 'jsonl'
+    if name.endswith('.json'):
+        return 'json'
+    return 'csv'
+
+
+def iter_rows(text_stream, fmt):
+    """คืน (เลขแถว, dict) ทีละแถวโดยไม่โหลดทั้งไฟล์ (ยกเว้น .json ที่เป็น array)"""
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(text_stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except ValueError as e:
+                yield line_num, ProductImportError(f"JSON ไม่ถูกต้อง: {e}")
+    elif fmt == 'json':
+        data = json.load(text_stream)
+        if isinstance(data, dict):
+            data = data.get('products', [])
+        for index, row in enumerate(data, start=1):
+            yield index, row
+    else:
+        raise ValueError(f"ไม่รองรับรูปแบบไฟล์: {fmt}")
+
+
+class ProductImporter:
+    """นำเข้าสินค้าทีละ chunk - ถ้ารหัสสินค้ามีอยู่แล้วจะอัปเดต (update_existing=True)"""
+
+    def __init__(self, chunk_size=500, update_existing=True, dry_run=False, wait_for_index=False,
+                 progress_callback=None):
+        self.chunk_size = chunk_size
+        self.update_existing = update_existing
+        self.dry_run = dry_run
+        self.wait_for_index = wait_for_index
+        self.progress_callback = progress_callback
+        self._categories = {}
+        self.stats = {
+            'rows': 0,
+            'created': 0,
+            'updated': 0,
+            'skipped': 0,
+            'errors': [],
+            'elapsed': 0.0,
+            'rows_per_sec': 0.0,
+        }
+
+    # ===== Validation =====
+    def _get_category(self, name):
+        name = (name or '').strip()
+        if not name:
+            return None
+        if name not in self._categories:
+            if self.dry_run:
+                self._categories[name] = Category.objects.filter(name=name).first() or Category(name=name)
+            else:
+                self._categories[name], _ = Category.objects.get_or_create(name=name)
+        return self._categories[name]
+
+    def clean_row(self, row):
+        if isinstance(row, Exception):
+            raise row
+        if not isinstance(row, dict):
+            raise ProductImportError("แถวต้องเป็น object")
+        row = {str(k).strip().lower(): v for k, v in row.items() if k is not None}
+
+        name = str(row.get('name') or '').strip()
+        if not name:
+            raise ProductImportError("ไม่มีชื่อสินค้า (name)")
+        if len(name) > 200:
+            raise ProductImportError("ชื่อสินค้ายาวเกิน 200 ตัวอักษร")
+
+        try:
+            price = Decimal(str(row.get('price', '')).strip().replace(',', ''))
+        except InvalidOperation:
+            raise ProductImportError(f"ราคาไม่ถูกต้อง: {row.get('price')!r}")
+        if not price.is_finite():
+            # NaN / Infinity - เทียบค่าไม่ได้ (price < 0 จะ raise InvalidOperation)
+            raise ProductImportError(f"ราคาไม่ถูกต้อง: {row.get('price')!r}")
+        if price < 0 or price >= Decimal('100000000'):
+            raise ProductImportError(f"ราคาไม่ถูกต้อง: {price}")
+
+        quantity_raw = row.get('quantity')
+        try:
+            quantity = int(str(quantity_raw).strip()) if quantity_raw not in (None, '') else 0
+        except ValueError:
+            raise ProductImportError(f"จำนวนไม่ถูกต้อง: {quantity_raw!r}")
+        if quantity < 0:
+            raise ProductImportError("จำนวนต้องไม่ติดลบ")
+        if quantity > MAX_QUANTITY:
+            raise ProductImportError(f"จำนวนมากเกินไป: {quantity}")
+
+        product_code = str(row.get('product_code') or '').strip().upper() or None
+        if product_code and not PRODUCT_CODE_RE.match(product_code):
+            raise ProductImportError(f"รหัสสินค้าไม่ถูกต้อง: {product_code}")
+        # ความยาวเกินคอลัมน์ MySQL จะ raise DataError ทั้ง chunk - ตรวจเป็นรายแถวก่อน
+        if product_code and len(product_code) > Product._meta.get_field('product_code').max_length:
+            raise ProductImportError(f"รหัสสินค้ายาวเกินไป: {product_code}")
+
+        image_url = str(row.get('image_url') or '').strip() or None
+        if image_url and not image_url.startswith(('http://', 'https://')):
+            raise ProductImportError(f"image_url ไม่ถูกต้อง: {image_url}")
+        if image_url and len(image_url) > Product._meta.get_field('image_url').max_length:
+            raise ProductImportError("image_url ยาวเกิน 500 ตัวอักษร")
+
+        category_name = str(row.get('category') or '').strip()
+        if len(category_name) > Category._meta.get_field('name').max_length:
+            raise ProductImportError("ชื่อหมวดหมู่ยาวเกิน 100 ตัวอักษร")
+
+        return {
+            'product_code': product_code,
+            'name': name,
+            'description': str(row.get('description') or '').strip() or None,
+            'category': self._get_category(category_name),
+            'price': price,
+            'quantity': quantity,
+            'image_url': image_url,
+            'ai_information': str(row.get('ai_information') or '').strip() or None,
+        }
+
+    # ===== Import =====
+    def run(self, rows):
+        """rows: iterable ของ (เลขแถว, dict) จาก iter_rows"""
+        started = time.monotonic()
+        with bulk_rag_sync(wait=self.wait_for_index):
+            chunk = []
+            for line_num, row in rows:
+                self.stats['rows'] += 1
+                try:
+                    chunk.append((line_num, self.clean_row(row)))
+                except ProductImportError as e:
+                    self.stats['errors'].append((line_num, str(e)))
+                if len(chunk) >= self.chunk_size:
+                    self._write_chunk(chunk)
+                    chunk = []
+                    self._report(started)
+            if chunk:
+                self._write_chunk(chunk)
+            self._report(started)
+        return self.stats
+
+    def _report(self, started):
+        elapsed = time.monotonic() - started
+        self.stats['elapsed'] = elapsed
+        self.stats['rows_per_sec'] = self.stats['rows'] / elapsed if elapsed > 0 else 0.0
+        if self.progress_callback:
+            self.progress_callback(self.stats)
+
+    def _write_chunk(self, chunk):
+        for attempt in range(2):
+            try:
+                result = self._write_chunk_once(chunk)
+            except IntegrityError as e:
+                # รหัสสินค้าชนกับที่สร้างพร้อมกันจากที่อื่น - จองรหัสใหม่แล้วลองอีกครั้ง
+                if attempt == 0:
+                    logger.warning(f"Product import chunk conflict, retrying: {e}")
+                    continue
+                for line_num, _ in chunk:
+                    self.stats['errors'].append((line_num, f"บันทึกไม่สำเร็จ: {e}"))
+                return
+            # นับสถิติเฉพาะรอบที่บันทึกสำเร็จ (รอบที่ rollback ไม่นับซ้ำ)
+            for key in ('created', 'updated', 'skipped'):
+                self.stats[key] += result[key]
+            self.stats['errors'].extend(result['errors'])
+            return
+
+    def _write_chunk_once(self, chunk):
+        """บันทึก chunk - คืนสถิติของ chunk นี้ (ผู้เรียกนำไปรวมเมื่อสำเร็จ)"""
+        result = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': []}
+
+        # รหัสซ้ำภายในไฟล์: แถวหลังชนะ แถวก่อนหน้ารายงานเป็น error
+        by_code = {}
+        without_code = []
+        for line_num, data in chunk:
+            code = data['product_code']
+            if not code:
+                without_code.append((line_num, data))
+                continue
+            if code in by_code:
+                result['errors'].append((by_code[code][0], f"รหัสสินค้า {code} ซ้ำกับแถว {line_num} (ใช้แถวหลัง)"))
+            by_code[code] = (line_num, data)
+
+        existing = Product.objects.in_bulk(list(by_code), field_name='product_code')
+        to_create, to_update = [], []
+        for code, (line_num, data) in by_code.items():
+            product = existing.get(code)
+            if product is None:
+                to_create.append(Product(**data))
+            elif self.update_existing:
+                for field in UPDATE_FIELDS:
+                    setattr(product, field, data[field])
+                to_update.append(product)
+            else:
+                result['skipped'] += 1
+
+        if without_code:
+            codes = allocate_product_codes(len(without_code), exclude=by_code)
+            for code, (line_num, data) in zip(codes, without_code):
+                to_create.append(Product(**{**data, 'product_code': code}))
+
+        result['created'] = len(to_create)
+        result['updated'] = len(to_update)
+        if self.dry_run:
+            return result
+
+        now = timezone.now()
+        with transaction.atomic():
+            Product.objects.bulk_create(to_create, batch_size=self.chunk_size)
+            if to_update:
+                # bulk_update ไม่ตั้ง auto_now ให้
+                for product in to_update:
+                    product.updated_at = now
+                Product.objects.bulk_update(to_update, UPDATE_FIELDS + ['updated_at'], batch_size=self.chunk_size)
+
+        # bulk_create / bulk_update ไม่ยิง signal - จด id ไว้ index ครั้งเดียวตอนจบ
+        created_codes = [p.product_code for p in to_create]
+        created_ids = Product.objects.filter(product_code__in=created_codes).values_list('id', flat=True)
+        for product_id in list(created_ids) + [p.id for p in to_update]:
+            record_bulk_product(UPSERT, product_id)
+        if to_create or to_update:
+            # ไม่มี signal - ให้ bulk_rag_sync เพิ่ม catalog version / ล้าง cache ครั้งเดียวตอนจบ
+            record_bulk_catalog_change()
+
+        return result
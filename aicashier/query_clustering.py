@@ -0,0 +1,178 @@
+"""
+จัดกลุ่มคำถามของลูกค้าด้วย embedding แบบ incremental (สำหรับหน้า overview / คำตอบสำเร็จรูป)
+
+cluster_queries (รันเป็นระยะ) อ่านเฉพาะ log ใหม่ต่อจาก watermark ทีละ batch
+embed ข้อความที่ไม่ซ้ำใน batch ครั้งเดียว แล้วจัดเข้ากลุ่มที่ centroid ใกล้สุด
+(cosine >= threshold) หรือเปิดกลุ่มใหม่ จำนวนต่อวันเก็บใน QueryClusterDailyCount
+หน้า overview จึงอ่านตารางเล็ก ๆ ที่ index ไว้แทนการ scan log 30 วัน
+"""
+
+import logging
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from .answer_cache import normalize_query
+from .models import QueryCluster, QueryClusterDailyCount
+
+logger = logging.getLogger(__name__)
+
+ASSIGN_THRESHOLD = 0.82
+BATCH_SIZE = 256
+MAX_VARIANTS = 20
+
+
+def _get_log_model():
+    try:
+        return apps.get_model('aicashier', 'ChatLog')
+    except LookupError:
+        return None
+
+
+def _normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def get_watermark():
+    """id ล่าสุดของ log ที่จัดกลุ่มแล้ว (บันทึกใน transaction เดียวกับกลุ่ม จึงไม่นับซ้ำ)"""
+    return QueryCluster.objects.aggregate(last=Max('last_log_id'))['last'] or 0
+
+
+def assign_new_queries(embeddings, threshold=ASSIGN_THRESHOLD, batch_size=BATCH_SIZE, log=print):
+    """จัดกลุ่ม log ที่ยังไม่เคยจัด - คืนค่า {'processed', 'clusters_created'}"""
+    ChatLog = _get_log_model()
+    if ChatLog is None:
+        log("   ยังไม่มีตาราง log คำถาม - ข้าม")
+        return {'processed': 0, 'clusters_created': 0}
+
+    clusters = list(QueryCluster.objects.all())
+    centroids = _normalize_rows([c.centroid for c in clusters]) if clusters else None
+    variant_keys = [{normalize_query(v) for v in c.variants} for c in clusters]
+
+    last_id = get_watermark()
+    processed = 0
+    created = 0
+    while True:
+        rows = list(
+            ChatLog.objects.filter(id__gt=last_id)
+            .order_by('id')
+            .values('id', 'user_query', 'created_at')[:batch_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+
+        # embed เฉพาะข้อความที่ไม่ซ้ำใน batch
+        texts = {}
+        for row in rows:
+            key = normalize_query(row['user_query'])
+            if key:
+                texts.setdefault(key, row['user_query'].strip())
+        if not texts:
+            continue
+        vectors = dict(zip(texts, _normalize_rows(embeddings.embed_documents(list(texts.values())))))
+
+        touched = set()
+        daily = Counter()
+        for row in rows:
+            key = normalize_query(row['user_query'])
+            if not key:
+                continue
+            vector = vectors[key]
+
+            index = None
+            if centroids is not None:
+                scores = centroids @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= threshold:
+                    index = best
+            if index is None:
+                clusters.append(QueryCluster(label=texts[key][:500], variants=[], size=0))
+                variant_keys.append(set())
+                centroids = vector[None, :] if centroids is None else np.vstack([centroids, vector])
+                index = len(clusters) - 1
+                created += 1
+
+            # online mean: centroid ใหม่ = ค่าเฉลี่ยของทุกคำถามในกลุ่ม
+            cluster = clusters[index]
+            merged = centroids[index] * cluster.size + vector
+            centroids[index] = merged / (np.linalg.norm(merged) or 1.0)
+            cluster.size += 1
+            cluster.last_log_id = row['id']
+            if key not in variant_keys[index] and len(cluster.variants) < MAX_VARIANTS:
+                variant_keys[index].add(key)
+                cluster.variants.append(texts[key][:200])
+
+            touched.add(index)
+            daily[(index, timezone.localdate(row['created_at']))] += 1
+            processed += 1
+
+        with transaction.atomic():
+            now = timezone.now()
+            to_update = []
+            for index in touched:
+                cluster = clusters[index]
+                cluster.centroid = centroids[index].tolist()
+                if cluster.pk is None:
+                    cluster.save()
+                else:
+                    cluster.updated_at = now
+                    to_update.append(cluster)
+            QueryCluster.objects.bulk_update(
+                to_update, ['centroid', 'size', 'variants', 'last_log_id', 'updated_at']
+            )
+            _add_daily_counts({(clusters[i].pk, day): n for (i, day), n in daily.items()})
+
+        log(f"   ✓ จัดกลุ่มแล้ว {processed} คำถาม (log id ถึง {last_id}, กลุ่มใหม่ {created})")
+
+    return {'processed': processed, 'clusters_created': created}
+
+
+def _add_daily_counts(counts):
+    """counts: {(cluster_id, date): จำนวนที่เพิ่ม}"""
+    if not counts:
+        return
+    existing = {
+        (row.cluster_id, row.date): row.pk
+        for row in QueryClusterDailyCount.objects.filter(
+            cluster_id__in={cid for cid, _ in counts},
+            date__in={day for _, day in counts}
+        ).only('id', 'cluster_id', 'date')
+    }
+    to_create = []
+    for (cluster_id, day), n in counts.items():
+        pk = existing.get((cluster_id, day))
+        if pk:
+            QueryClusterDailyCount.objects.filter(pk=pk).update(count=F('count') + n)
+        else:
+            to_create.append(QueryClusterDailyCount(cluster_id=cluster_id, date=day, count=n))
+    QueryClusterDailyCount.objects.bulk_create(to_create)
+
+
+def get_top_clusters(days=30, limit=5):
+    """กลุ่มคำถามยอดนิยมในช่วง days วัน - คืนค่า (rows, total)
+
+    rows: [{'cluster_id', 'label', 'count'}] เรียงจากมากไปน้อย
+    """
+    since = timezone.localdate() - timedelta(days=days - 1)
+    recent = QueryClusterDailyCount.objects.filter(date__gte=since)
+    rows = list(
+        recent.values('cluster_id', label=F('cluster__label'))
+        .annotate(count=Sum('count'))
+        .order_by('-count')[:limit]
+    )
+    total = recent.aggregate(total=Sum('count'))['total'] or 0
+    return rows, total
+
+
+def rebuild_clusters():
+    """ลบกลุ่มทั้งหมด - รอบถัดไปจะจัดกลุ่ม log ใหม่ทั้งหมดตั้งแต่ต้น"""
+    deleted, _ = QueryCluster.objects.all().delete()
+    return deleted
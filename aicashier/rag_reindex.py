@@ -0,0 +1,100 @@
+"""
+Reindex สินค้าใน RAG แบบเป็น batch เบื้องหลัง (เช่น เมื่อเปลี่ยนชื่อ / ลบหมวดหมู่)
+
+1. patch metadata ของทุกสินค้าที่เกี่ยวข้องก่อน (ไม่ต้อง embed - เห็นผลทันที)
+2. embed ข้อความใหม่ทีละ batch ผ่าน index writer
+ความคืบหน้าเก็บในตาราง RAGReindexJob (ทุก worker เห็นเหมือนกัน) ดูได้ที่ /api/rag/reindex-status/
+"""
+
+import logging
+import random
+import threading
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .index_writer import PATCH, UPSERT
+from .models import RAGReindexJob
+
+logger = logging.getLogger(__name__)
+
+JOB_RETENTION = timedelta(days=1)
+CLEANUP_PROBABILITY = 0.1
+MAX_LISTED_JOBS = 20
+
+
+def _save_progress(job_id, **fields):
+    RAGReindexJob.objects.filter(job_id=job_id).update(**fields)
+
+
+def get_reindex_progress(job_id=None):
+    """คืน progress ของ job เดียว หรือ job ล่าสุดทั้งหมด (ใหม่สุดก่อน)"""
+    if job_id:
+        job = RAGReindexJob.objects.filter(job_id=job_id).first()
+        return job.as_dict() if job else None
+    return [job.as_dict() for job in RAGReindexJob.objects.all()[:MAX_LISTED_JOBS]]
+
+
+def start_reindex(product_ids, reason, metadata_patch=None, batch_size=64):
+    """เริ่ม reindex หลัง transaction commit - คืนค่า job id"""
+    product_ids = [str(pid) for pid in product_ids]
+    job = RAGReindexJob.objects.create(
+        job_id=uuid.uuid4().hex[:12],
+        reason=reason[:200],
+        total=len(product_ids),
+    )
+
+    if random.random() < CLEANUP_PROBABILITY:
+        RAGReindexJob.objects.filter(
+            created_at__lt=timezone.now() - JOB_RETENTION, status__in=['done', 'failed']
+        ).delete()
+
+    def _start():
+        threading.Thread(
+            target=_run_reindex,
+            args=(job.job_id, reason, product_ids, metadata_patch, batch_size),
+            name=f"rag-reindex-{job.job_id}",
+            daemon=True
+        ).start()
+
+    transaction.on_commit(_start)
+    return job.job_id
+
+
+def _run_reindex(job_id, reason, product_ids, metadata_patch, batch_size):
+    from django.db import connection
+    from .signals import get_rag_service
+
+    status, error = 'running', ''
+    try:
+        _save_progress(job_id, status=status)
+
+        rag_service = get_rag_service()
+        if rag_service is None:
+            raise RuntimeError("RAG service not available")
+        writer = rag_service.index_writer
+
+        if metadata_patch:
+            writer.submit([(PATCH, pid, metadata_patch) for pid in product_ids], wait=True)
+            _save_progress(job_id, patched=len(product_ids))
+
+        reindexed = 0
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            writer.submit([(UPSERT, pid, None) for pid in batch], wait=True)
+            reindexed += len(batch)
+            _save_progress(job_id, reindexed=reindexed)
+            print(f"[RAGReindex] {reason}: {reindexed}/{len(product_ids)}")
+
+        status = 'done'
+    except Exception as e:
+        logger.error(f"RAG reindex job {job_id} failed: {e}", exc_info=True)
+        status, error = 'failed', str(e)
+    finally:
+        try:
+            _save_progress(job_id, status=status, error=error, finished_at=timezone.now())
+        except Exception as e:
+            logger.error(f"Could not save RAG reindex job {job_id}: {e}")
+        connection.close()
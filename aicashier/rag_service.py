@@ -2,15 +2,119 @@ import os
 from dotenv import load_dotenv
 import chromadb
 import re
+import threading
+import time
+from collections import OrderedDict
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_google_genai import GoogleGenerativeAI
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from django.conf import settings
 from django.apps import apps
+from .embedding_server import (
+    EMBEDDING_MODEL_NAME,
+    HAS_UNIX_SOCKETS,
+    EmbeddingClient,
+    EmbeddingServerError,
+    is_server_process,
+)
+from .circuit_breaker import CircuitOpenError, llm_breaker
+from .deadline import DeadlineExceeded
+from .llm_scheduler import BUSY_MESSAGE, CHAT, LLMOverloaded, llm_scheduler
+from .embedding_cache import CachedEmbeddings, EmbeddingCache
+from .index_writer import DELETE, PATCH, UPSERT, IndexWriter, RemoteIndexWriter
+from .index_snapshot import (
+    ai_chunk_id,
+    compute_catalog_version,
+    get_db_content_hashes,
+    get_index_content_hashes,
+    import_snapshot,
+    product_content_hash,
+)
 
 load_dotenv()
 
+# ผล retrieval ล่าสุดต่อคำถาม - ใช้แทนเมื่อ embed / ค้นหาช้าเกิน deadline
+RETRIEVAL_CACHE_SIZE = 256
+RETRIEVAL_CACHE_TTL = 10 * 60
+
+# คำถามต่อเนื่องที่อ้างถึงสินค้าจากรอบก่อน ("แล้วอันนี้ล่ะ", "เอาอันเดิม")
+FOLLOW_UP_RE = re.compile(r'อันนี้|อันนั้น|อันเดิม|ตัวนี้|ตัวนั้น|ตัวเดิม|แบบนี้|แบบเดิม|เหมือนเดิม|เมื่อกี้|ล่ะ|ละครับ|ละคะ')
+FOLLOW_UP_FRESH_K = 3  # คำถามต่อเนื่องที่พูดถึงสินค้าใหม่ ค้นเพิ่มแค่นี้แล้วรวมกับผลเดิม
+CONVERSATION_DOCS_LIMIT = 10  # ผล retrieval ที่เก็บไว้ให้รอบถัดไป - เฉพาะ id + คะแนนของสินค้าอันดับต้น ๆ
+
+LLM_UNAVAILABLE_MESSAGE = "ขออภัยครับ ตอนนี้ระบบ AI ตอบช้ากว่าปกติ ขอแนะนำข้อมูลสินค้าเบื้องต้นไปก่อนนะครับ"
+
+
+def create_local_embeddings():
+    """โหลดโมเดล embedding จากไฟล์ในเครื่อง (ใช้ทั้งใน web worker และ embedding server)"""
+    model_path = os.path.join(
+        settings.BASE_DIR, 
+        'aicashier', 
+        'models', 
+        EMBEDDING_MODEL_NAME
+    )
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"ไม่เจอไฟล์โมเดลที่ {model_path}")
+    
+    embeddings = HuggingFaceEmbeddings(
+        model_name=model_path,
+        model_kwargs={'device': 'cpu'}
+    )
+
+    # chunk ที่เคย embed แล้วอ่านจาก cache บนดิสก์แทนการรันโมเดลซ้ำ
+    cache_dir = getattr(settings, 'AI_EMBEDDING_CACHE_DIR', '')
+    if cache_dir:
+        try:
+            cache = EmbeddingCache(cache_dir, EMBEDDING_MODEL_NAME)
+            print(f"[RAG] Embedding cache: {cache.stats()['entries']} entries at {cache.cache_dir}")
+            return CachedEmbeddings(embeddings, cache)
+        except Exception as e:
+            print(f"[RAG] Embedding cache disabled: {e}")
+    return embeddings
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embeddings ที่ส่งงานไป embedding server และ fallback เป็นโมเดล local เมื่อ server ล่ม
+
+    โมเดล local จะถูกโหลดเฉพาะตอนที่ต้อง fallback จริงเท่านั้น
+    """
+
+    def __init__(self, client, fallback_factory=None):
+        self.client = client
+        self._fallback_factory = fallback_factory
+        self._fallback = None
+        self._fallback_lock = threading.Lock()
+
+    def _get_fallback(self):
+        if self._fallback is None and self._fallback_factory is not None:
+            with self._fallback_lock:
+                if self._fallback is None:
+                    print("[EmbeddingClient] Loading local embeddings for fallback...")
+                    self._fallback = self._fallback_factory()
+        return self._fallback
+
+    def embed_documents(self, texts):
+        try:
+            return self.client.embed_documents(texts)
+        except EmbeddingServerError:
+            fallback = self._get_fallback()
+            if fallback is None:
+                raise
+            return fallback.embed_documents(texts)
+
+    def embed_query(self, text):
+        try:
+            return self.client.embed_query(text)
+        except EmbeddingServerError:
+            fallback = self._get_fallback()
+            if fallback is None:
+                raise
+            return fallback.embed_query(text)
+
+
 # ===== Voice Command Management =====
 class VoiceCommandManager:
     """จัดการคำสั่งเสียง (เพิ่ม/ลบ/เอาออก) จากฐานข้อมูล AISettings"""
@@ -72,21 +176,25 @@ class VoiceCommandManager:
 class RAGService:
     def __init__(self):
         self.api_key = os.getenv('GEMINI_API_KEY')
+        self.embedding_client = None
         try:
-            model_path = os.path.join(
-                settings.BASE_DIR, 
-                'aicashier', 
-                'models', 
-                'paraphrase-multilingual-MiniLM-L12-v2'
-            )
-            if not os.path.exists(model_path):
-                raise FileNotFoundError(f"ไม่เจอไฟล์โมเดลที่ {model_path}")
-            
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=model_path,
-                model_kwargs={'device': 'cpu'}
-            )
-            print("Using local HuggingFace embeddings")
+            socket_path = getattr(settings, 'AI_EMBEDDING_SOCKET', '')
+            if socket_path and not HAS_UNIX_SOCKETS:
+                print("AI_EMBEDDING_SOCKET ignored: unix sockets are not supported on this platform")
+            if socket_path and HAS_UNIX_SOCKETS and not is_server_process():
+                # ใช้โมเดลร่วมกับ worker อื่นผ่าน embedding server (โหลด local เฉพาะตอน fallback)
+                self.embedding_client = EmbeddingClient(
+                    socket_path,
+                    timeout=getattr(settings, 'AI_EMBEDDING_TIMEOUT', 5.0)
+                )
+                self.embeddings = RemoteEmbeddings(
+                    self.embedding_client,
+                    fallback_factory=create_local_embeddings
+                )
+                print(f"Using shared embedding server at {socket_path}")
+            else:
+                self.embeddings = create_local_embeddings()
+                print("Using local HuggingFace embeddings")
         except Exception as e:
             print(f"Error: {e}")
             
@@ -109,7 +217,9 @@ class RAGService:
             self.llm = GoogleGenerativeAI(
                 model="gemini-2.5-flash",
                 google_api_key=self.api_key,
-                temperature=0.5
+                temperature=0.5,
+                # ไม่ให้การเรียกที่ค้าง (เช่น probe ของ circuit breaker) ถือ thread / คิวไว้ตลอดไป
+                timeout=getattr(settings, 'AI_LLM_TIMEOUT_SECONDS', 20),
             )
             print("Using Google Gemini LLM")
         except Exception as e:
@@ -118,8 +228,19 @@ class RAGService:
         
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
         
+        self._retrieval_cache = OrderedDict()
+        self._retrieval_cache_lock = threading.Lock()
+        
+        # Single writer - ทุกการแก้ไข index ต้องผ่านตัวนี้
+        self._embeddings_changed = set()
+        self.index_writer = IndexWriter(self)
+        if self.embedding_client:
+            self.index_writer = RemoteIndexWriter(self.embedding_client, fallback=self.index_writer)
+        
         # Load products from database into RAG 
-        self._load_products_from_db_optimized()
+        # (ถ้าใช้ embedding server ตัว server เป็นผู้โหลด/เขียน index เอง)
+        if not self.embedding_client:
+            self._load_products_from_db_optimized()
         
         # Load voice commands from settings
         self.voice_commands = VoiceCommandManager.get_voice_commands()
@@ -129,33 +250,81 @@ class RAGService:
     def _load_products_from_db_optimized(self):
         
         try:
-            # Check if collection already has products
             collection = self.chroma_client.get_collection(self.collection_name)
             existing_count = collection.count()
             
-            if existing_count > 0:
-                print(f"ChromaDB already has {existing_count} products loaded, skipping reload")
-                return
-            else:
-                print(f"ChromaDB empty, loading products from database...")
-                self._load_products_from_db()
+            if existing_count == 0:
+                snapshot_path = getattr(settings, 'AI_INDEX_SNAPSHOT', '')
+                if snapshot_path and os.path.exists(snapshot_path):
+                    # node ใหม่: โหลด vectors จาก snapshot แทนการ embed ทั้ง catalog
+                    print(f"ChromaDB empty, loading snapshot {snapshot_path}...")
+                    manifest = import_snapshot(collection, snapshot_path)
+                    print(f"Snapshot loaded: {manifest['chunk_count']} chunks "
+                          f"(catalog version {manifest['catalog_version'][:12]})")
+                else:
+                    print(f"ChromaDB empty, loading products from database...")
+                    self._load_products_from_db()
+                    return
+            
+            # เทียบ catalog version กับ DB แล้ว sync เฉพาะส่วนที่ต่าง
+            self.sync_index_with_db()
         except Exception as e:
-            print(f"Initializing collection, loading products from database...")
+            print(f"Initializing collection, loading products from database... ({e})")
             try:
                 self._load_products_from_db()
             except Exception as load_error:
                 print(f"Error loading products: {load_error}")
     
-    def _load_products_from_db(self):
+    def get_db_content_hashes(self):
+        return get_db_content_hashes()
+    
+    def diff_index_against_db(self):
+        """หาสินค้าที่ต้อง embed ใหม่ และ vectors ที่ต้องลบ (สินค้าถูกลบจาก DB แล้ว)"""
+        collection = self.chroma_client.get_collection(self.collection_name)
+        index_hashes = get_index_content_hashes(collection)
+        db_hashes = self.get_db_content_hashes()
+        
+        upsert_ids = [pid for pid, h in db_hashes.items() if index_hashes.get(pid) != h]
+        delete_ids = [pid for pid in index_hashes if pid not in db_hashes]
+        return {
+            'upsert_ids': upsert_ids,
+            'delete_ids': delete_ids,
+            'db_version': compute_catalog_version(db_hashes),
+            'index_version': compute_catalog_version(index_hashes),
+        }
+    
+    def sync_index_with_db(self, batch_size=64):
+        """ทำให้ index ตรงกับ DB โดยเขียนเฉพาะ delta (ใช้ตอน boot ใน process ที่เป็น writer)"""
+        diff = self.diff_index_against_db()
+        if diff['db_version'] == diff['index_version']:
+            print(f"ChromaDB up to date (catalog version {diff['db_version'][:12]}), skipping reload")
+            return diff
+        
+        print(f"ChromaDB stale: {len(diff['upsert_ids'])} to upsert, {len(diff['delete_ids'])} to delete")
+        if diff['delete_ids']:
+            self._apply_deletes(diff['delete_ids'])
+        upsert_ids = diff['upsert_ids']
+        for start in range(0, len(upsert_ids), batch_size):
+            self._apply_upserts(upsert_ids[start:start + batch_size])
+        return diff
+    
+    def _load_products_from_db(self, batch_size=64):
         try:
             
             Product = apps.get_model('aicashier', 'Product')
-            products = Product.objects.all()
+            products = Product.objects.select_related('category').all()
             
             count = 0
-            for product in products:
-                self.add_product_to_rag(product)
-                count += 1
+            batch = []
+            for product in products.iterator(chunk_size=batch_size):
+                batch.append(product)
+                if len(batch) >= batch_size:
+                    self.add_products_to_rag(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self.add_products_to_rag(batch)
+                count += len(batch)
             
             print(f"โหลดข้อมูลสินค้า {count} รายการเข้า RAG")
         except Exception as e:
@@ -173,71 +342,292 @@ class RAGService:
             print(f"[VoiceCommand] Error reloading: {e}")
             return False
     
-    def add_product_to_rag(self, product):
-        try:
-            product_id = str(product.id)
-            try:
-                existing = self.vector_store.get(
-                    where={"product_id": product_id},
-                    limit=1
-                )
-                if existing and existing.get("ids") and len(existing["ids"]) > 0:
-                    print(f"Product {product_id} already exists, deleting old entries first...")
-                    self.vector_store.delete(where={"product_id": product_id})
-            except Exception as check_error:
-                print(f"Note: Could not check for existing product: {check_error}")
-            
-            category_name = product.category.name if product.category else "ไม่มีหมวด"
-            description = product.description if product.description else "-"
-            
-            text_content = f"""
+    def _build_product_documents(self, product):
+        """สร้าง chunks / metadatas / ids ของสินค้า 1 รายการ"""
+        product_id = str(product.id)
+        category_name = product.category.name if product.category else "ไม่มีหมวด"
+        description = product.description if product.description else "-"
+        
+        text_content = f"""
 สินค้า: {product.name}
 หมวดหมู่: {category_name}
 ราคา: {product.price} บาท
 รายละเอียด: {description}
             """
+        
+        chunks = self.text_splitter.split_text(text_content)
+        if not chunks:
+            chunks = [text_content]
+        
+        content_hash = product_content_hash(product)
+        ai_chunks = ",".join(sorted(self._build_ai_info_chunks(product)))
+        metadatas = [{
+            "kind": "product",
+            "product_id": product_id,
+            "name": product.name,
+            "price": str(product.price),
+            "category": category_name,
+            "content_hash": content_hash,
+            "ai_chunks": ai_chunks
+        } for _ in chunks]
+        
+        ids = [f"prod_{product_id}_{i}" for i in range(len(chunks))]
+        return chunks, metadatas, ids
+    
+    def add_products_to_rag(self, products):
+        """เขียนสินค้าหลายรายการลง index ในครั้งเดียว (embed เป็น batch)
+        
+        เป็นการเขียนตรง - ใช้ภายใน IndexWriter เท่านั้น
+        โค้ดส่วนอื่นให้เรียก update_product_in_rag / delete_product_from_rag แทน
+        """
+        products = list(products)
+        if not products:
+            return True
+        try:
+            product_ids = [str(p.id) for p in products]
+            previous_ai_chunks = self._get_ai_chunk_refs(product_ids)
+            try:
+                self.vector_store.delete(where={"product_id": {"$in": product_ids}})
+            except Exception as check_error:
+                print(f"Note: Could not delete old entries: {check_error}")
             
-            chunks = self.text_splitter.split_text(text_content)
-            if not chunks:
-                chunks = [text_content]
-            
-            metadatas = [{
-                "product_id": product_id,
-                "name": product.name,
-                "price": str(product.price),
-                "category": category_name
-            } for _ in chunks]
+            texts, metadatas, ids = [], [], []
+            for product in products:
+                chunks, chunk_metadatas, chunk_ids = self._build_product_documents(product)
+                texts.extend(chunks)
+                metadatas.extend(chunk_metadatas)
+                ids.extend(chunk_ids)
             
-            ids = [f"prod_{product_id}_{i}" for i in range(len(chunks))]
+            self.vector_store.add_texts(texts=texts, metadatas=metadatas, ids=ids)
             
-            self.vector_store.add_texts(texts=chunks, metadatas=metadatas, ids=ids)
-            print(f"Product {product_id} ({product.name}) added to RAG with {len(chunks)} chunks")
+            wanted_ai_chunks = {str(p.id): self._build_ai_info_chunks(p) for p in products}
+            self._sync_ai_info_chunks(wanted_ai_chunks, previous_ai_chunks)
+            print(f"{len(products)} products added to RAG with {len(texts)} chunks")
+            return True
         except Exception as e:
-            print(f"Error adding product to RAG: {e}")
+            print(f"Error adding products to RAG: {e}")
             import traceback
             traceback.print_exc()
+            return False
+    
+    def add_product_to_rag(self, product):
+        return self.add_products_to_rag([product])
+    
+    # ===== ai_information chunks (ใช้ร่วมกันได้หลายสินค้า) =====
+    def _build_ai_info_chunks(self, product):
+        """แบ่ง ai_information เป็น chunk -> {chunk_id: text} (id มาจาก hash ของข้อความ)"""
+        text = (product.ai_information or "").strip()
+        if not text:
+            return {}
+        chunks = {}
+        for chunk in self.text_splitter.split_text(text):
+            normalized = " ".join(chunk.split())
+            if normalized:
+                chunks[ai_chunk_id(normalized)] = normalized
+        return chunks
+    
+    def _get_ai_chunk_refs(self, product_ids):
+        """ai chunk ที่สินค้าแต่ละตัวอ้างอิงอยู่ใน index ตอนนี้ -> {product_id: set(chunk_id)}"""
+        collection = self.chroma_client.get_collection(self.collection_name)
+        existing = collection.get(
+            where={"product_id": {"$in": [str(pid) for pid in product_ids]}},
+            include=["metadatas"]
+        )
+        refs = {}
+        for metadata in existing["metadatas"]:
+            chunk_ids = metadata.get("ai_chunks") or ""
+            refs[metadata["product_id"]] = {cid for cid in chunk_ids.split(",") if cid}
+        return refs
+    
+    def _sync_ai_info_chunks(self, wanted, previous):
+        """ปรับ reference ของ ai chunks และ embed เฉพาะ chunk ที่ยังไม่มีใน index
+        
+        wanted: {product_id: {chunk_id: text}}, previous: {product_id: set(chunk_id)}
+        chunk ที่ไม่มีสินค้าไหนอ้างอิงแล้วจะถูกลบ
+        """
+        chunk_ids = set()
+        for refs in previous.values():
+            chunk_ids.update(refs)
+        for chunks in wanted.values():
+            chunk_ids.update(chunks)
+        if not chunk_ids:
+            return
+        
+        collection = self.chroma_client.get_collection(self.collection_name)
+        existing = collection.get(ids=list(chunk_ids), include=["metadatas"])
+        old_refs = {
+            cid: frozenset(pid for pid in (metadata.get("product_ids") or "").split("|") if pid)
+            for cid, metadata in zip(existing["ids"], existing["metadatas"])
+        }
+        new_refs = {cid: set(pids) for cid, pids in old_refs.items()}
+        texts = {}
+        for product_id, refs in previous.items():
+            for cid in refs:
+                new_refs.get(cid, set()).discard(product_id)
+        for product_id, chunks in wanted.items():
+            for cid, text in chunks.items():
+                new_refs.setdefault(cid, set()).add(product_id)
+                texts[cid] = text
+        
+        def _metadata(pids):
+            return {"kind": "ai_info", "product_ids": "|" + "|".join(sorted(pids, key=int)) + "|"}
+        
+        to_delete = [cid for cid in old_refs if not new_refs[cid]]
+        to_update = [cid for cid in old_refs if new_refs[cid] and new_refs[cid] != old_refs[cid]]
+        to_add = [cid for cid in new_refs if cid not in old_refs and new_refs[cid]]
+        
+        if to_delete:
+            collection.delete(ids=to_delete)
+        if to_update:
+            # chunk เดิมแค่เปลี่ยนรายการสินค้า - ไม่ต้อง embed ใหม่
+            collection.update(ids=to_update, metadatas=[_metadata(new_refs[cid]) for cid in to_update])
+        if to_add:
+            self.vector_store.add_texts(
+                texts=[texts[cid] for cid in to_add],
+                metadatas=[_metadata(new_refs[cid]) for cid in to_add],
+                ids=to_add
+            )
+        if to_delete or to_update or to_add:
+            print(f"[RAG] AI info chunks: +{len(to_add)} ~{len(to_update)} -{len(to_delete)}")
+    
+    # ===== Index mutations (ผ่าน single writer) =====
+    def update_product_in_rag(self, product, wait=False):
+        self.index_writer.submit([(UPSERT, product.id, None)], wait=wait)
+    
+    def upsert_products_in_rag(self, product_ids, wait=False):
+        self.index_writer.submit([(UPSERT, pid, None) for pid in product_ids], wait=wait)
+    
+    def delete_product_from_rag(self, product_id, wait=False):
+        self.index_writer.submit([(DELETE, product_id, None)], wait=wait)
+    
+    def patch_product_metadata(self, product_id, metadata, wait=False):
+        """แก้เฉพาะ metadata โดยไม่ต้อง embed ใหม่"""
+        self.index_writer.submit([(PATCH, product_id, metadata)], wait=wait)
     
-    def update_product_in_rag(self, product):
+    def _apply_upserts(self, product_ids):
+        Product = apps.get_model('aicashier', 'Product')
+        products = Product.objects.select_related('category').in_bulk([int(pid) for pid in product_ids])
+        missing = [pid for pid in product_ids if int(pid) not in products]
+        
+        # ข้ามสินค้าที่ข้อความใน index ยังตรงกับ DB (เช่น save เพราะแก้สต็อก) - ไม่ต้อง embed ซ้ำ
         try:
-            self.delete_product_from_rag(product.id)
-            self.add_product_to_rag(product)
+            collection = self.chroma_client.get_collection(self.collection_name)
+            existing = collection.get(
+                where={"product_id": {"$in": [str(pid) for pid in products]}},
+                include=["metadatas"]
+            )
+            index_hashes = {m.get("product_id"): m.get("content_hash") for m in existing["metadatas"]}
         except Exception as e:
-            print(f"Error updating product in RAG: {e}")
+            print(f"Note: Could not read index hashes: {e}")
+            index_hashes = {}
+        changed = [p for p in products.values() if index_hashes.get(str(p.id)) != product_content_hash(p)]
+        
+        ok = self.add_products_to_rag(changed)
+        if ok:
+            self._embeddings_changed.update(p.id for p in changed)
+        if missing:
+            # สินค้าถูกลบไปแล้วระหว่างรอคิว
+            ok = self._apply_deletes(missing) and ok
+        return ok
     
-    def delete_product_from_rag(self, product_id):
+    def _apply_deletes(self, product_ids):
         try:
-            self.vector_store.delete(where={"product_id": str(product_id)})
-        except Exception:
-            pass
+            previous_ai_chunks = self._get_ai_chunk_refs(product_ids)
+            self.vector_store.delete(where={"product_id": {"$in": [str(pid) for pid in product_ids]}})
+            self._sync_ai_info_chunks({}, previous_ai_chunks)
+            self._embeddings_changed.update(int(pid) for pid in product_ids)
+            return True
+        except Exception as e:
+            print(f"Error deleting products from RAG: {e}")
+            return False
+    
+    def _after_index_batch(self):
+        """เรียกจาก IndexWriter หลังเขียนแต่ละ batch - อัปเดตสินค้าคล้ายกันเฉพาะส่วนที่ได้รับผล"""
+        changed, self._embeddings_changed = self._embeddings_changed, set()
+        if not changed:
+            return
+        try:
+            from .recommendation_service import refresh_similar_items
+            refresh_similar_items(changed, collection=self.chroma_client.get_collection(self.collection_name))
+        except Exception as e:
+            print(f"[Recommend] Could not refresh similar items: {e}")
+    
+    def _apply_metadata_patches(self, patches):
+        try:
+            collection = self.chroma_client.get_collection(self.collection_name)
+            existing = collection.get(
+                where={"product_id": {"$in": [str(pid) for pid in patches]}},
+                include=["metadatas"]
+            )
+            if not existing["ids"]:
+                return True
+            metadatas = [
+                {**metadata, **patches.get(metadata.get("product_id"), {})}
+                for metadata in existing["metadatas"]
+            ]
+            collection.update(ids=existing["ids"], metadatas=metadatas)
+            return True
+        except Exception as e:
+            print(f"Error patching product metadata: {e}")
+            return False
     
     def search_products(self, query: str, k: int = 3):
+        """ค้นหาสินค้า - คืนผลไม่เกิน k รายการ รายการละ 1 สินค้า"""
+        # ถ้ามี embedding server ให้ค้นหาที่ server (ไม่ต้อง embed ใน worker นี้)
+        if self.embedding_client and self.embedding_client.is_available():
+            try:
+                results = self.embedding_client.search(query, k=k)
+                return [
+                    (Document(page_content=r['page_content'], metadata=r['metadata']), r['score'])
+                    for r in results
+                ]
+            except EmbeddingServerError as e:
+                print(f"[RAG] Remote search failed, searching locally: {e}")
+        
         try:
-            results = self.vector_store.similarity_search_with_score(query, k=k)
-            return results
+            # ดึงเผื่อไว้เพราะสินค้าเดียวอาจมีหลาย chunk
+            results = self.vector_store.similarity_search_with_score(query, k=k * 3)
+            return self._group_hits_by_product(results, k)
         except Exception as e:
             print(f"Error searching products: {e}")
             return []
     
+    def _group_hits_by_product(self, results, k):
+        """รวม chunk ที่ค้นเจอให้เหลือผลเดียวต่อสินค้า (ใช้คะแนนที่ดีที่สุด)
+        
+        ai chunk ที่ตรงจะถูกแนบไว้ใน metadata['ai_info'] ของสินค้าทุกตัวที่อ้างอิงมัน
+        """
+        grouped = {}
+        for doc, score in results:
+            metadata = doc.metadata or {}
+            is_ai_info = metadata.get("kind") == "ai_info"
+            if is_ai_info:
+                product_ids = [pid for pid in (metadata.get("product_ids") or "").split("|") if pid]
+            else:
+                product_ids = [metadata.get("product_id") or f"_{len(grouped)}"]
+            
+            for product_id in product_ids:
+                entry = grouped.get(product_id)
+                if entry is None:
+                    base = {"product_id": product_id, "kind": "ai_info"} if is_ai_info else dict(metadata)
+                    entry = grouped[product_id] = {
+                        "doc": Document(page_content=doc.page_content, metadata=base),
+                        "score": score,
+                        "ai_info": [],
+                    }
+                elif not is_ai_info and entry["doc"].metadata.get("kind") == "ai_info":
+                    # เจอ chunk หลักของสินค้าทีหลัง - ใช้ข้อมูลหลักแต่คงคะแนนที่ดีกว่าไว้
+                    entry["doc"] = Document(page_content=doc.page_content, metadata=dict(metadata))
+                if is_ai_info and doc.page_content not in entry["ai_info"]:
+                    entry["ai_info"].append(doc.page_content)
+        
+        grouped_results = []
+        for entry in list(grouped.values())[:k]:
+            if entry["ai_info"]:
+                entry["doc"].metadata["ai_info"] = "\n".join(entry["ai_info"])
+            grouped_results.append((entry["doc"], entry["score"]))
+        return grouped_results
+    
     
     
     def _detect_action_from_voice_commands(self, user_message: str):
@@ -687,98 +1077,166 @@ class RAGService:
         except Exception as e:
             return f"Error formatting product: {e}"
     
-    def rag_query(self, query: str, conversation_history: list = None) -> str:
+    def rag_query(self, query: str, conversation_history: list = None, timings: dict = None,
+                  conversation_summary: str = None, deadline=None, allow_fallback: bool = True,
+                  priority: str = CHAT, conversation_key: str = None) -> str:
+        """timings: ถ้าส่ง dict มา จะเติมเวลาแต่ละขั้น (ms) และจำนวน token โดยประมาณ สำหรับ ChatLog
+        conversation_summary: สรุปบทสนทนาช่วงก่อนหน้า (จาก conversation_store)
+        deadline: ถ้าส่งมา retrieval ที่ช้าจะใช้ผลที่ cache ไว้ และ LLM ที่ช้าจะ raise DeadlineExceeded
+        allow_fallback: วงจร LLM เปิดอยู่ให้ตอบด้วย fallback_answer (timings['llm_fallback'] = True)
+            และคิว LLM เต็มให้ตอบ BUSY_MESSAGE (timings['llm_shed'] = True)
+            ถ้า False จะ raise CircuitOpenError / LLMOverloaded แทน
+        priority: คลาสในคิว LLM (ดู llm_scheduler)
+        conversation_key: session ของบทสนทนา - คำถามต่อเนื่องใช้ผล retrieval ของรอบก่อนได้
+        """
+        if timings is None:
+            timings = deadline.timings if deadline else {}
         try:
             print(f"\n RAG Query: {query}")
             
-            if conversation_history is None:
-                conversation_history = []
-            
-            print(f"Conversation history: {len(conversation_history)} messages")
-            
-            # ดึง AISettings
-            from django.apps import apps
-            AISettings = apps.get_model('aicashier', 'AISettings')
-            ai_settings = AISettings.get_settings()
-            print(f"Loaded AISettings: greeting='{ai_settings.greeting_message[:30]}...', featured_items={sum([1 for x in [ai_settings.featured_item_1, ai_settings.featured_item_2, ai_settings.featured_item_3, ai_settings.featured_item_4] if x])}")
-            
-            # ค้นหาเอกสารจาก ChromaDB (ค้นหาทั้งหมดไม่จำกัด)
-            # ใช้ k=100 เพื่อให้ได้สินค้าทั้งหมดที่มี
-            stats = self.get_collection_stats()
-            max_k = max(10, stats.get('document_count', 10))  # ย่างน้อย 10 รายการ
-            docs = self.search_products(query, k=max_k)
-            
-            if not docs:
-                print("No documents found")
-                return "ขออภัยครับ ไม่พบข้อมูลสินค้าที่เกี่ยวข้อง"
-            
-            # เพิ่มข้อมูลสินค้าที่มีสต็อก ส่วนสินค้าหมดให้บอกว่าหมด
-            Product = apps.get_model('aicashier', 'Product')
-            
-            available_products_text = []
-            out_of_stock_products = []
-            
-            for doc, score in docs:
+            docs = None
+            if deadline:
                 try:
-                    product_id = doc.metadata.get('product_id')
-                    if product_id:
-                        product = Product.objects.get(id=product_id)
-                        if product.quantity > 0:
-                            available_products_text.append(self._format_product_with_stock(product))
-                        else:
-                            out_of_stock_products.append(product.name)
+                    docs = deadline.run(
+                        'retrieval_ms', self.retrieve_for_conversation, query, conversation_key, timings
+                    )
+                except DeadlineExceeded:
+                    docs = self.fallback_docs(query)
+            
+            prompt, answer = self.build_prompt(
+                query, conversation_history, conversation_summary, timings, docs=docs,
+                conversation_key=conversation_key
+            )
+            if answer is not None:
+                return answer
+            return self.generate_answer(prompt, timings, deadline, priority=priority)
+        
+        except DeadlineExceeded:
+            raise
+        except CircuitOpenError as e:
+            if not allow_fallback:
+                raise
+            print(f"[RAG] {e} - using fallback answer")
+            timings['llm_fallback'] = True
+            return self.fallback_answer(query)
+        except LLMOverloaded:
+            if not allow_fallback:
+                raise
+            timings['llm_shed'] = True
+            return BUSY_MESSAGE
+        except Exception as e:
+            print(f"Error in RAG query: {e}")
+            import traceback
+            traceback.print_exc()
+            return f"เกิดข้อผิดพลาด: {str(e)[:50]}"
+    
+    def build_prompt(self, query, conversation_history=None, conversation_summary=None, timings=None, docs=None,
+                     conversation_key=None, still_needed=None):
+        """เตรียม prompt (AISettings + retrieval + ข้อมูลสต็อก + ประวัติ) - ยังไม่เรียก LLM
+        
+        คืน (prompt, None) หรือ (None, คำตอบ) ถ้าตอบได้เลยโดยไม่ต้องใช้ LLM
+        docs: ผล retrieval ที่ได้มาแล้ว (None = ค้นหาเอง)
+        still_needed: callable คืน False เมื่อผู้เรียกจะทิ้งผลนี้แล้ว (เช่นตะกร้าตอบไปก่อน)
+            - ไม่บันทึกผล retrieval และหยุดก่อนเตรียม prompt คืน (None, None)
+        """
+        if timings is None:
+            timings = {}
+        stage_started = time.perf_counter()
+        
+        if conversation_history is None:
+            conversation_history = []
+        
+        print(f"Conversation history: {len(conversation_history)} messages")
+        
+        # ดึง AISettings
+        from django.apps import apps
+        AISettings = apps.get_model('aicashier', 'AISettings')
+        ai_settings = AISettings.get_settings()
+        print(f"Loaded AISettings: greeting='{ai_settings.greeting_message[:30]}...', featured_items={sum([1 for x in [ai_settings.featured_item_1, ai_settings.featured_item_2, ai_settings.featured_item_3, ai_settings.featured_item_4] if x])}")
+        stage_started = self._record_stage(timings, 'settings_ms', stage_started)
+        
+        if docs is None:
+            docs = self.retrieve_for_conversation(query, conversation_key, timings, still_needed=still_needed)
+            stage_started = self._record_stage(timings, 'retrieval_ms', stage_started)
+        if still_needed is not None and not still_needed():
+            return None, None
+        
+        if not docs:
+            print("No documents found")
+            return None, "ขออภัยครับ ไม่พบข้อมูลสินค้าที่เกี่ยวข้อง"
+        
+        # เพิ่มข้อมูลสินค้าที่มีสต็อก ส่วนสินค้าหมดให้บอกว่าหมด
+        Product = apps.get_model('aicashier', 'Product')
+        
+        available_products_text = []
+        out_of_stock_products = []
+        
+        for doc, score in docs:
+            try:
+                product_id = doc.metadata.get('product_id')
+                if product_id:
+                    product = Product.objects.get(id=product_id)
+                    if product.quantity > 0:
+                        product_text = self._format_product_with_stock(product)
+                        if doc.metadata.get('ai_info'):
+                            product_text += f"\nข้อมูลเพิ่มเติม: {doc.metadata['ai_info']}"
+                        available_products_text.append(product_text)
+                    else:
+                        out_of_stock_products.append(product.name)
+            except:
+                # Fallback to original doc content if product not found
+                available_products_text.append(doc.page_content)
+        
+        # สร้าง featured items section
+        featured_products_text = ""
+        featured_items = [ai_settings.featured_item_1, ai_settings.featured_item_2, 
+                        ai_settings.featured_item_3, ai_settings.featured_item_4]
+        featured_items = [item for item in featured_items if item]  # ลบ None
+        
+        if featured_items:
+            featured_products_text = "\n\n **สินค้าแนะนำพิเศษ:**\n"
+            for item in featured_items:
+                try:
+                    if item.quantity > 0:
+                        featured_products_text += f"• {item.name} - ฿{item.price} (เหลือ {item.quantity} ชิ้น)\n"
+                    else:
+                        featured_products_text += f"• {item.name} - ขายหมดแล้ว ( กำลังเตรียม)\n"
                 except:
-                    # Fallback to original doc content if product not found
-                    available_products_text.append(doc.page_content)
-            
-            # สร้าง featured items section
-            featured_products_text = ""
-            featured_items = [ai_settings.featured_item_1, ai_settings.featured_item_2, 
-                            ai_settings.featured_item_3, ai_settings.featured_item_4]
-            featured_items = [item for item in featured_items if item]  # ลบ None
-            
-            if featured_items:
-                featured_products_text = "\n\n **สินค้าแนะนำพิเศษ:**\n"
-                for item in featured_items:
-                    try:
-                        if item.quantity > 0:
-                            featured_products_text += f"• {item.name} - ฿{item.price} (เหลือ {item.quantity} ชิ้น)\n"
-                        else:
-                            featured_products_text += f"• {item.name} - ขายหมดแล้ว ( กำลังเตรียม)\n"
-                    except:
-                        pass
-                print(f"Added {len(featured_items)} featured items")
-            
-            # สร้าง context
-            context_text = "\n\n".join(available_products_text)
-            if not context_text:
-                context_text = "ขณะนี้สินค้าทั้งหมดหมดสต็อก"
-            
-            # รวมข้อมูล out of stock
-            out_of_stock_note = ""
-            if out_of_stock_products:
-                out_of_stock_note = f"\n\n หมดสต็อก: {', '.join(out_of_stock_products)}"
-            
-            print(f"Found {len(docs)} documents, {len(available_products_text)} available")
-            
-            # สร้าง conversation history text
-            history_text = ""
-            if conversation_history:
-                history_text = "\n**ประวัติการสนทนาที่ผ่านมา:**\n"
-                # แสดง last 5 messages เท่านั้น เพื่อไม่ให้ prompt ยาวเกินไป
-                recent_history = conversation_history[-10:]  # last 10 messages
-                for i, item in enumerate(recent_history):
-                    role = "ลูกค้า" if item.get('role') == 'user' else " ร้าน"
-                    content = item.get('content', '')
-                    history_text += f"{role}: {content}\n"
-                print(f"Added {len(recent_history)} messages to history text")
-            else:
-                print(f"No conversation history provided")
-            
-            # สร้าง Prompt พร้อม AISettings และ conversation history
-            sales_steps = ai_settings.sales_steps if ai_settings.sales_steps else "1. ทักทาย\n2. เสนอสินค้า\n3. บอกราคา\n4. ขอบคุณ"
-            
-            prompt = f"""บทบาท: คุณเป็นพนักงานขายของร้าน AI CASHIER
+                    pass
+            print(f"Added {len(featured_items)} featured items")
+        
+        # สร้าง context
+        context_text = "\n\n".join(available_products_text)
+        if not context_text:
+            context_text = "ขณะนี้สินค้าทั้งหมดหมดสต็อก"
+        
+        # รวมข้อมูล out of stock
+        out_of_stock_note = ""
+        if out_of_stock_products:
+            out_of_stock_note = f"\n\n หมดสต็อก: {', '.join(out_of_stock_products)}"
+        
+        print(f"Found {len(docs)} documents, {len(available_products_text)} available")
+        
+        # สร้าง conversation history text
+        history_text = ""
+        if conversation_summary:
+            history_text = f"\n**สรุปบทสนทนาก่อนหน้า:**\n{conversation_summary}\n"
+        if conversation_history:
+            history_text += "\n**ประวัติการสนทนาที่ผ่านมา:**\n"
+            # แสดง last 5 messages เท่านั้น เพื่อไม่ให้ prompt ยาวเกินไป
+            recent_history = conversation_history[-10:]  # last 10 messages
+            for i, item in enumerate(recent_history):
+                role = "ลูกค้า" if item.get('role') == 'user' else " ร้าน"
+                content = item.get('content', '')
+                history_text += f"{role}: {content}\n"
+            print(f"Added {len(recent_history)} messages to history text")
+        else:
+            print(f"No conversation history provided")
+        
+        # สร้าง Prompt พร้อม AISettings และ conversation history
+        sales_steps = ai_settings.sales_steps if ai_settings.sales_steps else "1. ทักทาย\n2. เสนอสินค้า\n3. บอกราคา\n4. ขอบคุณ"
+        
+        prompt = f"""บทบาท: คุณเป็นพนักงานขายของร้าน AI CASHIER
 ทักทาย: {ai_settings.greeting_message}
 โปรโมชั่น: {ai_settings.promotion_text}
 
@@ -798,21 +1256,171 @@ class RAGService:
 กรุณาตอบคำถามให้เป็นมิตรและเป็นประโยชน์ ใช้ภาษาไทยเท่านั้น
 ในการตอบ ให้พิจารณาประวัติการสนทนาที่ผ่านมา เพื่อให้การตอบถูกต้องและสอดคล้องกัน
 **สำคัญ: ห้ามแนะนำหรือสั่งสินค้าที่หมดสต็อก**"""
-            
-            print(f"Prompt prepared with {len(prompt)} characters")
-            
-            # เรียก LLM
-            response = self.llm.invoke(prompt)
-            return response
         
-        except Exception as e:
-            print(f"Error in RAG query: {e}")
-            import traceback
-            traceback.print_exc()
-            return f"เกิดข้อผิดพลาด: {str(e)[:50]}"
+        print(f"Prompt prepared with {len(prompt)} characters")
+        self._record_stage(timings, 'context_ms', stage_started)
+        
+        from .chat_log import estimate_tokens
+        timings['prompt_tokens'] = estimate_tokens(prompt)
+        return prompt, None
+    
+    def generate_answer(self, prompt, timings=None, deadline=None, priority=CHAT):
+        """เรียก LLM ผ่านคิวตามลำดับความสำคัญและ circuit breaker
+        วงจรเปิดอยู่จะ raise CircuitOpenError ทันที, รอคิวนานเกินจะ raise LLMOverloaded
+        ถ้ามี deadline และตอบไม่ทันจะ raise DeadlineExceeded
+        """
+        if timings is None:
+            timings = {}
+        from .chat_log import estimate_tokens
+        stage_started = time.perf_counter()
+        
+        def _invoke():
+            timings['llm_queue_ms'] = int((time.perf_counter() - stage_started) * 1000)
+            return llm_breaker.call(self.llm.invoke, prompt)
+        
+        # เช็คก่อนเข้าคิว - วงจรเปิดอยู่ไม่ต้องรอ
+        llm_breaker.check()
+        if deadline:
+            # รอคิวได้ไม่เกิน budget ของ LLM - หมดเวลาแล้วไม่ต้องเรียกให้เสียโควต้า
+            response = deadline.run(
+                'llm_ms', llm_scheduler.run, priority, _invoke, max_wait=deadline.budget('llm_ms')
+            )
+        else:
+            response = llm_scheduler.run(priority, _invoke)
+            self._record_stage(timings, 'llm_ms', stage_started)
+        timings['completion_tokens'] = estimate_tokens(response)
+        return response
+    
+    def fallback_answer(self, query):
+        """LLM ใช้งานไม่ได้ - ตอบจากคำตอบสำเร็จรูป / ข้อมูลสินค้าโดยตรง / รายการสินค้า ตามลำดับ"""
+        from .answer_cache import find_answer
+        from .intent_router import catalog_answer, route_query
+        
+        answer = find_answer(query, self.embeddings)
+        if answer:
+            return answer
+        routed = route_query(query)
+        if routed:
+            return routed['answer']
+        catalog = catalog_answer()
+        return f"{LLM_UNAVAILABLE_MESSAGE}\n\n{catalog}" if catalog else LLM_UNAVAILABLE_MESSAGE
+    
+    def fallback_docs(self, query):
+        """retrieval ช้าเกิน deadline - ใช้ผลที่ cache ไว้ของคำถามเดียวกัน หรือสินค้าที่มีของแทน"""
+        cached_docs = self._cached_retrieval(query)
+        print(f"[RAG] Retrieval too slow, using {'cached' if cached_docs else 'catalog'} results")
+        return cached_docs or self._catalog_fallback_docs()
+    
+    def retrieve_for_conversation(self, query, conversation_key=None, timings=None, still_needed=None):
+        """retrieval ที่ใช้ผลของรอบก่อนในบทสนทนาเดียวกันซ้ำได้
+        
+        ผลของรอบก่อน = สินค้าอันดับต้น ๆ ไม่เกิน CONVERSATION_DOCS_LIMIT รายการ (id + คะแนน)
+        - คำถามต่อเนื่องที่ไม่ได้พูดถึงสินค้านอกผลเดิม -> ใช้ผลเดิมเลย (ไม่ต้อง embed / ค้นหา)
+        - คำถามต่อเนื่องที่พูดถึงสินค้าใหม่ -> ค้นเพิ่ม FOLLOW_UP_FRESH_K รายการแล้วรวมกับผลเดิม
+        - นอกนั้น หรือ catalog เปลี่ยนแล้ว -> ค้นหาใหม่ทั้งหมด
+        still_needed: ดู build_prompt - คืน False แล้วจะไม่บันทึกผลไว้ให้รอบถัดไป
+        """
+        if not conversation_key:
+            return self._retrieve(query)
+        if timings is None:
+            timings = {}
+        from .answer_cache import current_versions
+        from .conversation_store import conversation_store
+        from .intent_router import find_products
+        
+        catalog_version = current_versions()[0]
+        cached_docs = self._docs_from_json(conversation_store.get_retrieval(conversation_key, catalog_version))
+        if cached_docs:
+            cached_ids = {str(doc.metadata.get('product_id')) for doc, _ in cached_docs}
+            mentioned = find_products(query)
+            new_products = [p for p in mentioned if str(p['id']) not in cached_ids]
+            follow_up = bool(FOLLOW_UP_RE.search(query))
+            if (follow_up or mentioned) and not new_products:
+                print(f"[RAG] Follow-up turn, reusing {len(cached_docs)} documents from previous turn")
+                timings['retrieval_reused'] = 'full'
+                return cached_docs
+            if follow_up:
+                fresh = self.search_products(query, k=FOLLOW_UP_FRESH_K)
+                fresh_ids = {str(doc.metadata.get('product_id')) for doc, _ in fresh}
+                docs = fresh + [(doc, score) for doc, score in cached_docs
+                                if str(doc.metadata.get('product_id')) not in fresh_ids]
+                print(f"[RAG] Follow-up turn, merged {len(fresh)} fresh with {len(cached_docs)} previous documents")
+                timings['retrieval_reused'] = 'merged'
+                self._remember_retrieval(conversation_key, docs, catalog_version, still_needed)
+                return docs
+        
+        docs = self._retrieve(query)
+        if docs:
+            self._remember_retrieval(conversation_key, docs, catalog_version, still_needed)
+        return docs
+    
+    def _remember_retrieval(self, conversation_key, docs, catalog_version, still_needed=None):
+        if still_needed is not None and not still_needed():
+            return
+        from .conversation_store import conversation_store
+        conversation_store.set_retrieval(conversation_key, self._docs_to_json(docs), catalog_version)
+    
+    @staticmethod
+    def _docs_to_json(docs):
+        """เก็บแค่ id + คะแนนของสินค้าอันดับต้น ๆ - รายละเอียดสินค้าโหลดจาก DB ตอนสร้าง prompt อยู่แล้ว"""
+        items = []
+        for doc, score in docs:
+            product_id = doc.metadata.get('product_id')
+            if product_id:
+                items.append({'product_id': str(product_id), 'score': float(score)})
+            if len(items) >= CONVERSATION_DOCS_LIMIT:
+                break
+        return items
+    
+    @staticmethod
+    def _docs_from_json(items):
+        return [
+            (Document(page_content="", metadata={'product_id': item['product_id']}), item['score'])
+            for item in items or [] if item.get('product_id')
+        ]
+    
+    def _retrieve(self, query):
+        # ค้นหาทั้งหมดไม่จำกัด - ใช้จำนวนเอกสารใน collection เพื่อให้ได้สินค้าทั้งหมดที่เกี่ยวข้อง
+        stats = self.get_collection_stats()
+        max_k = max(10, stats.get('document_count', 10))  # ย่างน้อย 10 รายการ
+        docs = self.search_products(query, k=max_k)
+        if docs:
+            key = " ".join(query.lower().split())
+            with self._retrieval_cache_lock:
+                self._retrieval_cache.pop(key, None)
+                self._retrieval_cache[key] = (time.monotonic(), docs)
+                while len(self._retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+                    self._retrieval_cache.popitem(last=False)
+        return docs
+    
+    def _cached_retrieval(self, query):
+        key = " ".join(query.lower().split())
+        with self._retrieval_cache_lock:
+            cached = self._retrieval_cache.get(key)
+        if cached and time.monotonic() - cached[0] < RETRIEVAL_CACHE_TTL:
+            return cached[1]
+        return None
+    
+    def _catalog_fallback_docs(self, limit=30):
+        """ไม่มีผลใน cache - ใช้สินค้าที่มีของล่าสุดเป็น context แทน (ไม่ต้อง embed)"""
+        Product = apps.get_model('aicashier', 'Product')
+        product_ids = Product.objects.filter(quantity__gt=0).order_by('-updated_at').values_list('id', flat=True)[:limit]
+        return [(Document(page_content="", metadata={"product_id": pid}), 0.0) for pid in product_ids]
+    
+    @staticmethod
+    def _record_stage(timings, name, started):
+        now = time.perf_counter()
+        timings[name] = int((now - started) * 1000)
+        return now
     
     def get_collection_stats(self):
         """ดึงสถิติของ collection"""
+        # index จริงอยู่ที่ server (worker อาจเห็นข้อมูลเก่าใน store ของตัวเอง)
+        if self.embedding_client and self.embedding_client.is_available():
+            try:
+                return self.embedding_client.call('stats')
+            except EmbeddingServerError:
+                pass
         try:
             collection = self.chroma_client.get_collection(self.collection_name)
             return {"document_count": collection.count()}
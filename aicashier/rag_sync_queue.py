@@ -0,0 +1,225 @@
+"""
+คิว sync สินค้าเข้า RAG แบบ async
+
+signal ของ Product แค่ใส่ product id เข้าคิวหลัง transaction commit
+thread เบื้องหลังรอสักครู่ (debounce) รวม id ซ้ำ แล้วส่งเป็น batch ให้ index writer
+request ของ admin / checkout จึงไม่ต้องรอโหลดโมเดลหรือ embed
+
+งาน bulk (import, loaddata, แก้หลายสินค้าใน view) ให้ครอบด้วย bulk_rag_sync()
+signal จะแค่จด id ไว้ แล้วส่งเข้าคิวครั้งเดียวตอนออกจาก block
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ContextDecorator
+
+from django.db import transaction
+
+from .index_writer import DELETE, UPSERT
+
+logger = logging.getLogger(__name__)
+
+
+def _get_rag_service():
+    from .signals import get_rag_service
+    return get_rag_service()
+
+
+class RagSyncQueue:
+
+    def __init__(self, debounce=1.0, batch_size=256, retry_delay=5.0, max_attempts=5):
+        self.debounce = debounce
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self._pending = OrderedDict()  # product_id -> op (op ล่าสุดชนะ)
+        self._inflight = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def enqueue(self, op, product_id, using=None):
+        # ใส่คิวหลัง commit เท่านั้น - ถ้า rollback จะไม่มีงานค้าง
+        transaction.on_commit(lambda: self._add([(op, product_id)]), using=using)
+
+    def enqueue_upsert(self, product_id, using=None):
+        self.enqueue(UPSERT, product_id, using=using)
+
+    def enqueue_delete(self, product_id, using=None):
+        self.enqueue(DELETE, product_id, using=using)
+
+    def enqueue_many(self, op, product_ids, using=None):
+        product_ids = list(product_ids)
+        if product_ids:
+            transaction.on_commit(lambda: self._add([(op, pid) for pid in product_ids]), using=using)
+
+    def _add(self, items):
+        with self._cond:
+            for op, product_id in items:
+                key = str(product_id)
+                self._pending.pop(key, None)
+                self._pending[key] = op
+            self._cond.notify_all()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='rag-sync-queue', daemon=True)
+            self._thread.start()
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending) + self._inflight
+
+    def flush(self, timeout=None):
+        """รอจนคิวถูกส่งให้ index writer หมด"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._inflight, timeout)
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+
+            # debounce - save ที่ตามมาติด ๆ (เช่น ย้ายหมวดหลายสินค้า) จะถูกรวมเป็น batch เดียว
+            time.sleep(self.debounce)
+
+            with self._cond:
+                batch = OrderedDict()
+                while self._pending and len(batch) < self.batch_size:
+                    key, op = self._pending.popitem(last=False)
+                    batch[key] = op
+                self._inflight = len(batch)
+
+            try:
+                # โหลด rag_service ใน thread นี้ ไม่ใช่ใน request
+                rag_service = _get_rag_service()
+                if rag_service is None:
+                    raise RuntimeError("RAG service not available")
+                rag_service.index_writer.submit([(op, key, None) for key, op in batch.items()])
+                failures = 0
+                print(f"[RagSyncQueue] Submitted {len(batch)} products to index writer")
+            except Exception as e:
+                failures += 1
+                logger.error(f"RAG sync batch failed (attempt {failures}): {e}")
+                with self._cond:
+                    if failures < self.max_attempts:
+                        # ใส่กลับหน้าคิว ยกเว้นตัวที่มีงานใหม่กว่าเข้ามาแล้ว
+                        for key, op in reversed(batch.items()):
+                            if key not in self._pending:
+                                self._pending[key] = op
+                                self._pending.move_to_end(key, last=False)
+                    else:
+                        # sync_ai --changed-since จะเก็บตกให้ทีหลัง
+                        print(f"[RagSyncQueue] Dropping {len(batch)} products after {failures} attempts")
+                        failures = 0
+                    self._inflight = 0
+                    self._cond.notify_all()
+                time.sleep(self.retry_delay)
+                continue
+
+            with self._cond:
+                self._inflight = 0
+                self._cond.notify_all()
+
+
+rag_sync_queue = RagSyncQueue()
+
+
+# ===== Bulk mode =====
+_bulk_state = threading.local()
+
+
+def is_bulk_active():
+    return getattr(_bulk_state, 'depth', 0) > 0
+
+
+def record_bulk_product(op, product_id):
+    """จด product id ที่ถูกแก้ระหว่าง bulk (op ล่าสุดชนะ)"""
+    key = str(product_id)
+    _bulk_state.products.pop(key, None)
+    _bulk_state.products[key] = op
+
+
+def record_bulk_settings_change():
+    _bulk_state.settings_changed = True
+
+
+def record_bulk_catalog_change():
+    """สินค้า / หมวดหมู่เปลี่ยนระหว่าง bulk - เพิ่ม catalog version ครั้งเดียวตอนออกจาก block"""
+    _bulk_state.catalog_changed = True
+
+
+class bulk_rag_sync(ContextDecorator):
+    """ระงับงาน RAG ต่อแถวของ signal (Product / AISettings) ระหว่างทำงาน bulk
+
+    ใช้เป็น context manager หรือ decorator ก็ได้ ซ้อนกันได้ (block นอกสุดเป็นตัวส่งงาน)
+        with bulk_rag_sync(wait=True):
+            for row in rows: product.save()
+    ตอนออกจาก block จะส่ง id ทั้งหมดเข้าคิว reindex ครั้งเดียว, reload voice commands
+    และเพิ่ม catalog version ครั้งเดียว
+    wait=True จะรอจน index ถูกเขียนเสร็จ (เหมาะกับ management command)
+    """
+
+    def __init__(self, wait=False):
+        self.wait = wait
+
+    def __enter__(self):
+        if not is_bulk_active():
+            _bulk_state.products = OrderedDict()
+            _bulk_state.settings_changed = False
+            _bulk_state.catalog_changed = False
+            _bulk_state.depth = 0
+        _bulk_state.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _bulk_state.depth -= 1
+        if _bulk_state.depth > 0:
+            return False
+
+        products = _bulk_state.products
+        settings_changed = _bulk_state.settings_changed
+        catalog_changed = _bulk_state.catalog_changed
+        _bulk_state.products = OrderedDict()
+        _bulk_state.settings_changed = False
+        _bulk_state.catalog_changed = False
+
+        # ส่งงานแม้มี exception - สินค้าที่ save ไปแล้วก่อน error ต้องถูก sync ด้วย
+        # (id ที่ถูก rollback จะกลายเป็น delete ใน index writer เพราะไม่เจอใน DB)
+        try:
+            upserts = [pid for pid, op in products.items() if op == UPSERT]
+            deletes = [pid for pid, op in products.items() if op == DELETE]
+            rag_sync_queue.enqueue_many(UPSERT, upserts)
+            rag_sync_queue.enqueue_many(DELETE, deletes)
+            if settings_changed:
+                transaction.on_commit(_reload_voice_commands)
+            if catalog_changed:
+                _bump_catalog_version()
+            print(f"[RagSyncQueue] Bulk sync: upsert={len(upserts)}, delete={len(deletes)}, "
+                  f"settings_reload={settings_changed}")
+
+            if self.wait and (products or settings_changed):
+                rag_sync_queue.flush()
+                rag_service = _get_rag_service()
+                if rag_service is not None:
+                    rag_service.index_writer.flush()
+        except Exception as e:
+            logger.error(f"Error scheduling bulk RAG sync: {e}", exc_info=True)
+        return False
+
+
+def _bump_catalog_version():
+    from .answer_cache import invalidate_versions
+    from .intent_router import invalidate_snapshot
+    from .models import CatalogVersion
+
+    CatalogVersion.bump()
+    transaction.on_commit(invalidate_versions)
+    transaction.on_commit(invalidate_snapshot)
+
+
+def _reload_voice_commands():
+    rag_service = _get_rag_service()
+    if rag_service is not None:
+        rag_service.reload_voice_commands()
@@ -0,0 +1,122 @@
+"""
+Rate limit แบบ token bucket สำหรับ API ของ AI / ตะกร้า
+
+- แยก bucket ตามประเภทงาน: llm (แชท / เสียง / แนะนำสินค้า - แพง) และ cart (ถูก)
+- key ของ client: user ที่ login > session > IP
+  (X-Forwarded-For ใช้เฉพาะเมื่อ REMOTE_ADDR อยู่ใน AI_RATE_LIMIT_TRUSTED_PROXIES)
+- เก็บ bucket ในตาราง RateLimitBucket (lock แถวด้วย select_for_update) ทุก worker จึงเห็นค่าเดียวกัน
+- เกิน limit ตอบ 429 พร้อม Retry-After, ถ้า DB มีปัญหาจะปล่อยผ่าน (fail open)
+"""
+
+import logging
+import math
+import random
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+LLM = 'llm'
+CART = 'cart'
+
+# capacity = จำนวนครั้งที่ยิงติดกันได้, per_minute = อัตราเติม token
+DEFAULT_LIMITS = {
+    LLM: {'capacity': 10, 'per_minute': 10},
+    CART: {'capacity': 30, 'per_minute': 120},
+}
+
+STALE_AFTER = timedelta(days=1)
+CLEANUP_PROBABILITY = 0.01
+
+
+def get_limits(bucket):
+    limits = {**DEFAULT_LIMITS, **getattr(settings, 'AI_RATE_LIMITS', {})}
+    return limits[bucket]
+
+
+def get_client_key(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return f"session:{session.session_key}"
+    address = request.META.get('REMOTE_ADDR', '')
+    if address and address in getattr(settings, 'AI_RATE_LIMIT_TRUSTED_PROXIES', ()):
+        # มาจาก proxy ของเราเอง - ใช้ IP ที่ proxy ต่อท้ายไว้ (ค่าทางซ้ายกว่านั้น client ปลอมเองได้)
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+        forwarded = [part for part in forwarded if part]
+        if forwarded:
+            address = forwarded[-1]
+    return f"ip:{address or 'unknown'}"
+
+
+def consume(bucket, key, cost=1):
+    """ใช้ token - คืน (อนุญาตไหม, ต้องรออีกกี่วินาที)"""
+    limits = get_limits(bucket)
+    capacity = limits['capacity']
+    rate = limits['per_minute'] / 60  # token ต่อวินาที
+    now = timezone.now()
+
+    with transaction.atomic():
+        state, _ = RateLimitBucket.objects.select_for_update().get_or_create(
+            bucket=bucket, key=key[:100], defaults={'tokens': capacity, 'updated_at': now}
+        )
+        elapsed = max(0.0, (now - state.updated_at).total_seconds())
+        tokens = min(capacity, state.tokens + elapsed * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        state.tokens = tokens
+        state.updated_at = now
+        state.save(update_fields=['tokens', 'updated_at'])
+
+    if random.random() < CLEANUP_PROBABILITY:
+        # bucket ที่ไม่ได้ใช้นานแล้วเต็มอยู่แล้ว ลบทิ้งได้
+        RateLimitBucket.objects.filter(updated_at__lt=now - STALE_AFTER).delete()
+
+    if allowed:
+        return True, 0
+    return False, max(1, math.ceil((cost - tokens) / rate)) if rate > 0 else 60
+
+
+def check_rate_limit(request, bucket, cost=1):
+    """ใช้ token ของ client นี้ - คืน response 429 + Retry-After ถ้าเกิน limit, None ถ้าผ่าน"""
+    if not getattr(settings, 'AI_RATE_LIMIT_ENABLED', True):
+        return None
+    key = get_client_key(request)
+    try:
+        allowed, retry_after = consume(bucket, key, cost)
+    except Exception as e:
+        logger.error(f"Rate limit check failed ({bucket}): {e}")
+        return None
+    if allowed:
+        return None
+    print(f"[RateLimit] {bucket} limit hit for {key}, retry after {retry_after}s")
+    response = JsonResponse({
+        'success': False,
+        'error': 'ส่งคำขอถี่เกินไป กรุณารอสักครู่แล้วลองใหม่',
+        'retry_after': retry_after
+    }, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limit(bucket, cost=1):
+    """decorator ของ view - เกิน limit ตอบ 429 + Retry-After"""
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            limited = check_rate_limit(request, bucket, cost)
+            if limited is not None:
+                return limited
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,325 @@
+"""
+สินค้าแนะนำที่คำนวณไว้ล่วงหน้า (ไม่ต้องเรียก LLM)
+
+- similar: top-N สินค้าที่ embedding ใกล้กันที่สุด (cosine) คำนวณเป็น matrix product ครั้งเดียว
+- copurchase: "ลูกค้าที่ซื้อสินค้านี้มักซื้อด้วย" จาก co-occurrence ของ OrderItem ในออเดอร์ที่เสร็จแล้ว
+ผลเก็บในตาราง ProductNeighbor และโหลดเข้า dict ในหน่วยความจำ - เรียกดูเป็น O(1)
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db import transaction
+
+from .models import OrderItem, Product, ProductNeighbor
+
+logger = logging.getLogger(__name__)
+
+SIMILAR = 'similar'
+COPURCHASE = 'copurchase'
+DEFAULT_TOP_N = 10
+MIN_SUPPORT = 2  # ต้องถูกซื้อด้วยกันอย่างน้อยกี่ออเดอร์
+RELOAD_INTERVAL = 300  # วินาที - โหลดตารางใหม่เพื่อเห็นผลจาก process อื่น
+MATRIX_RELOAD_INTERVAL = 3600  # วินาที - โหลด embedding ทั้ง catalog ใหม่ (ปกติอัปเดตเฉพาะแถวที่เปลี่ยน)
+
+COLLECTION_NAME = "products_collection"
+
+# {kind: {product_id: [(neighbor_id, score), ...]}}
+_neighbors = {}
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+# embedding ของสินค้าที่ normalize แล้ว (ใช้ตอน refresh_similar_items) - {'product_ids', 'matrix', 'loaded_at'}
+_catalog = {}
+_catalog_lock = threading.Lock()
+
+
+# ===== Serving (in-memory) =====
+def _ensure_loaded():
+    global _neighbors, _loaded_at
+    # ตารางว่างก็นับว่าโหลดแล้ว (ยังไม่เคย build) - ไม่ต้อง query ทุกครั้ง
+    if _loaded_at and time.monotonic() - _loaded_at < RELOAD_INTERVAL:
+        return
+    with _lock:
+        if _loaded_at and time.monotonic() - _loaded_at < RELOAD_INTERVAL:
+            return
+        loaded = {}
+        rows = ProductNeighbor.objects.order_by('product_id', 'kind', 'rank').values_list(
+            'kind', 'product_id', 'neighbor_id', 'score'
+        )
+        for kind, product_id, neighbor_id, score in rows.iterator(chunk_size=5000):
+            loaded.setdefault(kind, {}).setdefault(product_id, []).append((neighbor_id, score))
+        _neighbors = loaded
+        _loaded_at = time.monotonic()
+
+
+def invalidate_cache():
+    global _loaded_at
+    _loaded_at = 0.0
+
+
+def get_neighbors(product_id, kind=SIMILAR, limit=None):
+    """คืน [(neighbor_id, score), ...] จากหน่วยความจำ"""
+    _ensure_loaded()
+    neighbors = _neighbors.get(kind, {}).get(int(product_id), [])
+    return neighbors[:limit] if limit else neighbors
+
+
+def _save_neighbors(kind, results, replace_all=False):
+    """results: {product_id: [(neighbor_id, score), ...]}"""
+    rows = [
+        ProductNeighbor(product_id=pid, neighbor_id=nid, kind=kind, rank=rank, score=float(score))
+        for pid, neighbors in results.items()
+        for rank, (nid, score) in enumerate(neighbors)
+    ]
+    with transaction.atomic():
+        existing = ProductNeighbor.objects.filter(kind=kind)
+        if not replace_all:
+            existing = existing.filter(product_id__in=list(results))
+        existing.delete()
+        ProductNeighbor.objects.bulk_create(rows, batch_size=1000)
+    invalidate_cache()
+    return len(rows)
+
+
+# ===== Similar items (embeddings) =====
+def _get_collection():
+    import chromadb
+    chroma_path = os.path.join(settings.BASE_DIR, 'data', 'chroma')
+    # อ่านอย่างเดียว ไม่ต้องโหลดโมเดล embedding
+    return chromadb.PersistentClient(path=chroma_path).get_or_create_collection(COLLECTION_NAME)
+
+
+def _product_vectors(existing):
+    """{product_id: vector} จากผล collection.get() - vector = ค่าเฉลี่ยของ chunk หลัก แล้ว normalize
+    (เฉพาะสินค้าที่ยังมีอยู่ใน DB)"""
+    sums, counts = {}, {}
+    for vector, metadata in zip(existing["embeddings"], existing["metadatas"]):
+        product_id = metadata.get("product_id")
+        if not product_id:
+            continue  # ai_info chunk ใช้ร่วมหลายสินค้า - ไม่นับ
+        pid = int(product_id)
+        vector = np.asarray(vector, dtype=np.float32)
+        sums[pid] = sums[pid] + vector if pid in sums else vector.copy()
+        counts[pid] = counts.get(pid, 0) + 1
+
+    valid = set(Product.objects.filter(id__in=list(sums)).values_list('id', flat=True))
+    vectors = {}
+    for pid in valid:
+        vector = sums[pid] / counts[pid]
+        vectors[pid] = vector / (np.linalg.norm(vector) or 1.0)
+    return vectors
+
+
+def load_catalog_embeddings(collection=None):
+    """คืน (product_ids, matrix) ของทั้ง catalog (normalize แล้ว)"""
+    collection = collection or _get_collection()
+    vectors = _product_vectors(collection.get(include=["embeddings", "metadatas"]))
+    product_ids = sorted(vectors)
+    if not product_ids:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    return product_ids, np.stack([vectors[pid] for pid in product_ids])
+
+
+def _set_catalog(product_ids, matrix):
+    with _catalog_lock:
+        _catalog.update(product_ids=list(product_ids), matrix=matrix, loaded_at=time.monotonic())
+
+
+def _get_catalog(changed_ids, collection=None):
+    """(product_ids, matrix) ที่ cache ไว้ - อ่าน embedding จาก index ใหม่เฉพาะสินค้าที่เปลี่ยน"""
+    with _catalog_lock:
+        cached = dict(_catalog)
+    if not cached or time.monotonic() - cached['loaded_at'] >= MATRIX_RELOAD_INTERVAL:
+        product_ids, matrix = load_catalog_embeddings(collection)
+        _set_catalog(product_ids, matrix)
+        return product_ids, matrix
+
+    collection = collection or _get_collection()
+    vectors = _product_vectors(collection.get(
+        where={"product_id": {"$in": [str(pid) for pid in changed_ids]}},
+        include=["embeddings", "metadatas"]
+    ))
+    # สินค้าที่ถูกลบ (หรือไม่มี chunk แล้ว) เอาแถวออก ที่เหลือแทนที่ / เพิ่มแถวใหม่
+    keep = [i for i, pid in enumerate(cached['product_ids']) if pid not in changed_ids]
+    product_ids = [cached['product_ids'][i] for i in keep] + sorted(vectors)
+    rows = [cached['matrix'][keep]] if keep else []
+    if vectors:
+        rows.append(np.stack([vectors[pid] for pid in sorted(vectors)]))
+    matrix = np.concatenate(rows) if rows else np.zeros((0, 0), dtype=np.float32)
+    _set_catalog(product_ids, matrix)
+    return product_ids, matrix
+
+
+def _top_n(scores, row_ids, product_ids, top_n):
+    """scores: (len(row_ids), len(product_ids)) - ตัดตัวเองออกแล้วเลือก top-n ต่อแถว"""
+    index_of = {pid: i for i, pid in enumerate(product_ids)}
+    for row, pid in enumerate(row_ids):
+        scores[row, index_of[pid]] = -np.inf
+
+    n = min(top_n, len(product_ids) - 1)
+    if n <= 0:
+        return {pid: [] for pid in row_ids}
+    top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    results = {}
+    for row, pid in enumerate(row_ids):
+        order = top[row][np.argsort(-scores[row, top[row]])]
+        results[pid] = [(product_ids[j], float(scores[row, j])) for j in order]
+    return results
+
+
+def build_similar_items(top_n=DEFAULT_TOP_N, collection=None):
+    """คำนวณ top-N ของทุกสินค้าด้วย matrix product ครั้งเดียว (E @ E.T)"""
+    product_ids, matrix = load_catalog_embeddings(collection)
+    _set_catalog(product_ids, matrix)
+    if not product_ids:
+        return 0
+    scores = matrix @ matrix.T
+    results = _top_n(scores, product_ids, product_ids, top_n)
+    count = _save_neighbors(SIMILAR, results, replace_all=True)
+    print(f"[Recommend] Similar items built for {len(product_ids)} products ({count} rows)")
+    return len(product_ids)
+
+
+def refresh_similar_items(changed_ids, top_n=DEFAULT_TOP_N, collection=None):
+    """อัปเดตเฉพาะแถวที่ได้รับผลจากสินค้าที่เปลี่ยน
+
+    คำนวณใหม่: สินค้าที่เปลี่ยนเอง, สินค้าที่มีสินค้าที่เปลี่ยนอยู่ในรายการ,
+    สินค้าที่คะแนนกับสินค้าที่เปลี่ยนดีกว่าอันดับสุดท้ายของตัวเอง และรายการที่ไม่ครบ (เพื่อนบ้านถูกลบ)
+    """
+    changed_ids = {int(pid) for pid in changed_ids}
+    if not changed_ids:
+        return 0
+    if not ProductNeighbor.objects.filter(kind=SIMILAR).exists():
+        return build_similar_items(top_n, collection)
+
+    product_ids, matrix = _get_catalog(changed_ids, collection)
+    if not product_ids:
+        return 0
+    index_of = {pid: i for i, pid in enumerate(product_ids)}
+    expected = min(top_n, len(product_ids) - 1)
+
+    current = {}
+    for pid, nid, score in ProductNeighbor.objects.filter(kind=SIMILAR).values_list(
+            'product_id', 'neighbor_id', 'score').order_by('product_id', 'rank'):
+        current.setdefault(pid, []).append((nid, score))
+
+    affected = {pid for pid in changed_ids if pid in index_of}
+    for pid, neighbors in current.items():
+        if pid in index_of and (len(neighbors) < expected or any(nid in changed_ids for nid, _ in neighbors)):
+            affected.add(pid)
+    affected.update(pid for pid in index_of if pid not in current)
+
+    changed_rows = [index_of[pid] for pid in changed_ids if pid in index_of]
+    if changed_rows:
+        # คะแนนของทุกสินค้าเทียบกับสินค้าที่เปลี่ยน - ถ้าดีกว่าอันดับสุดท้าย รายการนั้นต้องคำนวณใหม่
+        worst = np.full(len(product_ids), np.inf, dtype=np.float32)
+        for pid, neighbors in current.items():
+            if pid in index_of and neighbors and len(neighbors) >= expected:
+                worst[index_of[pid]] = neighbors[-1][1]
+        against_changed = matrix @ matrix[changed_rows].T
+        against_changed[changed_rows, np.arange(len(changed_rows))] = -np.inf
+        beats = (against_changed > worst[:, None]).any(axis=1)
+        affected.update(product_ids[i] for i in np.nonzero(beats)[0])
+
+    affected = sorted(affected)
+    if not affected:
+        return 0
+    scores = matrix[[index_of[pid] for pid in affected]] @ matrix.T
+    results = _top_n(scores, affected, product_ids, top_n)
+    _save_neighbors(SIMILAR, results)
+    print(f"[Recommend] Similar items refreshed for {len(affected)} products")
+    return len(affected)
+
+
+# ===== Co-purchase (OrderItem history) =====
+def build_copurchase(top_k=DEFAULT_TOP_N, metric='lift', min_support=MIN_SUPPORT):
+    """สร้าง item-item co-occurrence matrix แบบ sparse จากออเดอร์ที่เสร็จแล้ว
+
+    X = order x product (0/1), C = X.T @ X -> C[i, j] = จำนวนออเดอร์ที่มีทั้ง i และ j
+    metric: 'lift' = C_ij * N / (n_i * n_j), 'cosine' = C_ij / sqrt(n_i * n_j)
+    """
+    pairs = list(
+        OrderItem.objects.filter(order__status='completed')
+        .values_list('order_id', 'product_id')
+        .distinct()
+    )
+    if not pairs:
+        _save_neighbors(COPURCHASE, {}, replace_all=True)
+        return 0
+
+    order_ids = sorted({order_id for order_id, _ in pairs})
+    product_ids = sorted({product_id for _, product_id in pairs})
+    order_index = {oid: i for i, oid in enumerate(order_ids)}
+    product_index = {pid: i for i, pid in enumerate(product_ids)}
+
+    rows = np.fromiter((order_index[o] for o, _ in pairs), dtype=np.int32, count=len(pairs))
+    cols = np.fromiter((product_index[p] for _, p in pairs), dtype=np.int32, count=len(pairs))
+    X = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.float32), (rows, cols)),
+        shape=(len(order_ids), len(product_ids))
+    )
+
+    C = (X.T @ X).tocsr()
+    item_counts = C.diagonal()
+    C.setdiag(0)
+    C.data[C.data < min_support] = 0
+    C.eliminate_zeros()
+
+    # normalize ทีละค่าที่ไม่ใช่ 0 (ไม่แปลงเป็น dense)
+    C = C.tocoo()
+    if metric == 'cosine':
+        values = C.data / np.sqrt(item_counts[C.row] * item_counts[C.col])
+    elif metric == 'lift':
+        values = C.data * len(order_ids) / (item_counts[C.row] * item_counts[C.col])
+    else:
+        raise ValueError(f"unknown metric: {metric}")
+    C = sparse.csr_matrix((values, (C.row, C.col)), shape=C.shape)
+
+    results = {}
+    for i in range(C.shape[0]):
+        start, end = C.indptr[i], C.indptr[i + 1]
+        if start == end:
+            continue
+        cols_i, values_i = C.indices[start:end], C.data[start:end]
+        order = np.argsort(-values_i)[:top_k]
+        results[product_ids[i]] = [(product_ids[cols_i[j]], float(values_i[j])) for j in order]
+
+    count = _save_neighbors(COPURCHASE, results, replace_all=True)
+    print(f"[Recommend] Co-purchase built from {len(order_ids)} orders: "
+          f"{len(results)} products ({count} rows, metric={metric})")
+    return len(results)
+
+
+def recommend_for_cart(product_ids, limit=5):
+    """รวมคะแนน co-purchase ของสินค้าในตะกร้า -> [(product_id, score)] (ไม่รวมของที่อยู่ในตะกร้าแล้ว)"""
+    in_cart = {int(pid) for pid in product_ids}
+    scores = {}
+    for pid in in_cart:
+        for neighbor_id, score in get_neighbors(pid, COPURCHASE):
+            if neighbor_id not in in_cart:
+                scores[neighbor_id] = scores.get(neighbor_id, 0.0) + score
+    return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+
+def serialize_neighbors(neighbors, in_stock_only=False):
+    """แปลง [(neighbor_id, score)] เป็น dict สำหรับ JSON (query สินค้าครั้งเดียว)"""
+    products = Product.objects.in_bulk([nid for nid, _ in neighbors])
+    items = []
+    for nid, score in neighbors:
+        product = products.get(nid)
+        if product is None or (in_stock_only and product.quantity <= 0):
+            continue
+        items.append({
+            'id': product.id,
+            'name': product.name,
+            'price': float(product.price),
+            'quantity': product.quantity,
+            'score': round(score, 4),
+        })
+    return items
@@ -5,12 +5,15 @@ Handles business logic without modifying database structure
 
 import logging
 import uuid
+from functools import reduce
+from operator import or_
 from django.core.mail import send_mail
 from django.conf import settings
-from django.db.models import Sum, Count, Avg, Q, F
+from django.db import transaction
+from django.db.models import Sum, Count, Avg, Q, F, Case, When
 from django.utils import timezone
 from datetime import timedelta
-from .models import Order, OrderItem, Product, Customer
+from .models import CatalogVersion, Order, OrderItem, Product, Customer
 import json
 
 logger = logging.getLogger(__name__)
@@ -156,6 +159,83 @@ class OrderCancellationService:
             return {'success': False, 'message': f'เกิดข้อผิดพลาด: {str(e)}'}
 
 
+class InsufficientStock(Exception):
+    """สต็อกไม่พอสำหรับบางรายการในตะกร้า"""
+    
+    def __init__(self, product_names):
+        super().__init__(f"Insufficient stock: {', '.join(product_names)}")
+        self.product_names = product_names
+
+
+class CheckoutService:
+    """สร้างออเดอร์จากตะกร้าใน transaction เดียว - จำนวน query คงที่ไม่ขึ้นกับจำนวนสินค้าในตะกร้า"""
+    
+    @staticmethod
+    def create_order_from_cart(customer, cart_items, order_type='online'):
+        """สร้าง Order + OrderItem และลดสต็อก ถ้าสินค้าใดไม่พอจะ rollback ทั้งหมดแล้ว raise InsufficientStock"""
+        # รวมจำนวนต่อสินค้า (ตะกร้าอาจมีสินค้าเดียวกันหลายแถว)
+        quantities = {}
+        for item in cart_items:
+            product_id = int(item['product_id'])
+            quantities[product_id] = quantities.get(product_id, 0) + int(item['quantity'])
+        
+        with transaction.atomic():
+            products = Product.objects.in_bulk(list(quantities))
+            missing = [product_id for product_id in quantities if product_id not in products]
+            if missing:
+                raise Product.DoesNotExist(f"Products not found: {missing}")
+            
+            # ลดสต็อกทุกรายการใน UPDATE เดียว เฉพาะแถวที่ของพอ - แถวที่อัปเดตไม่ครบแปลว่ามีสินค้าไม่พอ
+            # (ใช้ update() จึงไม่ trigger post_save ของ Product - สต็อกไม่ได้อยู่ใน index ของ RAG)
+            # update() ไม่ตั้ง auto_now ให้ - ตั้ง updated_at เอง (สินค้าสำรองเรียงตาม -updated_at)
+            updated = Product.objects.filter(
+                reduce(or_, (Q(id=product_id, quantity__gte=qty) for product_id, qty in quantities.items()))
+            ).update(quantity=Case(
+                *[When(id=product_id, then=F('quantity') - qty) for product_id, qty in quantities.items()],
+                default=F('quantity'),
+                output_field=Product._meta.get_field('quantity')
+            ), updated_at=timezone.now())
+            if updated != len(quantities):
+                stock = dict(Product.objects.filter(id__in=list(quantities)).values_list('id', 'quantity'))
+                raise InsufficientStock([
+                    products[product_id].name
+                    for product_id, qty in quantities.items() if stock.get(product_id, 0) < qty
+                ])
+            if Product.objects.filter(id__in=list(quantities), quantity=0).exists():
+                # สินค้าหมด - คำตอบสำเร็จรูป / retrieval ที่ cache ไว้อาจยังบอกว่ามีของ
+                CatalogVersion.bump()
+            
+            order = Order.objects.create(
+                customer=customer,
+                total_price=sum(item['price'] * item['quantity'] for item in cart_items),
+                status='pending',
+                order_type=order_type,
+                order_number=Order.get_next_order_number()
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=products[int(item['product_id'])],
+                    quantity=item['quantity'],
+                    price=item['price'],
+                    subtotal=item['price'] * item['quantity']
+                )
+                for item in cart_items
+            ])
+            transaction.on_commit(CheckoutService._invalidate_stock_caches)
+        
+        logger.info(f"Order #{order.order_number} created with {len(cart_items)} items, stock reduced for {len(quantities)} products")
+        return order
+    
+    @staticmethod
+    def _invalidate_stock_caches():
+        # update() ไม่ส่ง signal - แจ้ง cache ที่ใช้ข้อมูลสต็อกเอง
+        from .answer_cache import invalidate_versions
+        from .intent_router import invalidate_snapshot
+        invalidate_versions()
+        invalidate_snapshot()
+
+
 class InventoryService:
     """จัดการการตรวจสอบสินค้าคงเหลือและส่งการแจ้งเตือน"""
     
@@ -304,31 +384,18 @@ class OrderAnalyticsService:
             }
     
     @staticmethod
-    def get_top_user_queries(limit=5):
-        """ดึงคำค้นหาหลัก/คำถามของลูกค้า
+    def get_top_user_queries(limit=5, days=30):
+        """ดึงกลุ่มคำถามหลักของลูกค้า
         
-        Note: ต้องดึงจาก log หรือ Vector DB
-        สำหรับตอนนี้ ส่งคืนข้อมูลตัวอย่าง
+        อ่านจากกลุ่มคำถามที่ cluster_queries คำนวณไว้ (คำถามความหมายเดียวกันรวมเป็นกลุ่มเดียว)
+        ถ้ายังไม่มีข้อมูล ส่งคืนข้อมูลตัวอย่าง
         """
         try:
-            from .models import ChatLog
-            from django.db.models import Count
-            from datetime import timedelta
-            from django.utils import timezone
-            
-            # ดึงข้อมูลจาก 30 วันที่ผ่านมา
-            thirty_days_ago = timezone.now() - timedelta(days=30)
+            from .query_clustering import get_top_clusters
             
-            # ดึง ChatLog ทั้งหมดในช่วง 30 วัน
-            chat_logs = ChatLog.objects.filter(
-                created_at__gte=thirty_days_ago
-            ).values('user_query').annotate(count=Count('id')).order_by('-count')[:limit]
+            top_clusters, total_queries = get_top_clusters(days=days, limit=limit)
             
-            total_queries = ChatLog.objects.filter(
-                created_at__gte=thirty_days_ago
-            ).count()
-            
-            if not chat_logs and total_queries == 0:
+            if not top_clusters:
                 # ถ้าไม่มีข้อมูล ส่งข้อมูลตัวอย่าง
                 sample_queries = [
                     {'query': 'ขนาดไหนคุ้มสุด', 'count': 15, 'percentage': 20},
@@ -346,14 +413,13 @@ class OrderAnalyticsService:
             
             # คำนวณเปอร์เซ็นต์ และสร้างรายการคำค้นหา
             result_queries = []
-            for log in chat_logs:
-                if log['user_query'].strip():  # ข้ามข้อความว่างเปล่า
-                    percentage = round((log['count'] / total_queries) * 100) if total_queries > 0 else 0
-                    result_queries.append({
-                        'query': log['user_query'][:50],  # ตัดให้ 50 ตัวอักษร
-                        'count': log['count'],
-                        'percentage': percentage
-                    })
+            for cluster in top_clusters:
+                percentage = round((cluster['count'] / total_queries) * 100) if total_queries > 0 else 0
+                result_queries.append({
+                    'query': cluster['label'][:50],  # ตัดให้ 50 ตัวอักษร
+                    'count': cluster['count'],
+                    'percentage': percentage
+                })
             
             return {
                 'success': True,
@@ -417,6 +483,37 @@ class OrderAnalyticsService:
 class ChatAnalyticsService:
     """ดึงข้อมูลจากประวัติแชท"""
     
+    @staticmethod
+    def get_route_stats(days=7):
+        """สัดส่วนคำถามที่ตอบผ่าน fast path / คำตอบสำเร็จรูป / LLM ในช่วง days วัน"""
+        try:
+            from .models import ChatLog
+            
+            since = timezone.localdate() - timedelta(days=days - 1)
+            logs = ChatLog.objects.filter(log_date__gte=since)
+            by_source = dict(logs.values_list('source').annotate(count=Count('id')))
+            by_intent = dict(
+                logs.filter(source='fast_path').values_list('intent').annotate(count=Count('id'))
+            )
+            total = sum(by_source.values())
+            fast_path = by_source.get('fast_path', 0)
+            
+            return {
+                'success': True,
+                'period_days': days,
+                'total': total,
+                'by_source': by_source,
+                'fast_path_by_intent': by_intent,
+                'fast_path_share': round(fast_path / total * 100, 1) if total else 0.0,
+            }
+        except Exception as e:
+            logger.error(f"Error in get_route_stats: {str(e)}")
+            return {
+                'success': False,
+                'total': 0,
+                'error': str(e)
+            }
+    
     @staticmethod
     def extract_top_queries_from_logs(limit=5):
         """
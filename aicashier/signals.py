@@ -1,9 +1,20 @@
 # aicashier/signals.py
 
 import logging
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
 from django.dispatch import receiver
-from .models import Product, Order, AISettings
+from .models import Product, Category, Order, AISettings, CatalogVersion
+from .index_writer import DELETE, UPSERT
+from .rag_sync_queue import (
+    is_bulk_active,
+    rag_sync_queue,
+    record_bulk_catalog_change,
+    record_bulk_product,
+    record_bulk_settings_change,
+)
+from .rag_reindex import start_reindex
+from .answer_cache import invalidate_versions
+from .intent_router import invalidate_snapshot
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -25,46 +36,110 @@ def get_rag_service():
     return _rag_service
 
 @receiver(post_save, sender=Product)
-def sync_product_to_rag(sender, instance, created, **kwargs):
+def sync_product_to_rag(sender, instance, created, using=None, **kwargs):
     try:
-        rag_service = get_rag_service()
-        if not rag_service:
-            logger.warning(f"RAG service not initialized when syncing Product {instance.id}")
+        if is_bulk_active():
+            record_bulk_product(UPSERT, instance.id)
             return
         
-        action = "created" if created else "updated"
-        print(f"Syncing Product ID {instance.id} ({instance.name}) - {action}...")
-        
-        rag_service.update_product_in_rag(instance)
+        # ใส่คิวอย่างเดียว - embed / เขียน index ทำใน thread เบื้องหลังหลัง commit
+        rag_sync_queue.enqueue_upsert(instance.id, using=using)
         
-        logger.info(f"Product {instance.id} ({instance.name}) synced to RAG - {action}")
-        print(f"Product ID {instance.id} synced successfully")
+        action = "created" if created else "updated"
+        logger.info(f"Product {instance.id} ({instance.name}) queued for RAG sync - {action}")
         
     except Exception as e:
-        logger.error(f"Error syncing Product {instance.id} to RAG: {e}", exc_info=True)
+        logger.error(f"Error queueing Product {instance.id} for RAG sync: {e}", exc_info=True)
         print(f"Error syncing Product {instance.id}: {e}")
         # Don't re-raise here to prevent breaking Django ORM, but log clearly
 
 @receiver(post_delete, sender=Product)
-def remove_product_from_rag(sender, instance, **kwargs):
+def remove_product_from_rag(sender, instance, using=None, **kwargs):
     try:
-        rag_service = get_rag_service()
-        if not rag_service:
-            logger.warning(f"RAG service not initialized when deleting Product {instance.id}")
+        if is_bulk_active():
+            record_bulk_product(DELETE, instance.id)
             return
         
-        print(f"Removing Product ID {instance.id} ({instance.name}) from RAG...")
-        
-        rag_service.delete_product_from_rag(instance.id)
+        rag_sync_queue.enqueue_delete(instance.id, using=using)
         
-        logger.info(f"Product {instance.id} ({instance.name}) removed from RAG")
-        print(f"Product ID {instance.id} removed from RAG successfully")
+        logger.info(f"Product {instance.id} ({instance.name}) queued for removal from RAG")
         
     except Exception as e:
-        logger.error(f"Error removing Product {instance.id} from RAG: {e}", exc_info=True)
+        logger.error(f"Error queueing removal of Product {instance.id} from RAG: {e}", exc_info=True)
         print(f"Error removing Product {instance.id}: {e}")
         # Don't re-raise here to prevent breaking Django ORM, but log clearly
 
+@receiver(pre_save, sender=Category)
+def remember_category_name(sender, instance, raw=False, **kwargs):
+    # เก็บชื่อเดิมไว้เทียบใน post_save
+    instance._rag_old_name = None
+    if instance.pk and not raw:
+        instance._rag_old_name = Category.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+@receiver(post_save, sender=Category)
+def reindex_products_on_category_rename(sender, instance, created, raw=False, **kwargs):
+    try:
+        old_name = getattr(instance, '_rag_old_name', None)
+        if created or raw or old_name is None or old_name == instance.name:
+            return  # เปลี่ยนแค่ description - ไม่ได้อยู่ใน index
+        
+        product_ids = list(instance.products.values_list('id', flat=True))
+        if not product_ids:
+            return
+        
+        # ชื่อหมวดอยู่ทั้งใน metadata และข้อความที่ embed -> patch metadata ก่อนแล้ว embed ใหม่
+        job_id = start_reindex(
+            product_ids,
+            reason=f"category renamed: {old_name} -> {instance.name}",
+            metadata_patch={"category": instance.name}
+        )
+        logger.info(f"Category {instance.id} renamed, reindexing {len(product_ids)} products (job {job_id})")
+        
+    except Exception as e:
+        logger.error(f"Error scheduling reindex for Category {instance.id}: {e}", exc_info=True)
+        print(f"Error scheduling category reindex: {e}")
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    # on_delete=SET_NULL อัปเดตสินค้าด้วย queryset.update() ซึ่งไม่ยิง signal ของ Product
+    instance._rag_product_ids = list(instance.products.values_list('id', flat=True))
+
+@receiver(post_delete, sender=Category)
+def reindex_products_on_category_delete(sender, instance, **kwargs):
+    try:
+        product_ids = getattr(instance, '_rag_product_ids', [])
+        if not product_ids:
+            return
+        
+        job_id = start_reindex(
+            product_ids,
+            reason=f"category deleted: {instance.name}",
+            metadata_patch={"category": "ไม่มีหมวด"}
+        )
+        logger.info(f"Category {instance.id} deleted, reindexing {len(product_ids)} products (job {job_id})")
+        
+    except Exception as e:
+        logger.error(f"Error scheduling reindex for deleted Category: {e}", exc_info=True)
+        print(f"Error scheduling category reindex: {e}")
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=AISettings)
+def invalidate_answer_caches(sender, **kwargs):
+    if sender is not AISettings:
+        if is_bulk_active():
+            # bulk_rag_sync เพิ่ม version ครั้งเดียวตอนจบ block
+            record_bulk_catalog_change()
+            return
+        # worker อื่นเห็น version ใหม่ภายใน VERSION_TTL ของ answer_cache
+        CatalogVersion.bump()
+    # ให้ตรวจ catalog / settings version ใหม่ในคำถามถัดไป (คำตอบที่ version ไม่ตรงจะไม่ถูกใช้)
+    invalidate_versions()
+    # ราคา / สต็อกที่ fast path ใช้ตอบ
+    invalidate_snapshot()
+
 @receiver(post_save, sender=Order)
 def update_product_stock_on_order(sender, instance, created, **kwargs):
     try:
@@ -94,6 +169,10 @@ def update_product_stock_on_order(sender, instance, created, **kwargs):
 @receiver(post_save, sender=AISettings)
 def reload_voice_commands_on_settings_change(sender, instance, created, **kwargs):
     try:
+        if is_bulk_active():
+            record_bulk_settings_change()
+            return
+        
         rag_service = get_rag_service()
         if not rag_service:
             logger.warning("RAG service not initialized when AISettings changed")
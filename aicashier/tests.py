@@ -1,6 +1,6 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
-from .models import Customer, Product
+from .models import Customer, Product, Order
 
 # การตั้งค่าพื้นฐานสำหรับ Tests ทั้งหมด
 class BaseTestCase(TestCase):
@@ -159,3 +159,393 @@ class ProductTests(BaseTestCase):
         # 5. ตรวจสอบว่า Product *ไม่* ถูกสร้างขึ้นในฐานข้อมูล
         self.assertFalse(Product.objects.filter(name='Unauthorized Product').exists())
         self.assertEqual(Product.objects.count(), 0)
+
+
+class ProductImportTests(BaseTestCase):
+
+    def test_import_rows_creates_products_and_reports_errors(self):
+        """
+        Test (เพิ่มเติม): นำเข้าสินค้าจาก CSV - แถวที่ผิดถูกข้ามพร้อมเลขแถว และรหัสสินค้าถูกจองต่อจากรหัสสูงสุด
+        """
+        import io
+        from .product_import import ProductImporter, iter_rows
+
+        Product.objects.create(name='Existing', price=10, quantity=1, product_code='P9999')
+
+        csv_data = io.StringIO(
+            "name,price,quantity,category\n"
+            "Latte,65,10,Coffee\n"
+            ",50,1,Coffee\n"
+            "Mocha,abc,1,Coffee\n"
+            "Tea,45,,Tea\n"
+        )
+        stats = ProductImporter(chunk_size=2).run(iter_rows(csv_data, 'csv'))
+
+        self.assertEqual(stats['rows'], 4)
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual([line for line, _ in stats['errors']], [3, 4])
+
+        # P10000 ต้องต่อจาก P9999 (ไม่ใช่เรียงแบบตัวอักษร)
+        codes = set(Product.objects.exclude(name='Existing').values_list('product_code', flat=True))
+        self.assertEqual(codes, {'P10000', 'P10001'})
+        self.assertEqual(Product.objects.get(name='Tea').category.name, 'Tea')
+
+    def test_import_reports_duplicate_codes_and_invalid_prices(self):
+        """
+        Test (เพิ่มเติม): รหัสซ้ำในไฟล์และราคา NaN ถูกรายงานเป็น error รายแถว (จำนวนแถวรวมกันได้ครบ)
+        """
+        import io
+        from .product_import import ProductImporter, iter_rows
+
+        csv_data = io.StringIO(
+            "product_code,name,price\n"
+            "P0001,Latte,65\n"
+            "P0001,Latte Hot,60\n"
+            "P0002,Mocha,NaN\n"
+        )
+        stats = ProductImporter().run(iter_rows(csv_data, 'csv'))
+
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(sorted(line for line, _ in stats['errors']), [2, 4])
+        self.assertEqual(stats['created'] + stats['updated'] + stats['skipped'] + len(stats['errors']), stats['rows'])
+        self.assertEqual(Product.objects.get(product_code='P0001').name, 'Latte Hot')
+
+
+class IntentRouterTests(BaseTestCase):
+
+    def test_price_and_stock_questions_answered_from_database(self):
+        """
+        Test (เพิ่มเติม): คำถามราคา/สต็อกตอบจากข้อมูลสินค้าโดยตรง ส่วนคำถามเชิงความเห็นส่งต่อให้ LLM
+        """
+        from .intent_router import invalidate_snapshot, route_query
+
+        Product.objects.create(name='ชาเขียว', price=45, quantity=3)
+        Product.objects.create(name='ชาเขียวนม', price=55, quantity=0)
+        invalidate_snapshot()
+
+        price = route_query('ชาเขียวราคาเท่าไหร่ครับ')
+        self.assertEqual(price['intent'], 'price')
+        self.assertIn('45', price['answer'])
+
+        stock = route_query('ชาเขียวนมมีของไหม')
+        self.assertEqual(stock['intent'], 'stock')
+        self.assertIn('หมด', stock['answer'])
+
+        self.assertIsNone(route_query('ชาเขียวอร่อยไหม'))
+
+
+class CircuitBreakerTests(TestCase):
+
+    def test_opens_on_failures_and_recovers_after_probe(self):
+        """
+        Test (เพิ่มเติม): error เกินสัดส่วนแล้ววงจรเปิด ไม่เรียก LLM จนครบเวลา แล้ว probe สำเร็จจึงปิด
+        """
+        from .circuit_breaker import CLOSED, OPEN, CircuitBreaker, CircuitOpenError
+
+        now = [0.0]
+        breaker = CircuitBreaker('test', min_calls=4, failure_rate=0.5, open_seconds=30, clock=lambda: now[0])
+
+        def fail():
+            raise RuntimeError('upstream error')
+
+        breaker.call(lambda: 'ok')
+        breaker.call(lambda: 'ok')
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                breaker.call(fail)
+        self.assertEqual(breaker.state, OPEN)
+
+        calls = []
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(calls.append, 'x')
+        self.assertEqual(calls, [])
+
+        now[0] = 31.0
+        self.assertEqual(breaker.call(lambda: 'ok'), 'ok')
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats()['transitions']['half_open->closed'], 1)
+
+    def test_hung_probe_reopens_circuit(self):
+        """
+        Test (เพิ่มเติม): probe ที่ค้างเกิน slow_call_ms ทำให้วงจรกลับไปเปิด และผลที่มาช้าไม่ปิดวงจร
+        """
+        from .circuit_breaker import HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+        now = [0.0]
+        breaker = CircuitBreaker('test', min_calls=1, slow_call_ms=1000, open_seconds=30, clock=lambda: now[0])
+
+        def fail():
+            raise RuntimeError('upstream error')
+
+        with self.assertRaises(RuntimeError):
+            breaker.call(fail)
+        now[0] = 31.0
+
+        def hung():
+            # ระหว่างที่ probe ค้าง คำขออื่นถูกปฏิเสธ จนเกิน slow_call_ms วงจรก็กลับไปเปิด
+            self.assertEqual(breaker.state, HALF_OPEN)
+            with self.assertRaises(CircuitOpenError):
+                breaker.call(lambda: 'ok')
+            now[0] = 32.5
+            self.assertEqual(breaker.state, OPEN)
+            return 'late'
+
+        self.assertEqual(breaker.call(hung), 'late')
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.stats()['transitions'].get('half_open->closed', 0), 0)
+
+
+class LLMSchedulerTests(TestCase):
+
+    def test_low_priority_request_is_shed_when_queue_is_full(self):
+        """
+        Test (เพิ่มเติม): คิวเต็มแล้วคำขอลำดับต่ำรอเกินกำหนดจะถูกตัดทิ้ง
+        """
+        import threading
+        from .llm_scheduler import BACKGROUND, RECOMMEND, LLMOverloaded, LLMScheduler
+
+        scheduler = LLMScheduler(max_concurrent=1, max_wait={RECOMMEND: 0.05})
+        started, release = threading.Event(), threading.Event()
+
+        def hold():
+            started.set()
+            release.wait(5)
+
+        worker = threading.Thread(target=scheduler.run, args=(BACKGROUND, hold))
+        worker.start()
+        started.wait(5)
+        try:
+            with self.assertRaises(LLMOverloaded):
+                scheduler.run(RECOMMEND, lambda: 'answer')
+        finally:
+            release.set()
+            worker.join()
+
+        self.assertEqual(scheduler.stats()['classes'][RECOMMEND]['shed'], 1)
+        self.assertEqual(scheduler.run(RECOMMEND, lambda: 'answer'), 'answer')
+
+
+class RateLimitTests(BaseTestCase):
+
+    @override_settings(AI_RATE_LIMITS={'cart': {'capacity': 2, 'per_minute': 60}})
+    def test_cart_api_returns_429_after_burst(self):
+        """
+        Test (เพิ่มเติม): ยิง API ตะกร้าเกิน burst แล้วได้ 429 พร้อม Retry-After
+        """
+        self.client.login(username='testuser', password=self.user_password)
+        url = reverse('api_cart')
+
+        for _ in range(2):
+            response = self.client.post(url, data='{"action": "get"}', content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(url, data='{"action": "get"}', content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class OrderNumberTests(BaseTestCase):
+
+    def test_order_numbers_increment_and_reset_daily(self):
+        """
+        Test (เพิ่มเติม): เลขออเดอร์เริ่มที่ 1000 เพิ่มทีละ 1 และเริ่มใหม่ในวันถัดไป
+        """
+        from datetime import date
+        from .models import DailyOrderCounter
+
+        self.assertEqual(Order.get_next_order_number(), 1000)
+        self.assertEqual(Order.get_next_order_number(), 1001)
+        self.assertEqual(DailyOrderCounter.next_number(date(2030, 1, 1)), 1000)
+        self.assertEqual(Order.get_next_order_number(), 1002)
+
+
+class CheckoutTests(BaseTestCase):
+
+    def test_checkout_is_all_or_nothing(self):
+        """
+        Test (เพิ่มเติม): ชำระเงินแล้วลดสต็อกทุกรายการ ถ้ามีสินค้าไม่พอจะไม่บันทึกอะไรเลย
+        """
+        from .services import CheckoutService, InsufficientStock
+
+        tea = Product.objects.create(name='Tea', price=40, quantity=5)
+        cake = Product.objects.create(name='Cake', price=60, quantity=1)
+
+        order = CheckoutService.create_order_from_cart(self.user, [
+            {'product_id': tea.id, 'price': 40.0, 'quantity': 2},
+            {'product_id': cake.id, 'price': 60.0, 'quantity': 1},
+        ])
+        self.assertEqual(order.items.count(), 2)
+        tea.refresh_from_db()
+        cake.refresh_from_db()
+        self.assertEqual((tea.quantity, cake.quantity), (3, 0))
+
+        with self.assertRaises(InsufficientStock) as raised:
+            CheckoutService.create_order_from_cart(self.user, [
+                {'product_id': tea.id, 'price': 40.0, 'quantity': 1},
+                {'product_id': cake.id, 'price': 60.0, 'quantity': 1},
+            ])
+        self.assertEqual(raised.exception.product_names, ['Cake'])
+        tea.refresh_from_db()
+        self.assertEqual(tea.quantity, 3)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class CopurchaseTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from .models import OrderItem
+
+        self.coffee, self.cake, self.cookie, self.water = [
+            Product.objects.create(name=name, price=50, quantity=100)
+            for name in ['Coffee', 'Cake', 'Cookie', 'Water']
+        ]
+        baskets = [
+            [self.coffee, self.cake],
+            [self.coffee, self.cake],
+            [self.coffee, self.cake, self.cookie],
+            [self.coffee, self.cookie],
+            [self.coffee, self.cookie, self.water],
+            [self.cake, self.water],
+        ]
+        # ออเดอร์ที่ยังไม่เสร็จต้องไม่ถูกนับ
+        pending = [self.coffee, self.cake]
+        for basket, status in [(b, 'completed') for b in baskets] + [(pending, 'pending')]:
+            order = Order.objects.create(customer=self.user, total_price=0)
+            for product in basket:
+                OrderItem.objects.create(order=order, product=product, price=50)
+            # update() ไม่ยิง signal ตัดสต็อก
+            Order.objects.filter(pk=order.pk).update(status=status)
+
+    @staticmethod
+    def _rounded(neighbors):
+        # คะแนนคำนวณเป็น float32
+        return [(nid, round(score, 4)) for nid, score in neighbors]
+
+    def _neighbors(self, product):
+        from .recommendation_service import COPURCHASE, get_neighbors
+        return self._rounded(get_neighbors(product.id, COPURCHASE))
+
+    def test_build_copurchase_scores_and_recommend_for_cart(self):
+        """
+        Test (เพิ่มเติม): คะแนน lift / cosine จากจำนวนออเดอร์ที่ซื้อด้วยกัน, ตัดคู่ที่ต่ำกว่า min_support
+        """
+        from .recommendation_service import build_copurchase, recommend_for_cart
+
+        # N = 6, n = coffee 5, cake 4, cookie 3, water 2
+        # ซื้อด้วยกัน: coffee+cake 3, coffee+cookie 3, คู่อื่น 1 (ต่ำกว่า min_support=2)
+        self.assertEqual(build_copurchase(metric='lift'), 3)
+        self.assertEqual(self._neighbors(self.coffee), [(self.cookie.id, 1.2), (self.cake.id, 0.9)])
+        self.assertEqual(self._neighbors(self.cake), [(self.coffee.id, 0.9)])
+        self.assertEqual(self._neighbors(self.cookie), [(self.coffee.id, 1.2)])
+        self.assertEqual(self._neighbors(self.water), [])
+
+        # ไม่แนะนำของที่อยู่ในตะกร้าแล้ว และรวมคะแนนจากหลายสินค้า
+        self.assertEqual(self._rounded(recommend_for_cart([self.coffee.id, self.cake.id])), [(self.cookie.id, 1.2)])
+        self.assertEqual(self._rounded(recommend_for_cart([self.cake.id, self.cookie.id])), [(self.coffee.id, 2.1)])
+
+        build_copurchase(metric='cosine')
+        self.assertEqual(self._neighbors(self.coffee), [(self.cookie.id, round(3 / 15 ** 0.5, 4)),
+                                                        (self.cake.id, round(3 / 20 ** 0.5, 4))])
+        self.assertEqual(self._neighbors(self.cake), [(self.coffee.id, round(3 / 20 ** 0.5, 4))])
+
+        # min_support=1: คู่ที่ซื้อด้วยกันครั้งเดียวกลับมา แต่ไม่มีคู่กับตัวเอง
+        build_copurchase(metric='lift', min_support=1)
+        self.assertEqual(self._neighbors(self.water), [(self.cookie.id, 1.0), (self.cake.id, 0.75), (self.coffee.id, 0.6)])
+        self.assertNotIn(self.coffee.id, [nid for nid, _ in self._neighbors(self.coffee)])
+
+
+class ConversationRetrievalTests(TestCase):
+
+    NAMES = ['Latte', 'Mocha', 'Espresso', 'Americano', 'Cappuccino', 'Matcha',
+             'Cocoa', 'Lemonade', 'Smoothie', 'Milk', 'Croissant', 'Brownie']
+
+    def setUp(self):
+        import threading
+        from collections import OrderedDict
+        from langchain_core.documents import Document
+        from .rag_service import RAGService
+
+        self.products = [Product.objects.create(name=name, price=50, quantity=5) for name in self.NAMES]
+        self.searches = []
+
+        def search_products(query, k=3):
+            # สินค้าที่ถูกพูดถึงได้อันดับแรก ที่เหลือเรียงตามลำดับที่สร้าง
+            self.searches.append(k)
+            ranked = sorted(self.products, key=lambda p: p.name.lower() not in query.lower())
+            return [(Document(page_content=p.name, metadata={'product_id': str(p.id)}), 0.1 * i)
+                    for i, p in enumerate(ranked[:k])]
+
+        # ไม่โหลดโมเดล / vector store - ทดสอบเฉพาะการใช้ผล retrieval ซ้ำ
+        self.service = RAGService.__new__(RAGService)
+        self.service.embedding_client = None
+        self.service._retrieval_cache = OrderedDict()
+        self.service._retrieval_cache_lock = threading.Lock()
+        self.service.search_products = search_products
+        self.service.get_collection_stats = lambda: {'document_count': len(self.products)}
+
+    def _ids(self, docs):
+        return [int(doc.metadata['product_id']) for doc, _ in docs]
+
+    def test_follow_up_turns_reuse_merge_or_search_again(self):
+        """
+        Test (เพิ่มเติม): คำถามต่อเนื่องใช้ผลเดิม, พูดถึงสินค้าใหม่ค้นเพิ่มแล้วรวม, คำถามใหม่ค้นทั้งหมด
+        """
+        from .answer_cache import current_versions
+        from .conversation_store import conversation_store
+        from .rag_service import CONVERSATION_DOCS_LIMIT, FOLLOW_UP_FRESH_K
+
+        key = 'retrieval-test'
+        ids = [p.id for p in self.products]
+        catalog_version = current_versions()[0]
+
+        # รอบแรก: ค้นทั้งหมด แต่เก็บไว้แค่ id + คะแนนของสินค้าอันดับต้น ๆ
+        timings = {}
+        docs = self.service.retrieve_for_conversation('มีเครื่องดื่มอะไรบ้าง', key, timings)
+        self.assertEqual(self.searches, [len(self.products)])
+        self.assertEqual(len(docs), len(self.products))
+        self.assertNotIn('retrieval_reused', timings)
+        stored = conversation_store.get_retrieval(key, catalog_version)
+        self.assertEqual([item['product_id'] for item in stored], [str(pid) for pid in ids[:CONVERSATION_DOCS_LIMIT]])
+        self.assertEqual(set(stored[0]), {'product_id', 'score'})
+
+        # ถามต่อโดยไม่พูดถึงสินค้าใหม่: ใช้ผลเดิม ไม่ค้นหา
+        timings = {}
+        docs = self.service.retrieve_for_conversation('แล้วอันนี้ราคาเท่าไหร่ล่ะ', key, timings)
+        self.assertEqual(len(self.searches), 1)
+        self.assertEqual(timings['retrieval_reused'], 'full')
+        self.assertEqual(self._ids(docs), ids[:CONVERSATION_DOCS_LIMIT])
+
+        # ถามต่อถึงสินค้าที่ไม่อยู่ในผลเดิม: ค้นเพิ่มเล็กน้อยแล้วรวม
+        timings = {}
+        docs = self.service.retrieve_for_conversation('แล้ว Brownie ล่ะ', key, timings)
+        self.assertEqual(self.searches[1:], [FOLLOW_UP_FRESH_K])
+        self.assertEqual(timings['retrieval_reused'], 'merged')
+        brownie = self.products[-1].id
+        self.assertEqual(self._ids(docs)[0], brownie)
+        self.assertEqual(len(docs), CONVERSATION_DOCS_LIMIT + 1)
+        self.assertEqual(len(conversation_store.get_retrieval(key, catalog_version)), CONVERSATION_DOCS_LIMIT)
+
+        # พูดถึงสินค้าที่อยู่ในผลเดิม: ใช้ผลเดิม
+        timings = {}
+        self.service.retrieve_for_conversation('Brownie หวานไหม', key, timings)
+        self.assertEqual(len(self.searches), 2)
+        self.assertEqual(timings['retrieval_reused'], 'full')
+
+        # คำถามใหม่ที่พูดถึงสินค้าใหม่ (ไม่ใช่คำถามต่อเนื่อง): ค้นทั้งหมด
+        timings = {}
+        self.service.retrieve_for_conversation('Croissant มีรสอะไรบ้าง', key, timings)
+        self.assertEqual(self.searches[2:], [len(self.products)])
+        self.assertNotIn('retrieval_reused', timings)
+
+    def test_discarded_prepare_does_not_store_retrieval(self):
+        """
+        Test (เพิ่มเติม): ตะกร้าตอบไปก่อน (ผลเตรียม prompt ถูกทิ้ง) - ไม่บันทึก retrieval ทับของบทสนทนา
+        """
+        from .answer_cache import current_versions
+        from .conversation_store import conversation_store
+
+        key = 'discarded-test'
+        docs = self.service.retrieve_for_conversation('มีเครื่องดื่มอะไรบ้าง', key, {}, still_needed=lambda: False)
+        self.assertEqual(len(docs), len(self.products))
+        self.assertFalse(conversation_store.get_retrieval(key, current_versions()[0]))
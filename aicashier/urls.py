@@ -24,7 +24,9 @@ from .views import (
     order_queue_display,
     PromotionListView, PromotionCreateView, PromotionUpdateView, PromotionDeleteView,call_staff_api, cancel_order_api, check_low_stock_api,
     get_aov_api, get_cancellation_rate_api,
-    get_staff_calls_api, acknowledge_staff_call_api, complete_staff_call_api
+    get_staff_calls_api, acknowledge_staff_call_api, complete_staff_call_api,
+    rag_reindex_status_api, similar_products_api, also_bought_api, ai_pitch_api,
+    clear_conversation_api, ai_route_stats_api
 )
 
 
@@ -123,7 +125,12 @@ urlpatterns = [
     
     # Chat API
     path('api/chat/', chat_with_ai, name='api_chat'),
+    path('api/chat/clear/', clear_conversation_api, name='api_chat_clear'),
     path('api/recommendation/', get_product_recommendation, name='api_recommendation'),
+    path('api/products/<int:product_id>/similar/', similar_products_api, name='api_similar_products'),
+    path('api/products/<int:product_id>/also-bought/', also_bought_api, name='api_also_bought'),
+    path('api/ai/pitch/', ai_pitch_api, name='api_ai_pitch'),
+    path('api/ai/route-stats/', ai_route_stats_api, name='api_ai_route_stats'),
     path('api/voice-order/', voice_order_api, name='api_voice_order'),
     path('api/cart/', cart_api, name='api_cart'),
     
@@ -137,4 +144,5 @@ urlpatterns = [
     path('api/inventory/check-low-stock/', check_low_stock_api, name='api_check_low_stock'),
     path('api/analytics/aov/', get_aov_api, name='api_get_aov'),
     path('api/analytics/cancellation-rate/', get_cancellation_rate_api, name='api_get_cancellation_rate'),
+    path('api/rag/reindex-status/', rag_reindex_status_api, name='api_rag_reindex_status'),
 ]
\ No newline at end of file
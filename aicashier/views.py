@@ -5,7 +5,7 @@ import os
 import logging
 from django.contrib.auth.decorators import user_passes_test
 from django.utils.decorators import method_decorator
-from django.db import models
+from django.db import connection, models
 from .forms import ProductForm, AISettingsForm, CustomerUpdateForm, PromotionForm
 from django.shortcuts import render,redirect, get_object_or_404
 from django.urls import reverse, reverse_lazy
@@ -16,6 +16,8 @@ from django.contrib import messages
 from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 import json
+import threading
+import time
 import uuid
 from .models import Customer, Product, AISettings, Category, Payment, Order, Promotion
 from aicashier.models import OrderItem
@@ -24,6 +26,15 @@ from django.contrib.auth import authenticate, logout
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from .rag_service import rag_service
+from .rag_sync_queue import bulk_rag_sync
+from .answer_cache import find_answer, get_pitch
+from .chat_log import log_interaction
+from .conversation_store import conversation_store, get_conversation_key
+from .intent_router import route_query
+from .rate_limit import check_rate_limit, rate_limit
+from .deadline import Deadline, DeadlineExceeded, get_miss_counts
+from .circuit_breaker import CircuitOpenError, llm_breaker
+from .llm_scheduler import BUSY_MESSAGE, CART, CHAT, RECOMMEND, LLMOverloaded, llm_scheduler
 from django.db.models import Sum, Count, Avg, F
 from datetime import timedelta
 from django.contrib.auth.mixins import UserPassesTestMixin
@@ -32,13 +43,18 @@ from .services import (
     StaffCallService,
     OrderCancellationService,
     InventoryService,
-    OrderAnalyticsService
+    OrderAnalyticsService,
+    CheckoutService,
+    InsufficientStock
 )
 
 
 # Setup logger
 logger = logging.getLogger(__name__)
 
+# จำนวนสินค้าขั้นต่ำจาก co-purchase ก่อนจะ fallback ไปใช้ LLM
+MIN_COPURCHASE_RESULTS = 3
+
 # Initialize Stripe Service
 stripe_service = None
 try:
@@ -186,44 +202,13 @@ class ProductCreateView(CreateView):
             product_code = self._generate_product_code()
             form.instance.product_code = product_code
         
-        response = super().form_valid(form)
-        
-        # เพิ่มสินค้าเข้า RAG system
-        try:
-            if rag_service:
-                product = self.object
-                rag_service.add_product_to_rag(
-                    product_id=product.id,
-                    product_name=product.name,
-                    description=product.description or "",
-                    price=float(product.price),
-                    category=product.category.name if product.category else "ไม่มีหมวด"
-                )
-        except Exception as e:
-            print(f"Warning: Could not add product to RAG: {e}")
-        
-        return response
+        # signal ของ Product จะใส่สินค้าเข้าคิว sync RAG ให้หลัง commit
+        return super().form_valid(form)
     
     def _generate_product_code(self):
         """สร้างรหัสสินค้าอัตโนมัติ: P + 4 ตัวเลข"""
-        # หารหัสสินค้าสูงสุด
-        last_product = Product.objects.filter(
-            product_code__startswith='P'
-        ).order_by('-product_code').first()
-        
-        if last_product and last_product.product_code:
-            try:
-                # แยกเลขออกมา
-                last_code = last_product.product_code
-                last_number = int(last_code[1:])  # ลบ 'P' ตัวแรก
-                next_number = last_number + 1
-            except (ValueError, IndexError):
-                next_number = 1
-        else:
-            next_number = 1
-        
-        # สร้างรหัสใหม่ 2 ตัวอักษร (P) + 4 ตัวเลข
-        return f"P{str(next_number).zfill(4)}"
+        from .product_import import allocate_product_codes
+        return allocate_product_codes(1)[0]
 
 @method_decorator(user_passes_test(admin_required, login_url='login'), name='dispatch')
 class ProductUpdateView(UpdateView):
@@ -233,27 +218,8 @@ class ProductUpdateView(UpdateView):
     success_url = reverse_lazy('product_manage')
     
     def form_valid(self, form):
-        response = super().form_valid(form)
-        
-        # อัพเดตสินค้าใน RAG system (ลบเก่า + เพิ่มใหม่)
-        try:
-            from .rag_service import rag_service
-            if rag_service:
-                product = self.object
-                # ลบของเก่า
-                rag_service.delete_product_from_rag(product.id)
-                # เพิ่มของใหม่
-                rag_service.add_product_to_rag(
-                    product_id=product.id,
-                    product_name=product.name,
-                    description=product.description or "",
-                    price=float(product.price),
-                    category=product.category.name if product.category else "ไม่มีหมวด"
-                )
-        except Exception as e:
-            print(f"Warning: Could not update product in RAG: {e}")
-        
-        return response
+        # signal ของ Product จะใส่สินค้าเข้าคิว sync RAG ให้หลัง commit
+        return super().form_valid(form)
 
 @method_decorator(user_passes_test(admin_required, login_url='login'), name='dispatch')
 class ProductDeleteView(DeleteView):
@@ -261,18 +227,7 @@ class ProductDeleteView(DeleteView):
     template_name = 'aicashier/product/product_confirm_delete.html'
     success_url = reverse_lazy('product_manage')
     
-    def delete(self, request, *args, **kwargs):
-        product = self.get_object()
-        
-        # ลบสินค้าออกจาก RAG system
-        try:
-            from .rag_service import rag_service
-            if rag_service:
-                rag_service.delete_product_from_rag(product.id)
-        except Exception as e:
-            print(f"Warning: Could not delete product from RAG: {e}")
-        
-        return super().delete(request, *args, **kwargs)
+    # การลบออกจาก RAG ทำผ่าน post_delete signal (rag_sync_queue)
 
 @method_decorator(user_passes_test(admin_required, login_url='login'), name='dispatch')
 class OverviewsView(LoginRequiredMixin, ListView):
@@ -403,6 +358,7 @@ class OverviewsView(LoginRequiredMixin, ListView):
         # ดึงข้อมูลวิเคราะห์เฉพาะ staff เท่านั้น
         aov_data = {}
         cancellation_data = {}
+        top_queries_data = {}
         
         if self.request.user.is_staff:
             # Average Order Value (30 days)
@@ -410,6 +366,9 @@ class OverviewsView(LoginRequiredMixin, ListView):
             
             # Cancellation Rate (30 days)
             cancellation_data = OrderAnalyticsService.get_cancellation_rate(days=30)
+            
+            # กลุ่มคำถามยอดนิยม (คำนวณไว้ล่วงหน้าโดย cluster_queries)
+            top_queries_data = OrderAnalyticsService.get_top_user_queries(limit=5, days=30)
         
         context.update({
             'stats': stats,
@@ -425,6 +384,7 @@ class OverviewsView(LoginRequiredMixin, ListView):
             # New analytics
             'aov_data': aov_data,
             'cancellation_data': cancellation_data,
+            'top_queries_data': top_queries_data,
         })
         
         return context
@@ -759,8 +719,9 @@ class CategoryUpdateView(UpdateView):
     template_name = 'aicashier/product/category_form.html'
     success_url = reverse_lazy('manage_category')
     
+    @bulk_rag_sync()
     def post(self, request, *args, **kwargs):
-        # ประมวลผล POST data
+        # ประมวลผล POST data (สินค้าที่ย้ายหมวดจะ sync RAG ครั้งเดียวตอนจบ request)
         self.object = self.get_object()
         
         # อัปเดตข้อมูลพื้นฐาน
@@ -1045,43 +1006,20 @@ class PaymentSuccessView(DetailView):
         payment_order_key = f'payment_{payment.id}_orders'
         order_ids = self.request.session.get(payment_order_key, [])
         
+        # สต็อกไม่พอไปแล้วครั้งหนึ่ง - reload หน้าไม่ต้องลองตัดสต็อก / เรียกพนักงานซ้ำ
+        checkout_error_key = f'payment_{payment.id}_checkout_error'
+        checkout_error = self.request.session.get(checkout_error_key)
+        
+        if checkout_error:
+            context['checkout_error'] = checkout_error
         # ถ้ายังไม่มี orders สำหรับการชำระเงินนี้ ให้สร้าง
-        if cart_items and not order_ids:
+        elif cart_items and not order_ids:
             try:
-                from aicashier.models import OrderItem
-                
                 # กำหนด order_type: counter หรือ online
                 order_type = 'counter' if self.request.user.is_staff else 'online'
                 
-                # คำนวณ total amount
-                total_amount = sum(item['price'] * item['quantity'] for item in cart_items)
-                
-                # สร้างออเดอร์หลัก 1 ออเดอร์สำหรับชุดสินค้า
-                order = Order.objects.create(
-                    customer=self.request.user,
-                    total_price=total_amount,
-                    status='pending',
-                    order_type=order_type,
-                    order_number=Order.get_next_order_number()
-                )
-                
-                # สร้าง OrderItem สำหรับแต่ละสินค้า
-                for item in cart_items:
-                    product = Product.objects.get(id=item['product_id'])
-                    OrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        quantity=item['quantity'],
-                        price=item['price'],
-                        subtotal=item['price'] * item['quantity']
-                    )
-                    
-                    # ลดสต็อกสินค้า
-                    product.quantity -= item['quantity']
-                    if product.quantity < 0:
-                        product.quantity = 0
-                    product.save()
-                    logger.info(f"Updated {product.name} stock: -{item['quantity']} → {product.quantity} remaining")
+                # สร้างออเดอร์ + รายการสินค้า + ลดสต็อก ใน transaction เดียว
+                order = CheckoutService.create_order_from_cart(self.request.user, cart_items, order_type)
                 
                 order_ids = [order.id]
                 
@@ -1091,6 +1029,16 @@ class PaymentSuccessView(DetailView):
                 # ล้างตะกร้า
                 self.request.session['cart'] = []
                 self.request.session.modified = True
+            except InsufficientStock as e:
+                # ไม่สร้างออเดอร์ (ไม่มีอะไรถูกบันทึก) เก็บตะกร้าไว้ให้พนักงานจัดการต่อ
+                logger.error(f"Payment {payment.id}: {e}")
+                context['checkout_error'] = (
+                    f"ขออภัยครับ สินค้า {', '.join(e.product_names)} ไม่พอ "
+                    f"กรุณาติดต่อพนักงานเพื่อเปลี่ยนสินค้าหรือคืนเงิน"
+                )
+                self.request.session[checkout_error_key] = context['checkout_error']
+                self.request.session.modified = True
+                StaffCallService.call_staff(self.request.user, reason=f"สต็อกไม่พอหลังชำระเงิน (payment #{payment.id})")
             except Exception as e:
                 logger.error(f"Error creating orders: {e}")
         
@@ -1299,7 +1247,9 @@ class SetPaymentAmountView(LoginRequiredMixin, View):
 # ===== Chat API Endpoint =====
 @csrf_exempt
 @require_http_methods(["POST"])
+@rate_limit('cart')
 def chat_with_ai(request):
+    started = time.perf_counter()
    
     try:
 
@@ -1311,7 +1261,6 @@ def chat_with_ai(request):
         
         data = json.loads(request.body)
         user_message = data.get('message', '').strip()
-        conversation_history = data.get('conversation_history', [])
         
         if not user_message:
             return JsonResponse({
@@ -1319,15 +1268,64 @@ def chat_with_ai(request):
                 'error': 'Message cannot be empty'
             }, status=400)
         
-        # Debug: log conversation history
+        # ประวัติการสนทนาเก็บฝั่ง server (conversation_history จาก client ใช้แค่ตั้งต้นให้ client เก่า)
+        conversation_key = get_conversation_key(request)
+        conversation_summary, conversation_history = conversation_store.get_context(
+            conversation_key, seed_history=data.get('conversation_history')
+        )
+        
         print(f"[CHAT]  Received message: {user_message[:50]}...")
-        print(f"[CHAT]  Conversation history: {len(conversation_history)} messages")
-        if conversation_history:
-            for i, item in enumerate(conversation_history[-50:]):  # Show last 3 messages
-                print(f"  [{i}] {item.get('role')}: {item.get('content', '')[:50]}...")
+        print(f"[CHAT]  Conversation history: {len(conversation_history)} messages, summary={bool(conversation_summary)}")
+        
+        # ถามราคา / สต็อก / รายการสินค้า -> ตอบจากฐานข้อมูลโดยตรง ไม่ต้องผ่าน RAG + LLM
+        routed = route_query(user_message)
+        if routed:
+            print(f"[CHAT]  Fast path: {routed['intent']}")
+            conversation_store.append(conversation_key, user_message, routed['answer'])
+            log_interaction(
+                request, 'chat', user_message, routed['answer'], started,
+                source='fast_path', intent=routed['intent']
+            )
+            return JsonResponse({
+                'success': True,
+                'message': routed['answer'],
+                'fast_path': True
+            })
+        
+        # คำถามแรกของบทสนทนาที่ตรงกับคำถามยอดฮิต -> ตอบจากคำตอบที่สร้างไว้ล่วงหน้า ไม่ต้องเรียก LLM
+        if not conversation_history and not conversation_summary:
+            cached_answer = find_answer(user_message, rag_service.embeddings)
+            if cached_answer:
+                print(f"[CHAT]  Served pregenerated answer")
+                conversation_store.append(conversation_key, user_message, cached_answer)
+                log_interaction(request, 'chat', user_message, cached_answer, started, source='pregenerated')
+                return JsonResponse({
+                    'success': True,
+                    'message': cached_answer,
+                    'cached': True
+                })
+        
+        # fast path / คำตอบสำเร็จรูปใช้ bucket cart - นับ llm เฉพาะตอนจะเรียก LLM จริง
+        limited = check_rate_limit(request, 'llm')
+        if limited is not None:
+            return limited
         
         # ใช้ RAG query เพื่อตอบคำถามจากข้อมูลสินค้าจริง พร้อมประวัติการสนทนา
-        response_text = rag_service.rag_query(user_message, conversation_history)
+        timings = {}
+        response_text = rag_service.rag_query(
+            user_message, conversation_history, timings=timings, conversation_summary=conversation_summary,
+            conversation_key=conversation_key
+        )
+        conversation_store.append(conversation_key, user_message, response_text)
+        if timings.pop('llm_fallback', False):
+            source = 'fallback'
+        elif timings.pop('llm_shed', False):
+            source = 'shed'
+        elif str(response_text).startswith('เกิดข้อผิดพลาด'):
+            source = 'error'
+        else:
+            source = 'llm'
+        log_interaction(request, 'chat', user_message, response_text, started, timings, source=source)
         
         return JsonResponse({
             'success': True,
@@ -1349,34 +1347,81 @@ def chat_with_ai(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
+def clear_conversation_api(request):
+    """ล้างประวัติการสนทนาของ session นี้"""
+    if request.session.session_key:
+        conversation_store.clear(request.session.session_key)
+    return JsonResponse({'success': True})
+
+@require_http_methods(["GET"])
+def ai_pitch_api(request):
+    """คำทักทาย / แนะนำสินค้าเด่นที่สร้างไว้ล่วงหน้า (message เป็น null ถ้ายังไม่มีหรือหมดอายุ)"""
+    return JsonResponse({
+        'success': True,
+        'message': get_pitch()
+    })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@rate_limit('llm')
 def get_product_recommendation(request):
-   
+    """แนะนำสินค้า - ถ้าส่ง product_ids (สินค้าในตะกร้า) มาจะใช้ประวัติการซื้อร่วมกันก่อน
+    เรียก LLM เฉพาะเมื่อประวัติไม่พอ หรือมีแค่ข้อความความต้องการ
+    """
     try:
+        data = json.loads(request.body)
+        customer_needs = data.get('needs', '').strip()
+        product_ids = [int(pid) for pid in data.get('product_ids', []) if str(pid).isdigit()]
+        
+        if not customer_needs and not product_ids:
+            return JsonResponse({
+                'success': False,
+                'error': 'Needs cannot be empty'
+            }, status=400)
+        
+        # 1. "ลูกค้าที่ซื้อสินค้านี้มักซื้อด้วย" จากตารางที่คำนวณไว้ (ไม่ต้องเรียก LLM)
+        if product_ids:
+            from .recommendation_service import recommend_for_cart, serialize_neighbors
+            items = serialize_neighbors(recommend_for_cart(product_ids, limit=10), in_stock_only=True)[:5]
+            if len(items) >= MIN_COPURCHASE_RESULTS:
+                names = ", ".join(item['name'] for item in items)
+                return JsonResponse({
+                    'success': True,
+                    'source': 'copurchase',
+                    'items': items,
+                    'recommendation': f"ลูกค้าที่ซื้อสินค้าเหล่านี้มักซื้อ {names} ด้วย"
+                })
         
+        # 2. ประวัติไม่พอ - ใช้ RAG + LLM
         if not rag_service:
             return JsonResponse({
                 'success': False,
                 'error': 'RAG service is not available'
             }, status=503)
         
-        data = json.loads(request.body)
-        customer_needs = data.get('needs', '').strip()
-        
         if not customer_needs:
-            return JsonResponse({
-                'success': False,
-                'error': 'Needs cannot be empty'
-            }, status=400)
+            names = ", ".join(Product.objects.filter(id__in=product_ids).values_list('name', flat=True))
+            customer_needs = f"สินค้าที่เข้ากับ {names}"
         
         # ใช้ RAG query เพื่อค้นหาและแนะนำสินค้า
         # จะค้นหาเฉพาะสินค้าที่มีอยู่จริงในระบบ
+        timings = {}
         recommendation = rag_service.rag_query(
             f"โปรดแนะนำสินค้าสำหรับ: {customer_needs}",
-            conversation_history=[]
+            conversation_history=[],
+            timings=timings,
+            priority=RECOMMEND
         )
         
+        if timings.get('llm_fallback'):
+            source = 'fallback'
+        elif timings.get('llm_shed'):
+            source = 'shed'
+        else:
+            source = 'llm'
         return JsonResponse({
             'success': True,
+            'source': source,
             'recommendation': recommendation
         })
     
@@ -1395,10 +1440,57 @@ def get_product_recommendation(request):
 
 
 
+@require_http_methods(["GET"])
+def similar_products_api(request, product_id):
+    """สินค้าคล้ายกัน (คำนวณไว้ล่วงหน้า) - ใช้เสนอสินค้าทดแทนเมื่อของหมด โดยไม่ต้องเรียก LLM"""
+    from .recommendation_service import SIMILAR, get_neighbors, serialize_neighbors
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 5)), 20))
+        in_stock_only = request.GET.get('in_stock', '1') != '0'
+        items = serialize_neighbors(get_neighbors(product_id, SIMILAR), in_stock_only=in_stock_only)
+        return JsonResponse({
+            'success': True,
+            'product_id': product_id,
+            'items': items[:limit]
+        })
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid limit'}, status=400)
+    except Exception as e:
+        logger.error(f"Similar products API error: {e}")
+        return JsonResponse({'success': False, 'error': f'Error: {str(e)}'}, status=500)
+
+
+@require_http_methods(["GET"])
+def also_bought_api(request, product_id):
+    """ลูกค้าที่ซื้อสินค้านี้มักซื้อด้วย (จากประวัติออเดอร์ คำนวณไว้ล่วงหน้า)"""
+    from .recommendation_service import COPURCHASE, get_neighbors, serialize_neighbors
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 5)), 20))
+        items = serialize_neighbors(get_neighbors(product_id, COPURCHASE), in_stock_only=True)
+        return JsonResponse({
+            'success': True,
+            'product_id': product_id,
+            'items': items[:limit]
+        })
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid limit'}, status=400)
+    except Exception as e:
+        logger.error(f"Also-bought API error: {e}")
+        return JsonResponse({'success': False, 'error': f'Error: {str(e)}'}, status=500)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
+@rate_limit('cart')
 def voice_order_api(request):
     ai_response = "ขอโทษค่ะ ฉันไม่สามารถประมวลผลคำสั่งของคุณได้ในขณะนี้"
+    started = time.perf_counter()
+    timings = {}
+    # ทุกขั้นใน pipeline ใช้ deadline เดียวกัน - LLM ตอบไม่ทันก็ยังตอบผลของตะกร้าได้
+    deadline = Deadline(timings=timings)
+    timed_out = False
+    llm_fallback = False
+    shed = False
    
     try:
         if not rag_service:
@@ -1409,7 +1501,6 @@ def voice_order_api(request):
         
         data = json.loads(request.body)
         user_message = data.get('user_message', '').strip()
-        conversation_history = data.get('conversation_history', [])
         
         if not user_message:
             return JsonResponse({
@@ -1417,64 +1508,111 @@ def voice_order_api(request):
                 'error': 'Message cannot be empty'
             }, status=400)
         
-        print(f"[VOICE]  Received: {user_message[:50]}...")
-        print(f"[VOICE]  Conversation history: {len(conversation_history)} messages")
+        conversation_key = get_conversation_key(request)
+        conversation_summary, conversation_history = conversation_store.get_context(
+            conversation_key, seed_history=data.get('conversation_history')
+        )
         
-        # ตรวจสอบว่ากำลังสั่งซื้อหรือแค่ถามคำถาม (ดึงจาก AISettings database)
-        # รวมคำสั่งจาก voice_commands_add, voice_commands_decrease, voice_commands_delete
-        try:
-            ai_settings = AISettings.get_settings()
-            order_keywords = []
-            
-            # รวมทุกประเภทคำสั่ง
-            if ai_settings.voice_commands_add:
-                order_keywords.extend(ai_settings.voice_commands_add.split('|'))
-            if ai_settings.voice_commands_decrease:
-                order_keywords.extend(ai_settings.voice_commands_decrease.split('|'))
-            if ai_settings.voice_commands_delete:
-                order_keywords.extend(ai_settings.voice_commands_delete.split('|'))
-            
-            # Normalize: lowercase, strip whitespace
-            order_keywords = [kw.strip().lower() for kw in order_keywords if kw.strip()]
-            print(f"[VOICE] Order keywords from DB: {order_keywords}")
-        except Exception as e:
-            print(f"[VOICE] Error loading keywords from DB: {e}, using defaults")
-            # Fallback หากดึงจาก DB ล้มเหลว
+        print(f"[VOICE]  Received: {user_message[:50]}...")
+        print(f"[VOICE]  Conversation history: {len(conversation_history)} messages, summary={bool(conversation_summary)}")
+        
+        # ตรวจสอบว่ากำลังสั่งซื้อหรือแค่ถามคำถาม
+        # ใช้คำสั่งเสียงที่ RAG service โหลดไว้แล้ว (signal ของ AISettings reload ให้) ไม่ต้อง query DB ทุกครั้ง
+        voice_commands = getattr(rag_service, 'voice_commands', None) or {}
+        order_keywords = [
+            kw.strip().lower()
+            for action in ('add', 'decrease', 'delete')
+            for kw in voice_commands.get(action, [])
+            if kw.strip()
+        ]
+        if not order_keywords:
+            print("[VOICE] Voice commands not loaded, using defaults")
             order_keywords = ["เพิ่ม", "สั่ง", "ซื้อ", "ให้", "ลง", "ใส่", "ลด", "ลบ", "เอาออก", "ถอด", "ลดลง", "ดาว"]
         
         # ตรวจสอบว่ามีคำสั่งใน message (compare lowercase)
         is_order = any(keyword in user_message.lower() for keyword in order_keywords)
         
+        # คำถามราคา / สต็อก / รายการสินค้า (ที่ไม่ใช่คำสั่งตะกร้า) ตอบจากฐานข้อมูลโดยตรง
+        routed = None if is_order else route_query(user_message)
+        
+        # เริ่ม retrieval + เตรียม prompt ใน thread pool ไปพร้อมกับจัดการตะกร้า
+        # (ถ้าตะกร้าตอบได้เลย ผลนี้จะถูกทิ้ง) - เวลาของขั้นนี้เก็บแยกไว้ รวมเข้า timings เฉพาะตอนใช้ผล
+        prepare = None
+        prepare_timings = {}
+        prepare_discarded = threading.Event()
+        if not routed:
+            def _prepare():
+                try:
+                    # ผลถูกทิ้งแล้ว - ไม่ต้องบันทึก retrieval ทับของรอบก่อนในบทสนทนา
+                    return rag_service.build_prompt(
+                        user_message, conversation_history, conversation_summary, prepare_timings,
+                        conversation_key=conversation_key,
+                        still_needed=lambda: not prepare_discarded.is_set()
+                    )
+                finally:
+                    connection.close()
+            prepare = deadline.start('prepare_ms', _prepare)
+        
         cart_response = None
         
         # ถ้าดูเหมือนเป็นการจัดการตะกร้า ลองใช้ voice_manage_cart
+        # ทำใน thread ของ request เพราะต้องแก้ session
         if is_order:
             try:
-                
-                if rag_service:
-                    cart_response = rag_service.voice_manage_cart(user_message, request)
-                    print(f"Cart response: {cart_response}")
+                cart_started = time.perf_counter()
+                cart_response = rag_service.voice_manage_cart(user_message, request)
+                deadline.record('cart_ms', cart_started)
+                print(f"Cart response: {cart_response}")
             except Exception as cart_error:
                 print(f"Cart Error: {cart_error}")
                 import traceback
                 traceback.print_exc()
         
-        # ลองใช้ RAG system ก่อน
         try:
             
-            if rag_service:
-                # ตรวจสอบว่ามีข้อมูลในฐานข้อมูล RAG หรือไม่
-                stats = rag_service.get_collection_stats()
-                if stats and stats['document_count'] > 0:
-                    # มีข้อมูล ใช้ RAG พร้อมส่ง conversation history
-                    ai_response = rag_service.rag_query(user_message, conversation_history=conversation_history)
-                else:
-                    # ไม่มีข้อมูล ใช้ normal response
-                    ai_response = "ขอโทษค่ะ ฉันไม่พบข้อมูลที่เกี่ยวข้องในระบบ แต่ฉันจะพยายามช่วยคุณเท่าที่ทำได้"
-                    print("[RAG] No documents in RAG collection")
+            if routed:
+                ai_response = routed['answer']
+                print(f"[VOICE]  Fast path: {routed['intent']}")
+            elif cart_response and cart_response.get('success'):
+                # ตะกร้าตอบได้แล้ว ไม่ต้องรอ LLM - ทิ้งงานเตรียม prompt ที่เริ่มไว้
+                prepare_discarded.set()
+                deadline.discard(prepare)
+                print("[VOICE]  Cart handled, skipping LLM")
             else:
-                ai_response = "ขอโทษค่ะ ฉันไม่สามารถเชื่อมต่อกับระบบ RAG ได้ในขณะนี้ แต่ฉันจะพยายามช่วยคุณเท่าที่ทำได้"
-                print("[RAG] RAG service not available")
+                try:
+                    prompt, answer = deadline.result(prepare)
+                    timings.update(prepare_timings)
+                except DeadlineExceeded:
+                    # retrieval ช้า - ใช้ผลที่ cache ไว้ / สินค้าที่มีของแทน
+                    prompt, answer = rag_service.build_prompt(
+                        user_message, conversation_history, conversation_summary, timings,
+                        docs=rag_service.fallback_docs(user_message)
+                    )
+                if answer is not None:
+                    ai_response = answer
+                else:
+                    # คำสั่งตะกร้า / คำตอบจากข้อมูลสินค้าใช้ bucket cart - นับ llm เฉพาะตอนเรียก LLM จริง
+                    limited = check_rate_limit(request, 'llm')
+                    if limited is not None:
+                        return limited
+                    try:
+                        # คำสั่งตะกร้าที่ต้องให้ LLM ช่วยตอบ ได้คิวก่อนคำถามทั่วไป
+                        ai_response = rag_service.generate_answer(
+                            prompt, timings, deadline, priority=CART if is_order else CHAT
+                        )
+                    except CircuitOpenError as circuit_error:
+                        # LLM ล่ม / โดน rate limit - ไม่ต้องรอ timeout ตอบจากข้อมูลที่มีแทน
+                        print(f"[VOICE]  {circuit_error} - using fallback answer")
+                        llm_fallback = True
+                        ai_response = rag_service.fallback_answer(user_message)
+                    except LLMOverloaded as overloaded:
+                        print(f"[VOICE]  {overloaded}")
+                        shed = True
+                        ai_response = BUSY_MESSAGE
+        except DeadlineExceeded as deadline_error:
+            print(f"[VOICE]  {deadline_error} - using template response")
+            timed_out = True
+            ai_response = "ขอโทษค่ะ ตอนนี้ระบบตอบช้ากว่าปกติ รบกวนถามอีกครั้ง หรือกดเรียกพนักงานได้เลยค่ะ"
         except Exception as rag_error:
             print(f"RAG Error (fallback to normal): {rag_error}")
             ai_response = "ขอโทษค่ะ ฉันมีปัญหาในการประมวลผลข้อมูลในขณะนี้ แต่ฉันจะพยายามช่วยคุณเท่าที่ทำได้"
@@ -1483,6 +1621,26 @@ def voice_order_api(request):
         if cart_response and cart_response.get('success'):
             ai_response = cart_response.get('message', ai_response)
         
+        conversation_store.append(conversation_key, user_message, ai_response)
+        if cart_response and cart_response.get('success'):
+            source = 'cart'
+        elif routed:
+            source = 'fast_path'
+        elif timed_out:
+            source = 'timeout'
+        elif llm_fallback:
+            source = 'fallback'
+        elif shed:
+            source = 'shed'
+        else:
+            source = 'llm'
+        log_interaction(
+            request, 'voice', user_message, ai_response, started, timings,
+            source=source,
+            cart_action=(cart_response or {}).get('action') or '',
+            intent=routed['intent'] if routed else ''
+        )
+        
        
         session_cart = request.session.get('cart', [])
         
@@ -1510,6 +1668,7 @@ def voice_order_api(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@rate_limit('cart')
 def cart_api(request):
 
     try:
@@ -2160,6 +2319,47 @@ def check_low_stock_api(request):
 
 
 
+@require_http_methods(["GET"])
+def rag_reindex_status_api(request):
+    """ความคืบหน้าของงาน reindex RAG เบื้องหลัง - Admin only"""
+    if not request.user.is_staff:
+        return JsonResponse({
+            'success': False,
+            'message': 'เฉพาะแอดมินเท่านั้น'
+        }, status=403)
+    
+    from .rag_reindex import get_reindex_progress
+    job_id = request.GET.get('job')
+    if job_id:
+        job = get_reindex_progress(job_id)
+        if job is None:
+            return JsonResponse({'success': False, 'message': 'ไม่พบงาน'}, status=404)
+        return JsonResponse({'success': True, 'job': job})
+    return JsonResponse({'success': True, 'jobs': get_reindex_progress()})
+
+
+@require_http_methods(["GET"])
+def ai_route_stats_api(request):
+    """สัดส่วนคำถามที่ตอบผ่าน fast path เทียบกับ LLM - Admin only"""
+    if not request.user.is_staff:
+        return JsonResponse({
+            'success': False,
+            'message': 'เฉพาะแอดมินเท่านั้น'
+        }, status=403)
+    
+    from .services import ChatAnalyticsService
+    try:
+        days = int(request.GET.get('days', 7))
+    except ValueError:
+        days = 7
+    stats = ChatAnalyticsService.get_route_stats(days=max(1, days))
+    # นับเฉพาะใน process นี้ตั้งแต่ start
+    stats['deadline_misses'] = get_miss_counts()
+    stats['llm_circuit'] = llm_breaker.stats()
+    stats['llm_queue'] = llm_scheduler.stats()
+    return JsonResponse(stats)
+
+
 @method_decorator(user_passes_test(admin_required, login_url='login'), name='dispatch')
 @require_http_methods(["GET"])
 def get_aov_api(request):
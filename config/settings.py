@@ -175,6 +175,43 @@ SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
 SESSION_COOKIE_SAMESITE = 'Lax'
 SESSION_SAVE_EVERY_REQUEST = True
 
+# AI Embedding Server (optional)
+# ถ้าตั้ง AI_EMBEDDING_SOCKET ไว้ web worker จะส่งงาน embedding/search ไปที่ process แยก
+# (python manage.py run_embedding_server) แทนการโหลดโมเดลในทุก worker
+AI_EMBEDDING_SOCKET = os.getenv('AI_EMBEDDING_SOCKET', '')
+AI_EMBEDDING_TIMEOUT = float(os.getenv('AI_EMBEDDING_TIMEOUT', '5'))
+
+# Snapshot ของ vector index (python manage.py rag_snapshot export/import)
+# ถ้า data/chroma ว่างตอน boot จะโหลดจากไฟล์นี้ก่อน แล้ว sync เฉพาะสินค้าที่เปลี่ยน
+AI_INDEX_SNAPSHOT = os.getenv('AI_INDEX_SNAPSHOT', str(BASE_DIR / 'data' / 'rag_snapshot.npz'))
+
+# Watermark ของ sync_ai --changed-since (เวลาที่ sync/verify ล่าสุด)
+AI_SYNC_WATERMARK = os.getenv('AI_SYNC_WATERMARK', str(BASE_DIR / 'data' / 'sync_ai_watermark.json'))
+
+# Cache ของ embedding (key = hash ของโมเดล + ข้อความ chunk) ตั้งเป็นค่าว่างเพื่อปิด
+AI_EMBEDDING_CACHE_DIR = os.getenv('AI_EMBEDDING_CACHE_DIR', str(BASE_DIR / 'data' / 'embedding_cache'))
+
+# เวลาสูงสุดต่อคำสั่งเสียง 1 ครั้ง (ms) - LLM ตอบไม่ทันจะใช้ข้อความสำเร็จรูปแทน
+AI_VOICE_DEADLINE_MS = int(os.getenv('AI_VOICE_DEADLINE_MS', '8000'))
+
+# Circuit breaker ของ LLM - เรียกช้าเกินนี้ (ms) นับเป็น slow call, วงจรเปิดแล้วรอกี่วินาทีก่อนลองใหม่
+AI_LLM_SLOW_CALL_MS = int(os.getenv('AI_LLM_SLOW_CALL_MS', '6000'))
+AI_LLM_CIRCUIT_OPEN_SECONDS = int(os.getenv('AI_LLM_CIRCUIT_OPEN_SECONDS', '30'))
+# เวลารอคำตอบจาก Gemini สูงสุด (วินาที) ต่อการเรียก 1 ครั้ง
+AI_LLM_TIMEOUT_SECONDS = float(os.getenv('AI_LLM_TIMEOUT_SECONDS', '20'))
+
+# จำนวนการเรียก LLM พร้อมกันสูงสุดต่อ process (แบ่งตามลำดับความสำคัญใน llm_scheduler)
+AI_LLM_MAX_CONCURRENT = int(os.getenv('AI_LLM_MAX_CONCURRENT', '4'))
+
+# Rate limit ต่อ client (user / session / IP) ของ API แชท เสียง แนะนำสินค้า (llm) และตะกร้า (cart)
+AI_RATE_LIMIT_ENABLED = os.getenv('AI_RATE_LIMIT_ENABLED', 'True') == 'True'
+# IP ของ reverse proxy ที่เชื่อถือได้ (คั่นด้วย ,) - เฉพาะ request จาก IP เหล่านี้ถึงจะใช้ X-Forwarded-For
+AI_RATE_LIMIT_TRUSTED_PROXIES = [ip.strip() for ip in os.getenv('AI_RATE_LIMIT_TRUSTED_PROXIES', '').split(',') if ip.strip()]
+AI_RATE_LIMITS = {
+    'llm': {'capacity': int(os.getenv('AI_RATE_LIMIT_LLM_BURST', '10')), 'per_minute': int(os.getenv('AI_RATE_LIMIT_LLM_PER_MINUTE', '10'))},
+    'cart': {'capacity': int(os.getenv('AI_RATE_LIMIT_CART_BURST', '30')), 'per_minute': int(os.getenv('AI_RATE_LIMIT_CART_PER_MINUTE', '120'))},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 